@@ -69,6 +69,8 @@ LOAD_ORDER = [
     'latextools_utils.tex_directives',
     'latextools_utils.ana_utils',
     'latextools_utils.bibcache',
+    'latextools_utils.build_log',
+    'latextools_utils.preamble_format',
 
     'latextools_plugin',
 
@@ -25,11 +25,15 @@ import os
 import re
 import subprocess
 import sys
+import time
 # This will work because makePDF.py puts the appropriate
 # builders directory in sys.path
 from pdfBuilder import PdfBuilder
 
 from latextools_utils.external_command import external_command, get_texpath
+from latextools_utils.preamble_format import (
+    FORMAT_ERROR_MESSAGES, get_preamble_format
+)
 
 # Standard LaTeX warning
 CITATIONS_REGEX = re.compile(
@@ -41,6 +45,12 @@ BIBLATEX_REGEX = re.compile(
 # \include
 FILE_WRITE_ERROR_REGEX = re.compile(
     r"! I can't write on file `(.*)/([^/']*)'")
+# Option to run a pass without producing the PDF
+DRAFT_MODE_OPTIONS = {
+    "pdflatex": u"-draftmode",
+    "lualatex": u"-draftmode",
+    "xelatex": u"-no-pdf"
+}
 
 
 # ----------------------------------------------------------------
@@ -57,6 +67,11 @@ class BasicBuilder(PdfBuilder):
         self.name = "Basic Builder"
         self.bibtex = self.builder_settings.get('bibtex', 'bibtex')
         self.display_log = self.builder_settings.get("display_log", False)
+        self.draft_mode = self.builder_settings.get("draft_mode", False)
+        self.draft_option = None
+        self._current_pass = None
+        self._full_pass_times = []
+        self._draft_pass_times = []
 
     def commands(self):
         # Print greeting
@@ -74,6 +89,9 @@ class BasicBuilder(PdfBuilder):
         if engine not in ['pdflatex', 'xelatex', 'lualatex']:
             engine = 'pdflatex'
 
+        if self.draft_mode:
+            self.draft_option = DRAFT_MODE_OPTIONS.get(engine)
+
         latex = [engine, u"-interaction=nonstopmode", u"-synctex=1"]
         biber = [u"biber"]
 
@@ -113,10 +131,46 @@ class BasicBuilder(PdfBuilder):
         ):
             self.make_directory(output_directory)
 
-        yield (latex, "running {0}...".format(engine))
+        # if enabled, load the preamble from a precompiled format, which
+        # is dumped again whenever the preamble changes
+        preamble_format = get_preamble_format(self, engine)
+        if preamble_format is not None and not preamble_format.up_to_date:
+            start_time = time.time()
+            yield (
+                preamble_format.dump_command(),
+                "dumping preamble format..."
+            )
+            self.display("done.\n")
+            self.log_output()
+
+            if not preamble_format.finish_dump(start_time):
+                self.display(
+                    "Could not dump the preamble format, "
+                    "building without it.\n"
+                )
+                preamble_format = None
+
+        if preamble_format is not None:
+            latex.insert(1, preamble_format.fmt_option)
+
+        yield self.run_latex(latex, engine)
         self.display("done.\n")
         self.log_output()
 
+        # the format may have been dumped by a different version of the
+        # engine, in which case we get rid of it
+        if preamble_format is not None and any(
+            message in self.out for message in FORMAT_ERROR_MESSAGES
+        ):
+            self.display(
+                "Could not load the preamble format, building without it.\n")
+            preamble_format.invalidate()
+            latex.remove(preamble_format.fmt_option)
+
+            yield self.run_latex(latex, engine)
+            self.display("done.\n")
+            self.log_output()
+
         if output_directory is not None:
             while True:
                 start = 0
@@ -137,7 +191,7 @@ class BasicBuilder(PdfBuilder):
                     else:
                         break
                 if added_directory:
-                    yield (latex, "running {0}...".format(engine))
+                    yield self.run_latex(latex, engine)
                     self.display("done.\n")
                     self.log_output()
                 else:
@@ -174,8 +228,10 @@ class BasicBuilder(PdfBuilder):
             self.display('done.\n')
             self.log_output()
 
+            # in draft mode, only the last of these passes has to produce
+            # the PDF
             for i in range(2):
-                yield (latex, "running {0}...".format(engine))
+                yield self.run_latex(latex, engine, draft=(i == 0))
                 self.display("done.\n")
                 self.log_output()
 
@@ -183,11 +239,61 @@ class BasicBuilder(PdfBuilder):
         # Do this at the end, so if there are also citations to resolve,
         # we may save one pdflatex run
         if "Rerun to get cross-references right." in self.out:
-            yield (latex, "running {0}...".format(engine))
+            yield self.run_latex(latex, engine)
             self.display("done.\n")
             self.log_output()
 
+        self.display_draft_mode_savings()
+
+    def run_latex(self, latex, engine, draft=False):
+        '''
+        returns the command to run a pass of the engine; if draft is True
+        and draft mode is enabled, the pass does not produce the PDF
+
+        the pass is timed until the next call to log_output()
+        '''
+        draft = draft and self.draft_option is not None
+        self._current_pass = (draft, time.time())
+
+        if draft:
+            return (
+                latex[:1] + [self.draft_option] + latex[1:],
+                "running {0} (draft mode)...".format(engine)
+            )
+
+        return (latex, "running {0}...".format(engine))
+
+    def display_draft_mode_savings(self):
+        if not self._draft_pass_times or not self._full_pass_times:
+            return
+
+        # estimate what the draft passes would have taken from the average
+        # time of the full passes
+        full_pass_time = (
+            sum(self._full_pass_times) / len(self._full_pass_times)
+        )
+        saved = (
+            full_pass_time * len(self._draft_pass_times) -
+            sum(self._draft_pass_times)
+        )
+        self.display(
+            "Draft mode: {0} of {1} passes ran without producing the PDF, "
+            "saving about {2:.1f}s.\n".format(
+                len(self._draft_pass_times),
+                len(self._draft_pass_times) + len(self._full_pass_times),
+                max(saved, 0)
+            )
+        )
+
     def log_output(self):
+        if self._current_pass is not None:
+            draft, start_time = self._current_pass
+            self._current_pass = None
+            if draft:
+                self._draft_pass_times.append(time.time() - start_time)
+            else:
+                self._full_pass_times.append(time.time() - start_time)
+
         if self.display_log:
             self.display("\nCommand results:\n")
             self.display(self.out)
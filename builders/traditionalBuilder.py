@@ -11,6 +11,11 @@ else:
 
 from pdfBuilder import PdfBuilder
 import shlex
+import time
+
+from latextools_utils.preamble_format import (
+	FORMAT_ERROR_MESSAGES, get_preamble_format
+)
 
 DEBUG = False
 
@@ -131,11 +136,46 @@ class TraditionalBuilder(PdfBuilder):
 				else:
 					cmd.append(u"-latexoption=" + option)
 
+		# if enabled, load the preamble from a precompiled format, which is
+		# dumped again whenever the preamble changes; we can only pass the
+		# format to the engine with latexmk
+		preamble_format = None
+		if latexmk and engine_used:
+			preamble_format = get_preamble_format(self, engine)
+		elif self.builder_settings.get("preamble_format", False):
+			self.display("Preamble formats are only supported with latexmk. ")
+
+		if preamble_format is not None and not preamble_format.up_to_date:
+			start_time = time.time()
+			yield (preamble_format.dump_command(), "Dumping preamble format... ")
+			self.display("done.\n")
+
+			if not preamble_format.finish_dump(start_time):
+				self.display("Could not dump the preamble format, building without it.\n")
+				preamble_format = None
+
+		if preamble_format is not None:
+			fmt_cmd = cmd + [u"-latexoption=" + preamble_format.fmt_option]
+		else:
+			fmt_cmd = cmd
+
 		# texify wants the .tex extension; latexmk doesn't care either way
-		yield (cmd + [self.tex_name], "Invoking " + cmd[0] + "... ")
+		yield (fmt_cmd + [self.tex_name], "Invoking " + cmd[0] + "... ")
 
 		self.display("done.\n")
 
+		# the format may have been dumped by a different version of the
+		# engine, in which case we get rid of it
+		if preamble_format is not None and any(
+			message in self.out for message in FORMAT_ERROR_MESSAGES
+		):
+			self.display("Could not load the preamble format, building without it.\n")
+			preamble_format.invalidate()
+
+			yield (cmd + [self.tex_name], "Invoking " + cmd[0] + "... ")
+
+			self.display("done.\n")
+
 		# This is for debugging purposes 
 		if self.display_log:
 			self.display("\nCommand results:\n")
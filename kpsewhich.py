@@ -1,46 +1,369 @@
 from __future__ import print_function
 
-import sublime
+import os
+import subprocess
+import threading
+import time
 import traceback
 
+import sublime
+
 if sublime.version() < '3000':
     _ST3 = False
+    from latextools_utils import cache, get_setting
     from latextools_utils.external_command import (
-        check_output, CalledProcessError
+        execute_command, get_texpath, CalledProcessError
     )
+    from latextools_utils.system import make_dirs
+    from latextools_utils.texmf import parse_ls_r_names
 else:
     _ST3 = True
+    from .latextools_utils import cache, get_setting
     from .latextools_utils.external_command import (
-        check_output, CalledProcessError
+        execute_command, get_texpath, CalledProcessError
     )
+    from .latextools_utils.system import make_dirs
+    from .latextools_utils.texmf import parse_ls_r_names
 
-__all__ = ['kpsewhich']
+__all__ = ['kpsewhich', 'kpsewhich_batch']
 
+# the results of kpsewhich are stored in a file in the global cache folder
+# until one of the ls-R databases or the environment of kpsewhich changes; as
+# there are no databases with MiKTeX, files which have not been found are
+# looked up again after this time in seconds
+_NEGATIVE_RESULT_LIFE_SPAN = 600
 
-def kpsewhich(filename, file_format=None, notify_user_on_error=False):
-    # build command
-    command = ['kpsewhich']
-    if file_format is not None:
-        command.append('-format=%s' % (file_format))
-    command.append(filename)
+# the maximal number of stored results; the oldest lookups are dropped first
+_MAX_RESULTS = 5000
+
+# the environment variables, which change the search paths of kpsewhich
+_ENVIRONMENT_VARIABLES = [
+    'TEXINPUTS', 'BIBINPUTS', 'BSTINPUTS', 'TEXMFHOME', 'TEXMFCNF'
+]
+
+# the minimal time in seconds between checking the ls-R databases for
+# changes
+_CHECK_DELAY = 10
+
+_RESULTS_FILE_NAME = 'kpsewhich_results'
+_RESULTS_FILE_VERSION = 3
+_results_file_lock = threading.Lock()
+
+_lock = threading.RLock()
+# (file_format, filename) -> (path or None, time of the lookup)
+_results = None
+# the environment and the ls-R databases with their mtime when the results
+# have been cached
+_signature = None
+# the working directory, texpath and search path variables of kpsewhich
+_environment = None
+_ls_r_files = None
+_last_check = 0
+# file_format -> search path
+_search_paths = {}
+
+
+def _run_kpsewhich(args):
+    '''
+    runs kpsewhich and returns its output; files that are not found are
+    omitted from the output
+    '''
+    returncode, stdout, stderr = execute_command(
+        ['kpsewhich'] + args, stderr=subprocess.PIPE)
+    # kpsewhich returns 1 if any of the files has not been found
+    if returncode not in (0, 1):
+        e = CalledProcessError(returncode, ['kpsewhich'] + args)
+        e.output = stderr
+        raise e
+    return stdout
+
+
+def _get_ls_r_files():
+    global _ls_r_files
+    if _ls_r_files is None:
+        try:
+            search_path = _run_kpsewhich(['--show-path=ls-R'])
+        except Exception:
+            search_path = ''
+
+        ls_r_files = []
+        for path in search_path.split(os.pathsep):
+            path = path.replace(u'!!', u'').rstrip('/')
+            if not path or path == '.':
+                continue
+            ls_r_file = os.path.join(os.path.normpath(path), 'ls-R')
+            if ls_r_file not in ls_r_files and os.path.isfile(ls_r_file):
+                ls_r_files.append(ls_r_file)
+        _ls_r_files = ls_r_files
+    return _ls_r_files
+
+
+def _get_environment():
+    # relative file names are looked up in the working directory
+    return (os.getcwd(), get_texpath()) + tuple(
+        os.environ.get(name) for name in _ENVIRONMENT_VARIABLES)
 
+
+def _get_signature():
+    # must be called with the lock
+    global _environment, _ls_r_files
+    environment = _get_environment()
+    if environment != _environment:
+        _environment = environment
+        _ls_r_files = None
+        _search_paths.clear()
+
+    signature = [environment]
+    for ls_r_file in _get_ls_r_files():
+        try:
+            signature.append((ls_r_file, os.path.getmtime(ls_r_file)))
+        except OSError:
+            pass
+    return tuple(signature)
+
+
+def _load_results():
+    # must be called with the lock
+    global _results, _signature, _last_check
+    now = time.time()
+    if _results is not None and now - _last_check < _CHECK_DELAY:
+        return
+    _last_check = now
+
+    signature = _get_signature()
+    if _results is None:
+        try:
+            with _results_file_lock:
+                with open(_get_results_file(), 'rb') as f:
+                    version, cached_signature, results = cache.pickle.load(f)
+            if (
+                version == _RESULTS_FILE_VERSION and
+                cached_signature == signature
+            ):
+                _results = results
+                _signature = signature
+                return
+        except Exception:
+            # missing or from an incompatible version
+            pass
+
+    # a package has been installed or removed or the environment changed
+    if _results is None or signature != _signature:
+        _results = {}
+        _signature = signature
+
+
+def _get_results_file():
+    return os.path.join(cache._global_cache_path(), _RESULTS_FILE_NAME)
+
+
+def _prune_results():
+    # must be called with the lock
+    now = time.time()
+    for key, (path, lookup_time) in list(_results.items()):
+        if path is None and now - lookup_time > _NEGATIVE_RESULT_LIFE_SPAN:
+            del _results[key]
+
+    if len(_results) > _MAX_RESULTS:
+        keys = sorted(_results, key=lambda key: _results[key][1])
+        for key in keys[:len(_results) - _MAX_RESULTS]:
+            del _results[key]
+
+
+def _save_results():
+    with _lock:
+        _prune_results()
+        data = (_RESULTS_FILE_VERSION, _signature, dict(_results))
+
+    results_file = _get_results_file()
     try:
-        return check_output(command)
-    except CalledProcessError as e:
-        if notify_user_on_error:
-            sublime.error_message(
-                'An error occurred while trying to run kpsewhich. '
-                'Files in your TEXINPUTS could not be accessed.'
-            )
-            if e.output:
-                print(e.output)
-            traceback.print_exc()
-    except OSError:
-        if notify_user_on_error:
-            sublime.error_message(
-                'Could not run kpsewhich. Please ensure that your texpath '
-                'setting is correct.'
+        make_dirs(os.path.dirname(results_file))
+        with _results_file_lock:
+            with open(results_file, 'wb') as f:
+                cache.pickle.dump(data, f, protocol=-1)
+    except Exception:
+        print(u'error while writing the results of kpsewhich')
+        traceback.print_exc()
+
+
+def _get_cached(key):
+    # must be called with the lock
+    try:
+        path, lookup_time = _results[key]
+    except KeyError:
+        raise cache.CacheMiss()
+
+    if path is None:
+        if time.time() - lookup_time > _NEGATIVE_RESULT_LIFE_SPAN:
+            raise cache.CacheMiss()
+    elif not os.path.exists(path):
+        raise cache.CacheMiss()
+    return path
+
+
+def _get_search_path(file_format):
+    try:
+        return _search_paths[file_format]
+    except KeyError:
+        pass
+    args = ['--show-path={0}'.format(file_format or 'tex')]
+    search_path = _run_kpsewhich(args)
+    _search_paths[file_format] = search_path
+    return search_path
+
+
+def _resolve_from_ls_r(filenames, file_format):
+    '''
+    looks up the files in the ls-R databases without running kpsewhich;
+    returns a dict of the files found
+    '''
+    try:
+        search_path = _get_search_path(file_format)
+    except Exception:
+        return {}
+
+    ls_r_files = _get_ls_r_files()
+    roots = [os.path.dirname(f) + os.sep for f in ls_r_files]
+
+    # the search path elements in order; all must be covered by a database
+    elements = []
+    for element in search_path.split(os.pathsep):
+        if not element or element == '.':
+            continue
+        recursive = element.endswith('//')
+        element = os.path.normpath(element.replace(u'!!', u''))
+        try:
+            ls_r_file = next(
+                f for f, root in zip(ls_r_files, roots)
+                if (element + os.sep).startswith(root)
             )
-            traceback.print_exc()
+        except StopIteration:
+            return {}
+        elements.append((element, recursive, parse_ls_r_names(ls_r_file)))
+
+    # like kpathsea, we use the first element of the search path containing
+    # the file and the first directory of that element in the database
+    found = {}
+    for filename in filenames:
+        for element, recursive, names in elements:
+            prefix = element + os.sep
+            directory = next((
+                directory for directory in names.get(filename, ())
+                if directory == element or
+                recursive and directory.startswith(prefix)
+            ), None)
+            if directory is not None:
+                found[filename] = os.path.join(directory, filename)
+                break
+    return found
+
+
+def _ends_with(path, filename):
+    return path == filename or path.endswith(os.sep + filename)
 
-    return None
+
+def _match_output(filenames, output):
+    '''
+    returns a dict mapping the filenames to their paths in the output of
+    kpsewhich and a list of the paths, which do not match any filename
+
+    each path ends with the filename, which may contain directories, e.g.
+    bibs/refs.bib; kpsewhich may add the default suffix of the format
+    '''
+    found = {}
+    unmatched = [p for p in output.splitlines() if p.strip()]
+    for filename in filenames:
+        normalized_filename = os.path.normcase(os.path.normpath(filename))
+        for path in unmatched:
+            normalized_path = os.path.normcase(os.path.normpath(path))
+            if (
+                _ends_with(normalized_path, normalized_filename) or
+                _ends_with(
+                    os.path.splitext(normalized_path)[0], normalized_filename)
+            ):
+                found[filename] = path
+                unmatched.remove(path)
+                break
+    return found, unmatched
+
+
+def kpsewhich_batch(filenames, file_format=None, notify_user_on_error=False):
+    '''
+    returns a dict mapping each of the filenames to its path or None if it
+    cannot be found
+
+    the results are cached and all filenames, which are not cached, are
+    looked up with one call to kpsewhich
+    '''
+    result = {}
+    missing = []
+    with _lock:
+        _load_results()
+        for filename in filenames:
+            try:
+                result[filename] = _get_cached((file_format, filename))
+            except cache.CacheMiss:
+                if filename not in missing:
+                    missing.append(filename)
+
+    if not missing:
+        return result
+
+    found = {}
+    if get_setting('kpsewhich_use_ls_r', False):
+        found = _resolve_from_ls_r(
+            [f for f in missing if os.path.splitext(f)[1]], file_format)
+
+    lookup = [f for f in missing if f not in found]
+    # if the output contains paths, which cannot be matched, the files not
+    # found may have been found under another name
+    cache_not_found = True
+    if lookup:
+        args = []
+        if file_format is not None:
+            args.append('-format=%s' % (file_format))
+        args.extend(lookup)
+
+        try:
+            matched, unmatched = _match_output(lookup, _run_kpsewhich(args))
+            found.update(matched)
+            cache_not_found = not unmatched
+        except CalledProcessError as e:
+            if notify_user_on_error:
+                sublime.error_message(
+                    'An error occurred while trying to run kpsewhich. '
+                    'Files in your TEXINPUTS could not be accessed.'
+                )
+                if e.output:
+                    print(e.output)
+                traceback.print_exc()
+            # do not cache the failure
+            for filename in missing:
+                result.setdefault(filename, found.get(filename))
+            return result
+        except OSError:
+            if notify_user_on_error:
+                sublime.error_message(
+                    'Could not run kpsewhich. Please ensure that your texpath '
+                    'setting is correct.'
+                )
+                traceback.print_exc()
+            for filename in missing:
+                result.setdefault(filename, found.get(filename))
+            return result
+
+    now = time.time()
+    with _lock:
+        for filename in missing:
+            path = found.get(filename)
+            if path is not None or cache_not_found:
+                _results[(file_format, filename)] = (path, now)
+            result[filename] = path
+    _save_results()
+
+    return result
+
+
+def kpsewhich(filename, file_format=None, notify_user_on_error=False):
+    return kpsewhich_batch(
+        [filename], file_format, notify_user_on_error)[filename]
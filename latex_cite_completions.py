@@ -26,10 +26,11 @@ if sublime.version() < '3000':
     # we are on ST2 and Python 2.X
     _ST3 = False
     import getTeXRoot
-    from kpsewhich import kpsewhich
+    from kpsewhich import kpsewhich_batch
     from latextools_utils import (
         analysis, bibformat, cache, get_setting
     )
+    from latextools_utils.completion_profiler import profile_stage
     from latextools_utils.internal_types import FillAllHelper
     from latextools_utils.six import strbase, reraise
     import latextools_plugin
@@ -40,9 +41,10 @@ else:
     from .latextools_utils import (
         analysis, bibformat, cache, get_setting
     )
+    from .latextools_utils.completion_profiler import profile_stage
     from .latextools_utils.six import strbase, reraise
     from . import latextools_plugin
-    from .kpsewhich import kpsewhich
+    from .kpsewhich import kpsewhich_batch
 
 import re
 
@@ -256,15 +258,25 @@ def find_bib_files(root):
 
         # extract absolute filepath for each bib file
         rootdir = os.path.dirname(root)
+        unresolved = []
         for res in resources:
             # We join with rootdir, the dir of the master file
             candidate_file = os.path.normpath(os.path.join(rootdir, res))
-            # if the file doesn't exist, search the default tex paths
-            if not os.path.exists(candidate_file):
-                candidate_file = kpsewhich(res, 'mlbib')
-
-            if candidate_file is not None and os.path.exists(candidate_file):
+            if os.path.exists(candidate_file):
                 result.append(candidate_file)
+            else:
+                unresolved.append(res)
+
+        # if the file doesn't exist, search the default tex paths
+        if unresolved:
+            for candidate_file in kpsewhich_batch(
+                unresolved, 'mlbib'
+            ).values():
+                if (
+                    candidate_file is not None and
+                    os.path.exists(candidate_file)
+                ):
+                    result.append(candidate_file)
 
         # remove duplicates
         return list(set(result))
@@ -425,7 +437,8 @@ class CiteFillAllHelper(FillAllHelper):
             return []
 
         try:
-            completions = get_cite_completions(view)
+            with profile_stage('fetch'):
+                completions = get_cite_completions(view)
         except NoBibFilesError:
             print("No bib files found!")
             sublime.status_message("No bib files found!")
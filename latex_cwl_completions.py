@@ -4,9 +4,11 @@ from __future__ import unicode_literals, print_function
 import sublime
 import sublime_plugin
 import glob
+import itertools
 import os
 import re
 import threading
+import traceback
 
 if sublime.version() < '3000':
     # we are on ST2 and Python 2.X
@@ -23,8 +25,9 @@ if sublime.version() < '3000':
     )
     from getRegion import getRegion
     from getTeXRoot import get_tex_root
-    from latextools_utils import get_setting, analysis, utils
+    from latextools_utils import get_setting, analysis, cache, utils
     from latextools_utils.parser_utils import command_to_snippet
+    from latextools_utils.system import make_dirs
 else:
     _ST3 = True
     from .latex_cite_completions import (
@@ -39,8 +42,9 @@ else:
     )
     from .getRegion import getRegion
     from .getTeXRoot import get_tex_root
-    from .latextools_utils import get_setting, analysis, utils
+    from .latextools_utils import get_setting, analysis, cache, utils
     from .latextools_utils.parser_utils import command_to_snippet
+    from .latextools_utils.system import make_dirs
 
 __all__ = ['get_cwl_completions', 'is_cwl_available']
 
@@ -75,6 +79,13 @@ CWL_COMPLETION_ENABLED = None
 # global instance of CwlCompletions class
 CWL_COMPLETIONS = None
 
+# the version of the database of parsed cwl files; increase it whenever the
+# parsing changes
+CWL_DATABASE_VERSION = 1
+
+# the maximal number of parsed cwl files kept in memory
+CWL_CACHE_SIZE = 100
+
 # KOMA-Script classes are all in one cwl file
 KOMA_SCRIPT_CLASSES = set(('class-scrartcl', 'class-scrreprt', 'class-book'))
 
@@ -95,122 +106,181 @@ def get_cwl_completions():
 class CwlCompletions(object):
     '''
     Completion manager that coordinates between between the event listener and
-    the thread that does the actual parsing. It also stores the completions
+    the threads that do the actual parsing. It also stores the completions
     once they have been parsed.
 
+    Only the cwl files of the packages used by the current document are
+    loaded. At most CWL_CACHE_SIZE parsed files are kept in memory; the
+    least recently used file is dropped first.
+
     N.B. This class should not be instantiated directly. It is intended to
     be used a single object stored in the CWL_COMPLETION value of this module
     '''
 
     def __init__(self):
-        self._started = False
-        self._completed = False
         self._triggered = False
-        self._completions = None
-        self._environment_completions = None
+        # cwl file name -> (completions, environment completions)
+        self._loaded = {}
+        # cwl file name -> the count of its last usage
+        self._last_used = {}
+        self._usage_count = itertools.count()
+        # the cwl file names which are currently loaded by a thread
+        self._loading = set()
+        # cwl file name -> path of all available cwl files
+        self._available = None
+        self._use_package = False
+        # (cwl file names, env) -> merged completions
+        self._merged = {}
         self._WLOCK = threading.RLock()
 
-    # get the completions
+    # get the completions; the result is shared between calls and must not
+    # be modified
     def get_completions(self, env=False):
-        with self._WLOCK:
-            if self._completed:
-                self._triggered = False
+        # the packages may require an analysis of the document, so they are
+        # collected without holding the lock
+        packages = self.get_packages()
+        if len(packages) == 0:
+            return []
 
-                cwl_files = []
-                packages = self.get_packages()
-                if len(packages) == 0:
-                    return []
-
-                for package in packages:
-                    if package.endswith('.cwl'):
-                        cwl_file = package
-                    else:
-                        cwl_file = '{0}.cwl'.format(package)
-
-                    # some hacks for particular packages that do not match
-                    # the standard pattern
-                    if package == 'polyglossia':
-                        cwl_file = 'babel.cwl'
-                    elif package in KOMA_SCRIPT_CLASSES:
-                        cwl_file = 'class-scrartcl,scrreprt,scrbook.cwl'
-
-                    if cwl_file not in cwl_files:
-                        cwl_files.append(cwl_file)
-
-                completions = []
-                if env:
-                    completion_dict = self._environment_completions
-                else:
-                    completion_dict = self._completions
+        cwl_files = tuple(self.get_cwl_file_names(packages))
 
+        with self._WLOCK:
+            try:
+                completions = self._merged[(cwl_files, env)]
+            except KeyError:
+                pass
+            else:
                 for cwl_file in cwl_files:
-                    try:
-                        completions.extend(completion_dict[cwl_file])
-                    except KeyError:
-                        # TODO - should we attempt to load the package?
-                        pass
+                    self._last_used[cwl_file] = next(self._usage_count)
                 return completions
-            else:
-                self._triggered = True
-                if not self._started:
-                    self.load_completions()
-                return []
 
-    # loads the list of currently specified cwl files
-    def get_packages(self):
-        packages = get_setting('cwl_list', [
+            completions = []
+            missing = []
+            for cwl_file in cwl_files:
+                try:
+                    completion_tuple = self._loaded[cwl_file]
+                except KeyError:
+                    missing.append(cwl_file)
+                    continue
+                self._last_used[cwl_file] = next(self._usage_count)
+                completions.extend(completion_tuple[1 if env else 0])
+
+            if missing:
+                self._triggered = True
+                self._load_cwl_files(missing)
+            else:
+                if len(self._merged) >= 20:
+                    self._merged = {}
+                self._merged[(cwl_files, env)] = completions
+            return completions
+
+    # maps the packages to the names of their cwl files
+    def get_cwl_file_names(self, packages):
+        cwl_files = []
+        for package in packages:
+            if package.endswith('.cwl'):
+                cwl_file = package
+            else:
+                cwl_file = '{0}.cwl'.format(package)
+
+            # some hacks for particular packages that do not match
+            # the standard pattern
+            if package == 'polyglossia':
+                cwl_file = 'babel.cwl'
+            elif package in KOMA_SCRIPT_CLASSES:
+                cwl_file = 'class-scrartcl,scrreprt,scrbook.cwl'
+
+            if cwl_file not in cwl_files:
+                cwl_files.append(cwl_file)
+
+        # packages without a cwl file are ignored once the available cwl
+        # files are known
+        if self._available is not None:
+            cwl_files = [f for f in cwl_files if f in self._available]
+
+        return cwl_files
+
+    # loads the list of currently specified cwl files; the packages of a
+    # document are stored in its local cache, so they are only collected
+    # again if it has been analyzed again
+    def get_packages(self, view=None):
+        packages = list(get_setting('cwl_list', [
             "latex-document.cwl",
             "tex.cwl",
             "latex-dev.cwl",
             "latex-209.cwl",
             "latex-l2tabu.cwl",
             "latex-mathsymbols.cwl"
-        ])
+        ]))
 
         # autoload packages by scanning the document
         if get_setting('cwl_autoload', True):
-            root = get_tex_root(sublime.active_window().active_view())
+            if view is None:
+                view = sublime.active_window().active_view()
+            root = get_tex_root(view)
             if root is not None:
-                doc = analysis.get_analysis(root)
-
-                # really, there should only be one documentclass
-                packages.extend([
-                    'class-{0}'.format(documentclass.args)
-                    for documentclass in doc.filter_commands(
-                        'documentclass',
-                        analysis.ONLY_PREAMBLE |
-                        analysis.ONLY_COMMANDS_WITH_ARGS
-                    )
-                ])
-
-                packages.extend([
-                    package.args for package in doc.filter_commands(
-                        'usepackage',
-                        analysis.ONLY_PREAMBLE |
-                        analysis.ONLY_COMMANDS_WITH_ARGS
-                    )
-                ])
-            # TODO - Attempt to read current buffer
+                packages.extend(cache.LocalCache(root).cache(
+                    'cwl_packages', lambda: _get_document_packages(root)))
+        # TODO - Attempt to read current buffer
 
         return packages
 
-    # loads all available completions on a new background thread
-    # set force to True to force completions to load regardless
-    # of whether they have already been loaded
-    def load_completions(self, force=False):
+    # loads the cwl files used by the document in the view (or the active
+    # view) on a background thread, so they are available once completions
+    # are requested
+    def load_completions(self, view=None):
+        def prefetch():
+            # the lock is only taken to start loading the files, so the
+            # analysis of the document does not block the completions
+            self._load_cwl_files(
+                self.get_cwl_file_names(self.get_packages(view)))
+
+        t = threading.Thread(target=prefetch)
+        t.daemon = True
+        t.start()
+
+    # starts a thread to load the cwl files, which are neither loaded nor
+    # currently loading
+    def _load_cwl_files(self, cwl_files):
         with self._WLOCK:
-            if self._started or (self._completed and not force):
+            cwl_files = [
+                f for f in cwl_files
+                if f not in self._loaded and f not in self._loading
+            ]
+            if not cwl_files:
                 return
+            self._loading.update(cwl_files)
 
-            self._started = True
-            t = threading.Thread(
-                target=cwl_parsing_handler,
-                args=(
-                    self._on_completions,
-                )
-            )
-            t.daemon = True
-            t.start()
+        t = threading.Thread(target=self._load_worker, args=(cwl_files,))
+        t.daemon = True
+        t.start()
+
+    def _load_worker(self, cwl_files):
+        try:
+            if self._available is None:
+                paths, use_package = get_cwl_package_files()
+                available = {}
+                for path in paths:
+                    available[os.path.basename(path)] = path
+                with self._WLOCK:
+                    self._available = available
+                    self._use_package = use_package
+
+            for cwl_file in cwl_files:
+                path = self._available.get(cwl_file)
+                result = None
+                if path is not None:
+                    try:
+                        result = load_cwl_file(path, self._use_package)
+                    except Exception:
+                        traceback.print_exc()
+                if result is None:
+                    # do not try to load it again
+                    result = ([], [])
+                self._on_completions(cwl_file, result)
+        finally:
+            with self._WLOCK:
+                self._loading.difference_update(cwl_files)
 
     # hack to display the autocompletions once they are available
     def _hack(self):
@@ -219,17 +289,25 @@ class CwlCompletions(object):
             sublime.active_window().active_view().run_command("auto_complete")
         sublime.set_timeout(hack2, 1)
 
-    # callback when completions are loaded
-    def _on_completions(self, completions, environment_completions):
+    # callback when the completions of a cwl file are loaded
+    def _on_completions(self, cwl_file, completion_tuple):
         with self._WLOCK:
-            self._completions = completions
-            self._environment_completions = environment_completions
-            self._started = False
-            self._completed = True
+            self._loaded[cwl_file] = completion_tuple
+            self._last_used[cwl_file] = next(self._usage_count)
+            # the merged completions may contain a dropped cwl file
+            self._merged = {}
+            while len(self._loaded) > CWL_CACHE_SIZE:
+                least_used = min(self._loaded, key=self._last_used.get)
+                del self._loaded[least_used]
+                del self._last_used[least_used]
+            self._loading.discard(cwl_file)
 
             # if the user has tried to summon autocompletions, reload
             # now that we have some
-            if self._triggered and len(self._completions) != 0:
+            if self._triggered and not self._loading and any(
+                completion_tuple
+            ):
+                self._triggered = False
                 sublime.set_timeout(self._hack, 0)
 
 
@@ -287,11 +365,15 @@ class LatexCwlCompletion(sublime_plugin.EventListener):
 
         # load the completions for the document
         if is_env:
-            completions = CWL_COMPLETIONS.get_completions(env=True).extend(
-                get_own_env_completion(view) or [])
+            completions = (
+                CWL_COMPLETIONS.get_completions(env=True) +
+                (get_own_env_completion(view) or [])
+            )
         else:
-            completions = CWL_COMPLETIONS.get_completions().extend(
-                get_own_command_completion(view) or [])
+            completions = (
+                CWL_COMPLETIONS.get_completions() +
+                (get_own_command_completion(view) or [])
+            )
 
         # autocompleting with slash already on line
         # this is necessary to work around a short-coming in ST where having a
@@ -324,7 +406,7 @@ class LatexCwlCompletion(sublime_plugin.EventListener):
         if not view.score_selector(0, "text.tex.latex"):
             return
 
-        CWL_COMPLETIONS.load_completions()
+        CWL_COMPLETIONS.load_completions(view)
 
     if not _ST3:
         on_activated = on_activated_async
@@ -392,55 +474,107 @@ def _check_if_cwl_enabled(view=None):
         g_settings.set("auto_complete_triggers", acts)
 
     # pre-load the completions
-    get_cwl_completions().load_completions()
+    get_cwl_completions().load_completions(view)
 
 
 # -- Internal Parsing API --
 
-# this is the function called by the CwlCompletions class to handle parsing
-# it loads every cwl in turn and returns a dictionary mapping from the
-# cwl file name to the set of parsed completions
-def cwl_parsing_handler(callback):
-    completion_results = {}
-    environment_results = {}
-    cwl_files, use_package = get_cwl_package_files()
-
-    for cwl_file in cwl_files:
-        base_name = os.path.basename(cwl_file)
-        if use_package:
-            try:
-                s = (sublime.load_resource(cwl_file).replace("\r\n", "\n")
-                     .replace("\r", "\n"))
-            except IOError:
-                print(
-                    u'{0} does not exist or could not be accessed'.format(
-                        cwl_file
-                    )
-                )
-                continue
-        else:
-            if not os.path.isabs(cwl_file) and cwl_file.startswith('Package'):
-                cwl_file = os.path.normpath(
-                    cwl_file.replace('Package', sublime.packages_path())
-                )
+# returns the classes and packages loaded by the document
+def _get_document_packages(root):
+    doc = analysis.get_analysis(root)
+    if doc is None:
+        return []
+
+    # really, there should only be one documentclass
+    packages = [
+        'class-{0}'.format(documentclass.args)
+        for documentclass in doc.filter_commands(
+            'documentclass',
+            analysis.ONLY_PREAMBLE |
+            analysis.ONLY_COMMANDS_WITH_ARGS
+        )
+    ]
 
-            try:
-                s = utils.read_file_unix_endings(cwl_file)
-            except IOError:
-                print(
-                    u'{0} does not exist or could not be accessed'.format(
-                        cwl_file
-                    )
-                )
-                continue
+    packages.extend([
+        package.args for package in doc.filter_commands(
+            'usepackage',
+            analysis.ONLY_PREAMBLE |
+            analysis.ONLY_COMMANDS_WITH_ARGS
+        )
+    ])
+    return packages
+
+
+def _read_cwl_file(cwl_file, use_package):
+    if use_package:
+        try:
+            return (sublime.load_resource(cwl_file).replace("\r\n", "\n")
+                    .replace("\r", "\n"))
+        except IOError:
+            pass
+    else:
+        if not os.path.isabs(cwl_file) and cwl_file.startswith('Package'):
+            cwl_file = os.path.normpath(
+                cwl_file.replace('Package', sublime.packages_path())
+            )
+
+        try:
+            return utils.read_file_unix_endings(cwl_file)
+        except IOError:
+            pass
+
+    print(u'{0} does not exist or could not be accessed'.format(cwl_file))
+    return None
+
+
+def _get_cwl_database_file(cwl_file):
+    return os.path.join(
+        cache._global_cache_path(), 'cwl', cache.hash_digest(cwl_file)
+    )
 
-        completions = parse_cwl_file(base_name, s)
-        completion_results[base_name] = completions
 
-        environments = parse_cwl_file(base_name, s, parse_line_as_environment)
-        environment_results[base_name] = environments
+# loads the parsed completions of a cwl file from the database in the
+# global cache; the file is only parsed if its content has changed since
+# it has been stored
+def load_cwl_file(cwl_file, use_package):
+    s = _read_cwl_file(cwl_file, use_package)
+    if s is None:
+        return None
+
+    content_hash = cache.hash_digest(s)
+    database_file = _get_cwl_database_file(cwl_file)
+    try:
+        with open(database_file, 'rb') as f:
+            version, path, file_hash, completions, environments = \
+                cache.pickle.load(f)
+        if (
+            version == CWL_DATABASE_VERSION and path == cwl_file and
+            file_hash == content_hash
+        ):
+            return completions, environments
+    except Exception:
+        # missing or from an incompatible version
+        pass
+
+    completions, environments = parse_cwl_file(
+        os.path.basename(cwl_file), s)
+
+    try:
+        make_dirs(os.path.dirname(database_file))
+        with open(database_file, 'wb') as f:
+            cache.pickle.dump(
+                (
+                    CWL_DATABASE_VERSION, cwl_file, content_hash,
+                    completions, environments
+                ),
+                f, protocol=-1
+            )
+    except Exception:
+        print(u'error while writing the cwl database for {0}'.format(
+            cwl_file))
+        traceback.print_exc()
 
-    callback(completion_results, environment_results)
+    return completions, environments
 
 
 # gets a list of all cwl package files available, whether in the
@@ -480,9 +614,11 @@ def parse_line_as_command(line):
     return command_to_snippet(line)
 
 
-# actually does the parsing of the cwl files
-def parse_cwl_file(cwl, s, parse_line=parse_line_as_command):
+# actually does the parsing of the cwl files; returns a tuple of the
+# command and the environment completions
+def parse_cwl_file(cwl, s):
     completions = []
+    environments = []
     method = os.path.splitext(cwl)[0]
 
     # we need some state tracking to ignore keyval data
@@ -514,19 +650,23 @@ def parse_cwl_file(cwl, s, parse_line=parse_line_as_command):
         # a # char
         line = line.rstrip()
 
-        result = parse_line(line)
-        if result is None:
-            continue
-        keyword, insertion = result
+        for parse_line, results in (
+            (parse_line_as_command, completions),
+            (parse_line_as_environment, environments)
+        ):
+            result = parse_line(line)
+            if result is None:
+                continue
+            keyword, insertion = result
 
-        # pad the keyword with spaces; this is to keep the size of the
-        # autocompletions consistent regardless of the returned results
-        keyword = keyword.ljust(50)
+            # pad the keyword with spaces; this is to keep the size of the
+            # autocompletions consistent regardless of the returned results
+            keyword = keyword.ljust(50)
 
-        item = (u'%s\t%s' % (keyword, method), insertion)
-        completions.append(item)
+            item = (u'%s\t%s' % (keyword, method), insertion)
+            results.append(item)
 
-    return completions
+    return completions, environments
 
 
 # ensure that CWL_COMPLETIONS has a value
@@ -6,6 +6,7 @@ try:
         get_cwl_completions, is_cwl_available, BEGIN_END_BEFORE_REGEX
     )
     from .latex_own_command_completions import get_own_env_completion
+    from .latextools_utils.completion_profiler import profile_stage
 except:
     _ST3 = False
     from latex_fill_all import FillAllHelper
@@ -14,6 +15,7 @@ except:
         get_cwl_completions, is_cwl_available, BEGIN_END_BEFORE_REGEX
     )
     from latex_own_command_completions import get_own_env_completion
+    from latextools_utils.completion_profiler import profile_stage
 
 
 class EnvFillAllHelper(FillAllHelper):
@@ -22,8 +24,9 @@ class EnvFillAllHelper(FillAllHelper):
         if not is_cwl_available():
             return
 
-        completions = get_cwl_completions().get_completions(env=True) + \
-            get_own_env_completion(view)
+        with profile_stage('fetch'):
+            completions = get_cwl_completions().get_completions(env=True) + \
+                get_own_env_completion(view)
 
         if prefix:
             completions = [c for c in completions if c[1].startswith(prefix)]
@@ -4,6 +4,7 @@ import sublime
 import sublime_plugin
 import re
 import sys
+import time
 import traceback
 
 if sublime.version() < '3000':
@@ -13,7 +14,7 @@ if sublime.version() < '3000':
     from latextools_plugin import (
         get_plugins_by_type, _classname_to_internal_name
     )
-    from latextools_utils import get_setting
+    from latextools_utils import completion_profiler, get_setting
     from latextools_utils.internal_types import FillAllHelper
 
     exec("""def reraise(tp, value, tb=None):
@@ -30,7 +31,7 @@ else:
     from .latextools_plugin import (
         get_plugins_by_type, _classname_to_internal_name
     )
-    from .latextools_utils import get_setting
+    from .latextools_utils import completion_profiler, get_setting
     from .latextools_utils.internal_types import FillAllHelper
 
     def reraise(tp, value, tb=None):
@@ -744,6 +745,15 @@ class LatexFillAllEventListener(
             if not view.score_selector(location, "text.tex.latex"):
                 return
 
+        # the timings are only recorded if the completion_profiling setting
+        # is enabled
+        record = completion_profiler.start_completion(prefix)
+        try:
+            return self._query_completions(view, prefix, locations, record)
+        finally:
+            completion_profiler.finish_completion(record)
+
+    def _query_completions(self, view, prefix, locations, record):
         completion_types = self.get_completion_types()
 
         orig_prefix = prefix
@@ -770,24 +780,33 @@ class LatexFillAllEventListener(
         completion_type = None
         for name in completion_types:
             ct = self.get_completion_type(name)
-            if (
-                fancy_prefixed_line is not None and
-                hasattr(ct, 'matches_fancy_prefix')
-            ):
-                if ct.matches_fancy_prefix(fancy_prefixed_line):
-                    line = fancy_prefixed_line
-                    prefix = fancy_prefix
-                    completion_type = ct
-                    break
+            match_start = time.time()
+            try:
+                if (
+                    fancy_prefixed_line is not None and
+                    hasattr(ct, 'matches_fancy_prefix')
+                ):
+                    if ct.matches_fancy_prefix(fancy_prefixed_line):
+                        line = fancy_prefixed_line
+                        prefix = fancy_prefix
+                        completion_type = ct
+                        break
+                    elif ct.matches_line(line):
+                        completion_type = ct
+                        remove_regions = []
+                        break
                 elif ct.matches_line(line):
                     completion_type = ct
+                    # reset fancy prefix
                     remove_regions = []
                     break
-            elif ct.matches_line(line):
-                completion_type = ct
-                # reset fancy prefix
-                remove_regions = []
-                break
+            finally:
+                if record is not None:
+                    record.match_times.append(
+                        (name, time.time() - match_start))
+
+        if record is not None and completion_type is not None:
+            record.helper = name
 
         if completion_type is None:
             self.clear_bracket_cache()
@@ -801,6 +820,7 @@ class LatexFillAllEventListener(
             self.clear_bracket_cache()
             return []
 
+        helper_start = time.time()
         try:
             completions = completion_type.get_auto_completions(
                 view, prefix, line[::-1]
@@ -809,6 +829,11 @@ class LatexFillAllEventListener(
             traceback.print_exc()
             self.clear_bracket_cache()
             return []
+        finally:
+            # everything after the helper is formatting
+            format_start = time.time()
+            if record is not None:
+                record.helper_time = format_start - helper_start
 
         if len(completions) == 0:
             self.clear_bracket_cache()
@@ -862,6 +887,10 @@ class LatexFillAllEventListener(
 
         self.clear_bracket_cache()
 
+        if record is not None:
+            record.results = len(completions)
+            record.add_stage('format', time.time() - format_start)
+
         return (
             zip(show, completions),
             sublime.INHIBIT_WORD_COMPLETIONS |
@@ -1198,3 +1227,31 @@ class LatexToolsFillAllCompleteBracket(
             self.view, edit, insert_char,
             self.tuples_to_regions(remove_regions)
         )
+
+
+class LatextoolsCompletionProfileCommand(sublime_plugin.WindowCommand):
+    '''
+    Shows the timings of the completions recorded if the
+    completion_profiling setting is enabled
+
+    :param clear:
+        if True, the recorded timings are discarded instead
+    '''
+
+    def run(self, clear=False):
+        if clear:
+            completion_profiler.clear()
+            sublime.status_message('Completion profile cleared')
+            return
+
+        new_view = self.window.new_file()
+        new_view.set_scratch(True)
+        new_view.settings().set('word_wrap', False)
+        new_view.settings().set('line_numbers', False)
+        new_view.settings().set('gutter', False)
+        new_view.set_name('LaTeXTools Completion Profile')
+        new_view.run_command(
+            'latextools_insert_text',
+            {'text': u'\n'.join(completion_profiler.get_report())}
+        )
+        new_view.set_read_only(True)
@@ -1,18 +1,21 @@
 import re
 
 import sublime
+import sublime_plugin
 
 
 _ST3 = sublime.version() >= "3000"
 
 if _ST3:
     from .latex_fill_all import FillAllHelper
-    from .latextools_utils import analysis, cache, get_setting
+    from .latextools_utils import get_setting, symbol_index
+    from .latextools_utils.completion_profiler import profile_stage
     from .latextools_utils.tex_directives import get_tex_root
 
 else:
     from latextools_utils.internal_types import FillAllHelper
-    from latextools_utils import analysis, cache, get_setting
+    from latextools_utils import get_setting, symbol_index
+    from latextools_utils.completion_profiler import profile_stage
     from latextools_utils.tex_directives import get_tex_root
 
 
@@ -24,36 +27,10 @@ ACR_LINE_RE = re.compile(
 )
 
 
-def _get_glo_completions(ana, prefix, ac):
-    comp = []
-    glo_commands = ana.filter_commands(
-        ["newglossaryentry", "longnewglossaryentry", "newacronym"])
-    if ac:
-        comp = [(a.args + "\tGlossary", a.args) for a in glo_commands]
-    else:
-        glo_commands = [a for a in glo_commands if a.args.startswith(prefix)]
-        comp = [
-            [a.args]
-            for a in glo_commands
-        ], [
-            a.args for a in glo_commands
-        ]
-    return comp
-
-
-def _get_acr_completions(ana, prefix, ac):
-    acr_commands = ana.filter_commands("newacronym")
-    if ac:
-        comp = [(a.args + "\tAcronym", a.args) for a in acr_commands]
-    else:
-        acr_commands = [a for a in acr_commands if a.args.startswith(prefix)]
-        comp = [
-            [a.args, "{0} - {1}".format(a.args2 or "", a.args3 or "")]
-            for a in acr_commands
-        ], [
-            a.args for a in acr_commands
-        ]
-    return comp
+_COMPLETION_KINDS = {
+    "glo": symbol_index.GLOSSARY,
+    "acr": symbol_index.ACRONYM
+}
 
 
 class GlossaryFillAllHelper(FillAllHelper):
@@ -62,20 +39,21 @@ class GlossaryFillAllHelper(FillAllHelper):
         if not tex_root:
             return []
 
-        cache_name = "glocomp_{0}_{1}".format(comp_type, "ac" if ac else "kbd")
+        with profile_stage("fetch"):
+            index = symbol_index.get_symbol_index(tex_root)
+        kind = _COMPLETION_KINDS.get(comp_type)
+        if index is None or kind is None:
+            return []
 
-        def make_compl():
-            ana = analysis.get_analysis(tex_root)
-            if comp_type == "glo":
-                comp = _get_glo_completions(ana, prefix, ac)
-            elif comp_type == "acr":
-                comp = _get_acr_completions(ana, prefix, ac)
-            else:
-                comp = []
-            return comp
+        if ac:
+            return index.completions(kind)
 
-        comp = cache.cache(tex_root, cache_name, make_compl)
-        return comp
+        entries, values = index.quick_panel_entries(kind, prefix)
+        # fall back to ignoring the case if no key matches the prefix
+        if not entries and prefix:
+            entries, values = index.quick_panel_entries(
+                kind, prefix, ignore_case=True)
+        return entries, values
 
     def get_compl_type(self, line):
         if GLO_LINE_RE.match(line[::-1]):
@@ -102,3 +80,21 @@ class GlossaryFillAllHelper(FillAllHelper):
 
     def is_enabled(self):
         return get_setting("glossary_auto_trigger", True)
+
+
+class LatextoolsGlossaryBenchmarkCommand(sublime_plugin.WindowCommand):
+    """
+    Measure the prefix queries of the glossary quick panel on a generated
+    document with many glossary entries and acronyms.
+    """
+
+    def run(self, count=5000, queries=1000):
+        lines = symbol_index.run_benchmark(count, queries)
+
+        view = self.window.new_file()
+        view.set_scratch(True)
+        view.settings().set("word_wrap", False)
+        view.set_name("LaTeXTools Glossary Benchmark")
+        view.run_command(
+            "latextools_insert_text", {"text": "\n".join(lines)})
+        view.set_read_only(True)
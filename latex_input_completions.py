@@ -2,14 +2,18 @@
 # ST2/ST3 compat
 from __future__ import print_function
 import sublime
+import sublime_plugin
 
 import os
 import re
 import json
+import threading
+import time
 
 try:
     from latex_fill_all import FillAllHelper
-    from latextools_utils import analysis, get_setting
+    from latextools_utils import analysis, cache, get_setting
+    from latextools_utils.completion_profiler import profile_stage
     from latextools_utils.is_tex_file import get_tex_extensions
     from latextools_utils.output_directory import (
         get_aux_directory, get_output_directory
@@ -17,7 +21,8 @@ try:
     from getTeXRoot import get_tex_root
 except ImportError:
     from .latex_fill_all import FillAllHelper
-    from .latextools_utils import analysis, get_setting
+    from .latextools_utils import analysis, cache, get_setting
+    from .latextools_utils.completion_profiler import profile_stage
     from .latextools_utils.is_tex_file import get_tex_extensions
     from .latextools_utils.output_directory import (
         get_aux_directory, get_output_directory
@@ -189,48 +194,194 @@ if not _ST3:
     plugin_loaded()
 
 
+# the minimal time in seconds between checking the directories of a file
+# index for changes, unless a file has been saved in the meantime
+_FILE_INDEX_REFRESH_DELAY = 5
+
+_last_save_time = 0
+_file_indexes = {}
+_file_indexes_lock = threading.Lock()
+
+
+if hasattr(os, 'scandir'):
+    def _list_directory(dir_name):
+        files = []
+        dirs = []
+        for entry in os.scandir(dir_name):
+            if entry.name[0] == '.':
+                continue
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            if is_dir:
+                dirs.append(entry.name)
+            else:
+                files.append(entry.name)
+        return files, dirs
+else:
+    def _list_directory(dir_name):
+        files = []
+        dirs = []
+        for name in os.listdir(dir_name):
+            if name[0] == '.':
+                continue
+            if os.path.isdir(os.path.join(dir_name, name)):
+                dirs.append(name)
+            else:
+                files.append(name)
+        return files, dirs
+
+
+class _FileIndex(object):
+    '''
+    the files below a base path, grouped by their directory
+
+    on a refresh only the directories, whose mtime has changed, are listed
+    again; the index is stored in the local cache of the tex root
+    '''
+
+    def __init__(self, root, base_path, output_directory, aux_directory):
+        self.root = root
+        self.base_path = base_path
+        self.key = (base_path, output_directory, aux_directory)
+        self.excluded = set(
+            d for d in (output_directory, aux_directory) if d is not None)
+        # dir_name -> (mtime, files, [(dir, realpath of dir)])
+        self.directories = None
+        self.refresh_time = 0
+        # types -> [(dir_name, file name)]
+        self._matches = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            indexes = cache.read_local(self.root, 'file_index')
+            self.directories = dict(indexes[self.key])
+        except Exception:
+            self.directories = {}
+
+    def _save(self):
+        try:
+            indexes = dict(cache.read_local(self.root, 'file_index'))
+        except Exception:
+            indexes = {}
+        indexes[self.key] = self.directories
+        cache.write_local(self.root, 'file_index', indexes)
+
+    def refresh(self):
+        if self.directories is None:
+            self._load()
+
+        changed = False
+        directories = {}
+        handled_directories = set([os.path.realpath(self.base_path)])
+        stack = [self.base_path]
+        while stack:
+            dir_name = stack.pop()
+            try:
+                mtime = os.stat(dir_name).st_mtime
+            except OSError:
+                continue
+
+            entry = self.directories.get(dir_name)
+            if entry is None or entry[0] != mtime:
+                try:
+                    files, dirs = _list_directory(dir_name)
+                except OSError:
+                    continue
+                entry = (mtime, tuple(files), tuple(
+                    (d, os.path.realpath(os.path.join(dir_name, d)))
+                    for d in sorted(dirs)
+                ))
+                changed = True
+            directories[dir_name] = entry
+
+            for d, real_path in entry[2]:
+                if (
+                    real_path in handled_directories or
+                    real_path in self.excluded
+                ):
+                    continue
+                handled_directories.add(real_path)
+                stack.append(os.path.join(dir_name, d))
+
+        if changed or len(directories) != len(self.directories):
+            self.directories = directories
+            self._matches = {}
+            self._save()
+        self.refresh_time = time.time()
+
+    def get_matches(self, types):
+        with self._lock:
+            if (
+                self.directories is None or
+                self.refresh_time < _last_save_time or
+                time.time() - self.refresh_time > _FILE_INDEX_REFRESH_DELAY
+            ):
+                self.refresh()
+
+            types = tuple(types)
+            try:
+                return self._matches[types]
+            except KeyError:
+                pass
+
+            matches = []
+            for dir_name, entry in self.directories.items():
+                for f in entry[1]:
+                    if f.lower().endswith(types):
+                        matches.append((dir_name, f))
+            matches.sort()
+            self._matches[types] = matches
+            return matches
+
+
+def _get_file_index(root, base_path, output_directory, aux_directory):
+    key = (root, base_path, output_directory, aux_directory)
+    with _file_indexes_lock:
+        try:
+            return _file_indexes[key]
+        except KeyError:
+            file_index = _file_indexes[key] = _FileIndex(
+                root, base_path, output_directory, aux_directory)
+            return file_index
+
+
+class InputFileIndexListener(sublime_plugin.EventListener):
+    '''
+    ensures that the file indexes are refreshed after a file has been saved
+    '''
+
+    def on_post_save(self, view):
+        global _last_save_time
+        _last_save_time = time.time()
+
+
 # Get all file by types
 def get_file_list(root, types, filter_exts=[], base_path=None, output_directory=None,
                   aux_directory=None):
     if not base_path:
         base_path = os.path.dirname(root)
 
-    def file_match(f):
-        for ext in types:
-            if f.lower().endswith(ext):
-                return True
-        return False
-
-    def dir_match(d):
-        _d = os.path.realpath(os.path.join(dir_name, d))
-        if (
-            _d in handled_directories or
-            _d == output_directory or
-            _d == aux_directory
-        ):
-            return False
-
-        return True
+    file_index = _get_file_index(
+        root, base_path, output_directory, aux_directory)
 
     completions = []
-    handled_directories = set([])
-    for dir_name, dirs, files in os.walk(base_path, followlinks=True):
-        handled_directories.add(os.path.realpath(dir_name))
-        files = [f for f in files if f[0] != '.' and file_match(f)]
-        dirs[:] = [d for d in dirs if d[0] != '.' and dir_match(d)]
-        for f in files:
-            full_path = os.path.join(dir_name, f)
-            # Exclude image file have the same name of root file,
-            # which may be the pdf file of the root files,
-            # only pdf format.
-            if os.path.splitext(root)[0] == os.path.splitext(full_path)[0]:
-                continue
+    root_base = os.path.splitext(root)[0]
+    for dir_name, f in file_index.get_matches(types):
+        full_path = os.path.join(dir_name, f)
+        # Exclude image file have the same name of root file,
+        # which may be the pdf file of the root files,
+        # only pdf format.
+        if root_base == os.path.splitext(full_path)[0]:
+            continue
 
-            for ext in filter_exts:
-                if f.endswith(ext):
-                    f = f[:-len(ext)]
+        for ext in filter_exts:
+            if f.endswith(ext):
+                f = f[:-len(ext)]
 
-            completions.append((os.path.relpath(dir_name, base_path), f))
+        completions.append((os.path.relpath(dir_name, base_path), f))
 
     return completions
 
@@ -332,7 +483,14 @@ def parse_completions(view, line):
     return completions
 
 
+# the package cache and the mtime of its file, so it is only read again if
+# it has been generated again
+_pkg_cache = None
+_pkg_cache_mtime = None
+
+
 def _get_cache():
+    global _pkg_cache, _pkg_cache_mtime
     if _ST3:
         cache_path = os.path.normpath(
             os.path.join(sublime.cache_path(), "LaTeXTools"))
@@ -356,15 +514,20 @@ def _get_cache():
         if gen_cache:
             sublime.active_window().run_command("latex_gen_pkg_cache")
     else:
-        with open(pkg_cache_file) as f:
-            cache = json.load(f)
+        mtime = os.path.getmtime(pkg_cache_file)
+        if _pkg_cache is None or mtime != _pkg_cache_mtime:
+            with open(pkg_cache_file) as f:
+                _pkg_cache = json.load(f)
+            _pkg_cache_mtime = mtime
+        cache = _pkg_cache
     return cache
 
 
 class InputFillAllHelper(FillAllHelper):
 
     def get_auto_completions(self, view, prefix, line):
-        completions = parse_completions(view, line)
+        with profile_stage('fetch'):
+            completions = parse_completions(view, line)
 
         if len(completions) == 0:
             return []
@@ -6,8 +6,6 @@ import sublime_plugin
 import os
 import json
 
-from collections import defaultdict
-
 from functools import partial
 import threading
 import traceback
@@ -15,18 +13,18 @@ import traceback
 if sublime.version() < '3000':
     # we are on ST2 and Python 2.X
     _ST3 = False
-    strbase = basestring
 
     from latextools_utils.external_command import (
         check_output, CalledProcessError
     )
+    from latextools_utils.texmf import find_files
 else:
     _ST3 = True
-    strbase = str
 
     from .latextools_utils.external_command import (
         check_output, CalledProcessError
     )
+    from .latextools_utils.texmf import find_files
 
 __all__ = ['LatexGenPkgCacheCommand']
 
@@ -67,56 +65,20 @@ def _get_tex_searchpath(file_type):
     return None
 
 
-def _get_files_matching_extensions(paths, extensions=[]):
-    if isinstance(extensions, strbase):
-        extensions = [extensions]
-
-    matched_files = defaultdict(lambda: [])
-
-    for path in paths.split(os.pathsep):
-        # our current directory isn't usually meaningful from a WindowCommand
-        if path == '.':
-            continue
-
-        # !! sometimes occurs in the results on POSIX; remove them
-        path = path.replace(u'!!', u'')
-        path = os.path.normpath(path)
-        if not os.path.exists(path):  # ensure path exists
-            continue
-
-        if len(extensions) > 0:
-            for _, _, files in os.walk(path):
-                for f in files:
-                    for ext in extensions:
-                        if f.endswith(u''.join((os.extsep, ext))):
-                            matched_files[ext].append(os.path.splitext(f)[0])
-        else:
-            for _, _, files in os.walk(path):
-                for f in files:
-                    matched_files['*'].append(os.path.splitext(f)[0])
-
-    matched_files = dict([(key, sorted(set(value), key=lambda s: s.lower()))
-        for key, value in matched_files.items()])
-
-    return matched_files
-
-
 def _generate_package_cache():
-    installed_tex_items = _get_files_matching_extensions(
-        _get_tex_searchpath('tex'),
-        ['sty', 'cls']
-    )
+    tex_searchpath = _get_tex_searchpath('tex')
+    bst_searchpath = _get_tex_searchpath('bst')
+    if tex_searchpath is None or bst_searchpath is None:
+        return
 
-    installed_bst = _get_files_matching_extensions(
-        _get_tex_searchpath('bst'),
-        ['bst']
-    )
+    installed_tex_items = find_files(tex_searchpath, ['sty', 'cls'])
+    installed_bst = find_files(bst_searchpath, ['bst'])
 
     # create the cache object
     pkg_cache = {
-        'pkg': installed_tex_items['sty'],
-        'bst': installed_bst['bst'],
-        'cls': installed_tex_items['cls']
+        'pkg': installed_tex_items.get('sty', []),
+        'bst': installed_bst.get('bst', []),
+        'cls': installed_tex_items.get('cls', [])
     }
 
     # For ST3, put the cache files in cache dir
@@ -3,12 +3,10 @@ import sublime
 _ST3 = sublime.version() >= '3000'
 
 if _ST3:
-    from .latextools_utils import analysis, cache
-    from .latextools_utils.parser_utils import command_to_snippet
+    from .latextools_utils import symbol_index
     from .getTeXRoot import get_tex_root
 else:
-    from latextools_utils import analysis, cache
-    from latextools_utils.parser_utils import command_to_snippet
+    from latextools_utils import symbol_index
     from getTeXRoot import get_tex_root
 
 __all__ = ["get_own_env_completion", "get_own_command_completion"]
@@ -19,12 +17,11 @@ def get_own_env_completion(view):
     if not tex_root:
         return []
 
-    def make_completions():
-        ana = analysis.get_analysis(tex_root)
-        return _make_own_env_completion(ana)
+    index = symbol_index.get_symbol_index(tex_root)
+    if index is None:
+        return []
 
-    return list(cache.LocalCache(tex_root).cache(
-        "own_env_completion", make_completions) or [])
+    return index.completions(symbol_index.ENVIRONMENT)
 
 
 def get_own_command_completion(view):
@@ -32,6 +29,10 @@ def get_own_command_completion(view):
     if not tex_root:
         return []
 
+    index = symbol_index.get_symbol_index(tex_root)
+    if index is None:
+        return []
+
     # use special handling (additional completions) for math mode
     math_selector = (
         "string.other.math.tex, "
@@ -40,69 +41,8 @@ def get_own_command_completion(view):
     )
     is_math = bool(view.score_selector(view.sel()[0].b, math_selector))
 
-    def make_completions():
-        ana = analysis.get_analysis(tex_root)
-        return _make_own_command_completion(ana, is_math)
-
-    cache_name = "own_command_completion"
-    if is_math:
-        cache_name += "_math"
-
-    return list(
-        cache.LocalCache(tex_root).cache(cache_name, make_completions) or [])
-
-
-def _make_own_env_completion(ana):
-    commands = ana.filter_commands(["newenvironment", "renewenvironment"])
-    return [(c.args.ljust(50) + "\tlocal", c.args) for c in commands]
-
-
-def _make_own_command_completion(ana, is_math):
-    com = ana.filter_commands(["newcommand", "renewcommand"])
-    res = [_parse_command(c) for c in com]
-
-    env = ana.filter_commands(["newenvironment", "renewenvironment"])
-    for e in env:
-        res.extend([
-            ("\\begin{{{0}}}".format(e.args).ljust(50) + "\tlocal",
-                "\\begin{{{0}}}\n$1\n\\end{{{0}}}$0".format(e.args)),
-            ("\\end{{{0}}}".format(e.args).ljust(50) + "\tlocal",
-                "\\end{{{0}}}".format(e.args))
-        ])
-
+    res = index.completions(symbol_index.COMMAND)
     if is_math:
-        dop = ana.filter_commands(["DeclareMathOperator"])
-        res.extend(
-            (s.args.ljust(50) + "\tlocal", s.args)
-            for s in dop
-        )
+        res.extend(index.completions(symbol_index.MATH_OPERATOR))
 
     return res
-
-
-def _parse_command(c):
-    class NoArgs(Exception):
-        pass
-
-    try:
-        if not c.optargs2:
-            raise NoArgs()
-        arg_count = int(c.optargs2)
-        has_opt = bool(c.optargs2a)
-        s = c.args
-        if has_opt:
-            s += "[{0}]".format(c.optargs2a)
-            arg_count -= 1
-        elif arg_count == 0:
-            raise NoArgs()
-        s += "{arg}" * arg_count
-        comp = command_to_snippet(s)
-        if comp is None:
-            raise NoArgs()
-        comp = comp[1]
-    except:  # no args
-        s = c.args + "{}"
-        comp = s
-
-    s = s.ljust(50)
-    return (s + "\tlocal", comp)
@@ -1,19 +1,29 @@
 # ST2/ST3 compat
 from __future__ import print_function
 import sublime
+import sublime_plugin
 if sublime.version() < '3000':
     # we are on ST2 and Python 2.X
     _ST3 = False
     import getTeXRoot
     from latex_fill_all import FillAllHelper
-    from latextools_utils import analysis, get_setting
+    from latextools_utils import get_setting
+    from latextools_utils.completion_profiler import profile_stage
+    from latextools_utils.symbol_index import get_symbol_index
+    from latextools_utils.utils import run_on_main_thread
 else:
     _ST3 = True
     from . import getTeXRoot
     from .latex_fill_all import FillAllHelper
-    from .latextools_utils import analysis, get_setting
+    from .latextools_utils import get_setting
+    from .latextools_utils.completion_profiler import profile_stage
+    from .latextools_utils.symbol_index import get_symbol_index
+    from .latextools_utils.utils import run_on_main_thread
 
+import itertools
+import os
 import re
+import threading
 
 _ref_special_commands = "|".join([
     "", "eq", "page", "v", "V", "auto", "autopage", "name",
@@ -47,32 +57,198 @@ AUTOCOMPLETE_EXCLUDE_RX = re.compile(
 )
 
 
+LABEL_REGEX = r'\\label\{([^\{\}]+)\}'
+_LABEL_RE = re.compile(LABEL_REGEX)
+
+# the commands, which only modify the lines around the selections
+_LOCAL_EDIT_COMMANDS = set([
+    "insert", "left_delete", "right_delete", "delete_word"
+])
+
+# the keys of the hidden regions containing the \label{...} commands of a
+# buffer and the lines modified since the labels have been extracted
+_LABEL_REGIONS_KEY = 'latextools_ref_labels'
+_DIRTY_REGIONS_KEY = 'latextools_ref_labels_dirty'
+
+# view id -> _BufferLabels
+_buffer_labels = {}
+_buffer_labels_lock = threading.Lock()
+
+
+class _BufferLabels(object):
+    '''
+    the labels of a buffer
+
+    each \\label{...} command is stored as a hidden region of the view, so
+    it is moved by later modifications; after local edits, e.g. typing, only
+    the modified lines are scanned again
+    '''
+
+    def __init__(self, view):
+        self.view = view
+        self.version = 0
+        self._lock = threading.Lock()
+        self._needs_full_scan = True
+        self._labels = []
+        # (version of the symbol index, version, merged labels)
+        self.merged = None
+
+    def on_modified(self):
+        view = self.view
+        command, _, _ = view.command_history(0, True)
+        with self._lock:
+            if self._needs_full_scan:
+                return
+            if command not in _LOCAL_EDIT_COMMANDS:
+                self._needs_full_scan = True
+                view.erase_regions(_DIRTY_REGIONS_KEY)
+                return
+            # include the previous line in case a newline was inserted
+            dirty_regions = view.get_regions(_DIRTY_REGIONS_KEY)
+            dirty_regions.extend(
+                sublime.Region(
+                    view.line(max(sel.begin() - 1, 0)).begin(),
+                    view.line(sel.end()).end()
+                )
+                for sel in view.sel()
+            )
+            view.add_regions(
+                _DIRTY_REGIONS_KEY, dirty_regions, '', '', sublime.HIDDEN)
+
+    def _scan_dirty_regions(self, label_regions, dirty_regions):
+        view = self.view
+        for dirty in dirty_regions:
+            # a label may span several lines, so we scan it completely
+            intersecting = [
+                r for r in label_regions
+                if r.begin() <= dirty.end() and dirty.begin() <= r.end()
+            ]
+            for r in intersecting:
+                dirty = dirty.cover(r)
+            label_regions = [
+                r for r in label_regions
+                if r.end() < dirty.begin() or dirty.end() < r.begin()
+            ]
+            offset = dirty.begin()
+            label_regions.extend(
+                sublime.Region(offset + m.start(), offset + m.end())
+                for m in _LABEL_RE.finditer(view.substr(dirty))
+            )
+        return label_regions
+
+    def get_labels(self):
+        '''
+        returns the labels of the buffer
+        '''
+        view = self.view
+        with self._lock:
+            if self._needs_full_scan:
+                label_regions = view.find_all(LABEL_REGEX)
+            else:
+                dirty_regions = view.get_regions(_DIRTY_REGIONS_KEY)
+                if not dirty_regions:
+                    return self._labels
+                label_regions = self._scan_dirty_regions(
+                    view.get_regions(_LABEL_REGIONS_KEY), dirty_regions)
+
+            self._needs_full_scan = False
+            view.erase_regions(_DIRTY_REGIONS_KEY)
+            view.add_regions(
+                _LABEL_REGIONS_KEY, label_regions, '', '', sublime.HIDDEN)
+
+            label_regions.sort(key=lambda r: r.begin())
+            labels = [
+                _LABEL_RE.match(view.substr(r)).group(1)
+                for r in label_regions
+            ]
+            if labels != self._labels:
+                self._labels = labels
+                self.version += 1
+            return self._labels
+
+
+def _get_buffer_labels(view):
+    with _buffer_labels_lock:
+        try:
+            return _buffer_labels[view.id()]
+        except KeyError:
+            buffer_labels = _buffer_labels[view.id()] = _BufferLabels(view)
+            return buffer_labels
+
+
 # recursively search all linked tex files to find all
 # included \label{} tags in the document and extract
 def find_labels_in_files(root, labels):
-    doc = analysis.get_analysis(root)
-    for command in doc.filter_commands('label'):
-        labels.append(command.args)
+    index = get_symbol_index(root)
+    if index is not None:
+        for file_labels in index.labels_by_file.values():
+            labels.extend(file_labels)
 
 
 # get_ref_completions forms the guts of the parsing shared by both the
 # autocomplete plugin and the quick panel command
 def get_ref_completions(view):
-    completions = []
     # Check the file buffer first:
     #    1) in case there are unsaved changes
     #    2) if this file is unnamed and unsaved, get_tex_root will fail
-    view.find_all(r'\\label\{([^\{\}]+)\}', 0, '\\1', completions)
+    buffer_labels = _get_buffer_labels(view)
+    labels = run_on_main_thread(buffer_labels.get_labels)
 
     root = getTeXRoot.get_tex_root(view)
+    index = None
     if root:
         print(u"TEX root: " + repr(root))
-        find_labels_in_files(root, completions)
+        index = get_symbol_index(root)
+    if index is not None:
+        file_labels = index.labels_by_file
+        index_version = index.version
+    else:
+        file_labels = {}
+        index_version = None
+
+    # the merged labels are reused until either the buffer or the symbol
+    # index changes; the index is only rebuilt if the document is analyzed
+    # again
+    merged = buffer_labels.merged
+    if (
+        merged is not None and
+        merged[0] == index_version and
+        merged[1] == buffer_labels.version
+    ):
+        return list(merged[2])
 
-    # remove duplicates
-    completions = list(set(completions))
+    # the labels of the current file in the analysis may be outdated, so
+    # we use the labels of the buffer instead
+    file_name = view.file_name()
+    if file_name:
+        file_name = os.path.normpath(file_name)
 
-    return completions
+    completions = []
+    seen = set()
+    for label in itertools.chain(labels, *(
+        file_labels[f] for f in file_labels if f != file_name
+    )):
+        if label not in seen:
+            seen.add(label)
+            completions.append(label)
+
+    buffer_labels.merged = (index_version, buffer_labels.version, completions)
+    return list(completions)
+
+
+class RefLabelIndexListener(sublime_plugin.EventListener):
+    '''
+    keeps the label indexes of the buffers up to date
+    '''
+
+    def on_modified(self, view):
+        buffer_labels = _buffer_labels.get(view.id())
+        if buffer_labels is not None:
+            buffer_labels.on_modified()
+
+    def on_close(self, view):
+        with _buffer_labels_lock:
+            _buffer_labels.pop(view.id(), None)
 
 
 # called by LatexFillAllCommand; provides a list of labels for any ref commands
@@ -91,7 +267,8 @@ class RefFillAllHelper(FillAllHelper):
         if old_style and not prefix:
             return []
 
-        completions = get_ref_completions(view)
+        with profile_stage('fetch'):
+            completions = get_ref_completions(view)
 
         if prefix:
             lower_prefix = prefix.lower()
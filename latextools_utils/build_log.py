@@ -0,0 +1,169 @@
+'''
+Stores the location and the parsed content of the log file of the last build
+of a document in the local cache of its tex root.
+
+The parsed result is only reused as long as the log file has the same
+modification time and size as when it was parsed, so anything interested in
+the errors of the last build (the output panel, the inline error phantoms,
+the show build errors command, ...) can ask for them without rereading or
+reparsing the log.
+'''
+import os
+
+import sublime
+
+if sublime.version() < '3000':
+    from latextools_utils.cache import LocalCache, CacheMiss
+    import parseTeXlog
+else:
+    from .cache import LocalCache, CacheMiss
+    from .. import parseTeXlog
+
+__all__ = ['BuildLog', 'find_log_file', 'get_build_log', 'read_build_log']
+
+_CACHE_KEY = 'build_log'
+
+
+class BuildLog(object):
+    '''
+    the parsed content of a log file
+
+    errors, warnings and badboxes are lists of parseTeXlog.LogEntry tuples
+    '''
+
+    def __init__(self, log_file, errors, warnings, badboxes):
+        self.log_file = log_file
+        self.errors = errors
+        self.warnings = warnings
+        self.badboxes = badboxes
+
+    def format(self):
+        '''
+        returns the errors, warnings and badboxes formatted as
+        "file:line: message" strings, as returned by parse_tex_log
+        '''
+        return tuple(
+            [parseTeXlog.format_log_entry(e) for e in entries]
+            for entries in (self.errors, self.warnings, self.badboxes)
+        )
+
+
+def _read_cache(tex_root):
+    try:
+        return LocalCache(tex_root).get(_CACHE_KEY)
+    except CacheMiss:
+        return None
+    except Exception:
+        # e.g. a cache entry written by an older version
+        return None
+
+
+def find_log_file(
+    tex_root, tex_base, aux_directory=None, output_directory=None,
+    newer_than=None
+):
+    '''
+    returns the path to the log file of the last build
+
+    the log file is searched for in the aux_directory, the output_directory
+    and the folder of the tex_root, in that order; if it cannot be found, the
+    path in the folder of the tex_root is returned
+
+    if the log file was found at one of these locations before, that location
+    is checked first; if newer_than is given, that location is only used if
+    the log file has been written since that time
+    '''
+    log_file_base = tex_base + '.log'
+    candidates = []
+    for directory in (
+        aux_directory, output_directory, os.path.dirname(tex_root)
+    ):
+        if directory is None:
+            continue
+        log_file = os.path.join(directory, log_file_base)
+        if log_file not in candidates:
+            candidates.append(log_file)
+
+    cached = _read_cache(tex_root)
+    if cached is not None and cached['log_file'] in candidates:
+        try:
+            mtime = os.path.getmtime(cached['log_file'])
+        except OSError:
+            pass
+        else:
+            if newer_than is None or mtime >= newer_than:
+                return cached['log_file']
+
+    for log_file in candidates:
+        if os.path.exists(log_file):
+            return log_file
+
+    return candidates[-1]
+
+
+def get_build_log(tex_root, log_file):
+    '''
+    returns the BuildLog for the log_file
+
+    the log file is only read and parsed if it has changed since it was last
+    parsed; raises IOError if the log file cannot be read
+    '''
+    try:
+        stat = os.stat(log_file)
+    except OSError as e:
+        raise IOError(str(e))
+
+    cached = _read_cache(tex_root)
+    if (
+        cached is not None and
+        cached['log_file'] == log_file and
+        cached['mtime'] == stat.st_mtime and
+        cached['size'] == stat.st_size
+    ):
+        return BuildLog(
+            log_file,
+            *[
+                [parseTeXlog.LogEntry(*e) for e in cached[key]]
+                for key in ('errors', 'warnings', 'badboxes')
+            ]
+        )
+
+    # We must open the log in binary mode on Windows because MiKTeX inserts
+    # ASCII control characters in over/underfull warnings. In particular it
+    # inserts EOFs, which stop reading altogether; reading in binary prevents
+    # that. Furthermore, if we invoke splitlines on a string and a FS
+    # character is encountered, the line is broken in two, which messes up
+    # the line numbers in error reports. This does not happen with a byte
+    # array, so parseTeXlog takes care of decoding the lines itself.
+    with open(log_file, 'rb') as f:
+        data = f.read()
+
+    errors, warnings, badboxes = parseTeXlog.parse_tex_log_entries(
+        data, os.path.dirname(tex_root)
+    )
+
+    LocalCache(tex_root).set(_CACHE_KEY, {
+        'log_file': log_file,
+        'mtime': stat.st_mtime,
+        'size': stat.st_size,
+        'errors': tuple(tuple(e) for e in errors),
+        'warnings': tuple(tuple(e) for e in warnings),
+        'badboxes': tuple(tuple(e) for e in badboxes)
+    })
+
+    return BuildLog(log_file, errors, warnings, badboxes)
+
+
+def read_build_log(tex_root):
+    '''
+    returns the BuildLog of the last build of the tex_root or None if the
+    document has not been built or its log file cannot be read anymore
+    '''
+    cached = _read_cache(tex_root)
+    if cached is None:
+        return None
+
+    try:
+        return get_build_log(tex_root, cached['log_file'])
+    except IOError:
+        return None
@@ -249,7 +249,8 @@ class Cache(object):
             result = self._objects[key]
         except KeyError:
             # note: will raise CacheMiss if can't be found
-            result = self.load(key)
+            self.load(key)
+            result = self._objects[key]
 
         if result is _invalid_object:
             raise CacheMiss('{0} is invalid'.format(key))
@@ -0,0 +1,291 @@
+'''
+Optional profiling of the completions of the LatexFillAllEventListener.
+
+If the completion_profiling setting is enabled, each completion records the
+time spent matching the line against each FillAll helper, fetching the data
+(e.g. the analysis, bibliography or cwl files), formatting the completions
+and the number of results. The last records are kept in memory to create
+the report shown by the latextools_completion_profile command and each
+record is appended to a log file in the cache folder, which is rotated when
+it gets too large, so it can be attached to a bug report.
+
+Helpers mark the time spent fetching their data using
+
+    with profile_stage('fetch'):
+        ...
+
+which does nothing unless a completion is profiled.
+'''
+from __future__ import print_function
+
+import collections
+import json
+import math
+import os
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+import sublime
+
+if sublime.version() < '3000':
+    from latextools_utils import get_setting
+    from latextools_utils.cache import _global_cache_path
+    from latextools_utils.system import make_dirs
+else:
+    from . import get_setting
+    from .cache import _global_cache_path
+    from .system import make_dirs
+
+__all__ = [
+    'is_enabled', 'start_completion', 'finish_completion', 'profile_stage',
+    'get_report', 'clear', 'get_log_path'
+]
+
+# the number of completions kept in memory for the report
+MAX_RECORDS = 1000
+
+# the log is rotated if it gets larger than this size in bytes
+MAX_LOG_SIZE = 512 * 1024
+LOG_NAME = 'completion_profile.log'
+
+# the delay in milliseconds before the records are written to the log
+_FLUSH_DELAY = 5000
+
+_lock = threading.Lock()
+_records = collections.deque(maxlen=MAX_RECORDS)
+_log_buffer = []
+_local = threading.local()
+
+
+class CompletionRecord(object):
+    '''
+    the timings of one completion; all times are in seconds
+    '''
+
+    def __init__(self, prefix):
+        self.time = time.time()
+        self.prefix = prefix
+        self.helper = None
+        # [(helper name, time spent in matches_line)]
+        self.match_times = []
+        self.stages = {}
+        self.helper_time = 0
+        self.total = 0
+        self.results = 0
+        self._start = time.time()
+
+    def add_stage(self, stage, duration):
+        self.stages[stage] = self.stages.get(stage, 0) + duration
+
+    @property
+    def match_time(self):
+        return sum(t for _, t in self.match_times)
+
+    @property
+    def fetch_time(self):
+        return self.stages.get('fetch', 0)
+
+    @property
+    def format_time(self):
+        # everything the helper did apart from fetching the data and the
+        # post-processing of the listener
+        return max(self.helper_time - self.fetch_time, 0) + \
+            self.stages.get('format', 0)
+
+    def to_dict(self):
+        return {
+            'time': time.strftime(
+                '%Y-%m-%d %H:%M:%S', time.localtime(self.time)),
+            'helper': self.helper,
+            'prefix_length': len(self.prefix or ''),
+            'total_ms': _ms(self.total),
+            'match_ms': dict(
+                (name, _ms(t)) for name, t in self.match_times),
+            'fetch_ms': _ms(self.fetch_time),
+            'format_ms': _ms(self.format_time),
+            'results': self.results
+        }
+
+
+def _ms(duration):
+    return round(duration * 1000, 3)
+
+
+def is_enabled():
+    return get_setting('completion_profiling', False)
+
+
+def start_completion(prefix):
+    '''
+    returns a new CompletionRecord if profiling is enabled, otherwise None;
+    while the record is not finished, profile_stage() adds to it
+    '''
+    if not is_enabled():
+        _local.record = None
+        return None
+    record = _local.record = CompletionRecord(prefix)
+    return record
+
+
+def finish_completion(record):
+    '''
+    stores the record; it is ignored if it is None
+    '''
+    _local.record = None
+    if record is None:
+        return
+    record.total = time.time() - record._start
+
+    with _lock:
+        _records.append(record)
+        _log_buffer.append(json.dumps(record.to_dict(), sort_keys=True))
+        schedule_flush = len(_log_buffer) == 1
+    if schedule_flush:
+        sublime.set_timeout(_flush_log, _FLUSH_DELAY)
+
+
+@contextmanager
+def profile_stage(stage):
+    '''
+    adds the time spent in the with-block to the stage of the current
+    completion, if it is profiled
+    '''
+    record = getattr(_local, 'record', None)
+    if record is None:
+        yield
+        return
+
+    start = time.time()
+    try:
+        yield
+    finally:
+        record.add_stage(stage, time.time() - start)
+
+
+def get_log_path():
+    return os.path.join(_global_cache_path(), LOG_NAME)
+
+
+def _flush_log():
+    with _lock:
+        lines = list(_log_buffer)
+        del _log_buffer[:]
+    if not lines:
+        return
+
+    log_path = get_log_path()
+    try:
+        make_dirs(os.path.dirname(log_path))
+        try:
+            if os.path.getsize(log_path) > MAX_LOG_SIZE:
+                old_log_path = log_path + '.1'
+                if os.path.exists(old_log_path):
+                    os.remove(old_log_path)
+                os.rename(log_path, old_log_path)
+        except OSError:
+            pass
+
+        with open(log_path, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+    except Exception:
+        print('Error writing the completion profile log')
+        traceback.print_exc()
+
+
+def clear():
+    with _lock:
+        _records.clear()
+
+
+def _percentile(sorted_values, percent):
+    # nearest-rank percentile of a sorted list
+    if not sorted_values:
+        return 0
+    index = int(math.ceil(percent / 100.0 * len(sorted_values))) - 1
+    return sorted_values[max(0, min(index, len(sorted_values) - 1))]
+
+
+def _format_stats(name, values):
+    values = sorted(values)
+    return u'  {0:<14}{1:>9.1f}{2:>9.1f}{3:>9.1f}{4:>9.1f}'.format(
+        name,
+        _percentile(values, 50) * 1000,
+        _percentile(values, 90) * 1000,
+        _percentile(values, 99) * 1000,
+        values[-1] * 1000 if values else 0
+    )
+
+
+def get_report(top=10):
+    '''
+    returns the lines of a report of the profiled completions
+    '''
+    # the records are appended on the main thread, so we copy them first
+    with _lock:
+        records = list(_records)
+
+    lines = [
+        u'LaTeXTools completion profile',
+        u'',
+        u'Completions profiled: {0} (the last {1} are kept)'.format(
+            len(records), MAX_RECORDS),
+        u'Log file: {0}'.format(get_log_path())
+    ]
+    if not is_enabled():
+        lines.append(
+            u'Profiling is disabled; set "completion_profiling" to true in '
+            u'your LaTeXTools settings to enable it.')
+    if not records:
+        return lines
+
+    header = u'  {0:<14}{1:>9}{2:>9}{3:>9}{4:>9}'.format(
+        u'(ms)', u'p50', u'p90', u'p99', u'max')
+
+    by_helper = {}
+    for record in records:
+        helper = record.helper or u'(no helper)'
+        by_helper.setdefault(helper, []).append(record)
+
+    for helper, helper_records in sorted(by_helper.items()):
+        results = [r.results for r in helper_records]
+        lines.extend([
+            u'',
+            u'{0}: {1} completions, {2:.1f} results on average'.format(
+                helper, len(helper_records),
+                float(sum(results)) / len(results)
+            ),
+            header,
+            _format_stats(u'total', [r.total for r in helper_records]),
+            _format_stats(u'matching', [r.match_time for r in helper_records]),
+            _format_stats(u'fetching', [r.fetch_time for r in helper_records]),
+            _format_stats(
+                u'formatting', [r.format_time for r in helper_records])
+        ])
+
+    # the time each helper needs to check whether it matches the line
+    match_times = {}
+    for record in records:
+        for name, duration in record.match_times:
+            match_times.setdefault(name, []).append(duration)
+    lines.extend([u'', u'matches_line per helper', header])
+    lines.extend(
+        _format_stats(name, durations)
+        for name, durations in sorted(
+            match_times.items(), key=lambda item: -sum(item[1]))
+    )
+
+    lines.extend([u'', u'Slowest completions'])
+    for record in sorted(records, key=lambda r: -r.total)[:top]:
+        data = record.to_dict()
+        data['helper'] = record.helper or u'(no helper)'
+        lines.append(
+            u'  {time}  {helper}: {total_ms:.1f}ms (matching {match:.1f}ms, '
+            u'fetching {fetch_ms:.1f}ms, formatting {format_ms:.1f}ms), '
+            u'{results} results'.format(
+                match=_ms(record.match_time),
+                **data
+            )
+        )
+    return lines
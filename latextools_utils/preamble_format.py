@@ -0,0 +1,311 @@
+'''
+Support for precompiling the preamble of a document into a format file.
+
+The preamble (everything up to \\begin{document}) is dumped into a format
+file using the mylatexformat package, i.e. by running
+
+    pdflatex -ini -jobname=<name> "&pdflatex" mylatexformat.ltx <file>.tex
+
+Subsequent runs load the format using -fmt=<name>, so the packages loaded
+in the preamble do not have to be processed on every run. The format is
+only dumped again if the preamble, any file it inputs or any local package
+or class it loads has changed. This is determined using the analysis of
+the document.
+'''
+from __future__ import print_function
+
+import hashlib
+import os
+import traceback
+
+import sublime
+
+if sublime.version() < '3000':
+    from latextools_utils import analysis
+    from latextools_utils.external_command import (
+        check_output, CalledProcessError
+    )
+    from latextools_utils.system import make_dirs
+    from latextools_utils.utils import read_file_unix_endings
+else:
+    from . import analysis
+    from .external_command import check_output, CalledProcessError
+    from .system import make_dirs
+    from .utils import read_file_unix_endings
+
+__all__ = [
+    'PreambleFormat', 'get_preamble_format', 'mylatexformat_installed'
+]
+
+# the engines which can dump and load a format containing the preamble;
+# LuaTeX cannot store the Lua state in the format, which breaks most
+# preambles that load packages using Lua
+SUPPORTED_ENGINES = ['pdflatex', 'xelatex']
+
+# the message TeX prints if the format cannot be loaded, e.g. because it has
+# been created by a different version of the engine
+FORMAT_ERROR_MESSAGES = [
+    "Fatal format file error",
+    "I can't find the format file"
+]
+
+_PACKAGE_COMMANDS = {
+    'usepackage': '.sty',
+    'RequirePackage': '.sty',
+    'documentclass': '.cls',
+    'LoadClass': '.cls'
+}
+
+_MYLATEXFORMAT_INSTALLED = []
+
+
+def mylatexformat_installed():
+    if not _MYLATEXFORMAT_INSTALLED:
+        try:
+            check_output(['kpsewhich', 'mylatexformat.ltx'])
+        except (CalledProcessError, OSError):
+            _MYLATEXFORMAT_INSTALLED.append(False)
+        except Exception:
+            traceback.print_exc()
+            _MYLATEXFORMAT_INSTALLED.append(False)
+        else:
+            _MYLATEXFORMAT_INSTALLED.append(True)
+    return _MYLATEXFORMAT_INSTALLED[0]
+
+
+class PreambleFormat(object):
+    '''
+    the format file containing the preamble of a document
+
+    :param tex_root:
+        the path to the tex root
+
+    :param engine:
+        the engine, e.g. "pdflatex"
+
+    :param directory:
+        the directory the format is written to; if it is a relative path,
+        it is relative to the folder of the tex_root
+
+    :param job_name:
+        the jobname of the document; the format is called
+        "<job_name>-preamble"
+    '''
+
+    def __init__(self, tex_root, engine, directory, job_name):
+        self.tex_root = os.path.normpath(tex_root)
+        self.tex_dir, self.tex_name = os.path.split(self.tex_root)
+        self.engine = engine
+        self.directory = directory or '.'
+        self.name = job_name + '-preamble'
+
+        self.path = os.path.normpath(
+            os.path.join(self.tex_dir, self.directory, self.name + '.fmt')
+        )
+        self._hash_file = self.path + '-hash'
+        self._hash = None
+        self.up_to_date = False
+
+    @property
+    def fmt_option(self):
+        '''
+        the option to pass to the engine to load this format
+        '''
+        if self.directory == '.':
+            return u'-fmt=' + self.name
+        return u'-fmt=' + os.path.join(self.directory, self.name)
+
+    def _get_analysis(self):
+        ana = analysis.get_analysis(self.tex_root)
+        # the cached analysis may be outdated; if the preamble it contains
+        # does not match the file anymore, we analyze the document again
+        try:
+            preamble = self._preamble_text(ana)
+            content = read_file_unix_endings(self.tex_root)
+        except Exception:
+            preamble = content = None
+
+        if preamble is None or not content.startswith(preamble):
+            ana = analysis.analyze_document(self.tex_root)
+        return ana
+
+    def _preamble_text(self, ana):
+        raw_content = ana.raw_content(self.tex_root)
+        for c in ana.filter_commands(
+            'begin', flags=analysis.ONLY_COMMANDS_WITH_ARGS
+        ):
+            if c.args == 'document' and c.file_name == self.tex_root:
+                return raw_content[:c.start]
+        # no \begin{document} in the root, so no preamble to dump
+        return None
+
+    def compute_hash(self):
+        '''
+        returns a digest of everything that goes into the format: the
+        engine, the preamble of the tex root, any files input in the
+        preamble and the modification time of all local packages and classes
+        loaded in the preamble
+        '''
+        ana = self._get_analysis()
+        preamble = self._preamble_text(ana)
+        if preamble is None:
+            return None
+
+        digest = hashlib.md5()
+
+        def update(text):
+            digest.update(text.encode('utf-8', 'ignore'))
+            digest.update(b'\0')
+
+        update(self.engine)
+        update(preamble)
+
+        preamble_commands = ana.commands(
+            flags=analysis.ONLY_PREAMBLE | analysis.ONLY_COMMANDS_WITH_ARGS
+        )
+
+        file_names = []
+        for c in preamble_commands:
+            if c.file_name != self.tex_root and c.file_name not in file_names:
+                file_names.append(c.file_name)
+        for file_name in file_names:
+            update(file_name)
+            update(ana.raw_content(file_name))
+
+        for c in preamble_commands:
+            ext = _PACKAGE_COMMANDS.get(c.command)
+            if ext is None or not c.args:
+                continue
+            for package in c.args.split(','):
+                package = package.strip()
+                if not package:
+                    continue
+                package_file = os.path.join(self.tex_dir, package + ext)
+                try:
+                    stat = os.stat(package_file)
+                except OSError:
+                    continue
+                update(u'{0}:{1}:{2}'.format(
+                    package_file, stat.st_mtime, stat.st_size))
+
+        return digest.hexdigest()
+
+    def is_up_to_date(self):
+        '''
+        returns True if the format exists and contains the current preamble
+        '''
+        if self._hash is None:
+            self._hash = self.compute_hash()
+        if self._hash is None or not os.path.exists(self.path):
+            return False
+
+        try:
+            with open(self._hash_file, 'r') as f:
+                return f.read().strip() == self._hash
+        except (IOError, OSError):
+            return False
+
+    def dump_command(self):
+        '''
+        returns the command to dump the format, creating the directory for
+        the format if necessary
+        '''
+        directory = os.path.dirname(self.path)
+        if not os.path.exists(directory):
+            make_dirs(directory)
+
+        command = [
+            self.engine, u'-ini', u'-interaction=nonstopmode',
+            u'-jobname=' + self.name
+        ]
+        if self.directory != '.':
+            command.append(u'--output-directory=' + self.directory)
+        command.extend([u'&' + self.engine, u'mylatexformat.ltx', self.tex_name])
+        return command
+
+    def finish_dump(self, start_time):
+        '''
+        checks whether the format has been written after start_time and, if
+        so, records the hash of the preamble it contains
+
+        returns True if the format can be used
+        '''
+        try:
+            if os.path.getmtime(self.path) < start_time:
+                return False
+        except OSError:
+            return False
+
+        if self._hash is None:
+            self._hash = self.compute_hash()
+
+        try:
+            with open(self._hash_file, 'w') as f:
+                f.write(self._hash)
+        except (IOError, OSError):
+            traceback.print_exc()
+            return False
+
+        return True
+
+    def invalidate(self):
+        '''
+        removes the format, e.g. if the engine cannot load it
+        '''
+        for path in (self.path, self._hash_file):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def get_preamble_format(builder, engine):
+    '''
+    returns the PreambleFormat for the document built by builder if the
+    "preamble_format" builder setting is enabled and the format can be used
+    with the engine; otherwise returns None and displays the reason in the
+    output panel (if any)
+
+    if the up_to_date attribute of the result is False, the format has to
+    be dumped using dump_command() before it can be used
+
+    :param builder:
+        the builder; its aux_directory (or output_directory) is used to
+        store the format
+
+    :param engine:
+        the engine command, e.g. "pdflatex"
+    '''
+    if not builder.builder_settings.get('preamble_format', False):
+        return None
+
+    if engine not in SUPPORTED_ENGINES:
+        builder.display(
+            u'Preamble formats are not supported with {0}. '.format(engine))
+        return None
+
+    if not mylatexformat_installed():
+        builder.display(
+            u'Cannot find mylatexformat.ltx, not using a preamble format. ')
+        return None
+
+    preamble_format = PreambleFormat(
+        builder.tex_root, engine,
+        builder.aux_directory or builder.output_directory,
+        builder.job_name
+    )
+
+    try:
+        preamble_format.up_to_date = preamble_format.is_up_to_date()
+    except Exception:
+        traceback.print_exc()
+        builder.display(
+            u'Could not analyze the preamble, not using a preamble format. ')
+        return None
+
+    if preamble_format._hash is None:
+        builder.display(
+            u'No \\begin{document} found, not using a preamble format. ')
+        return None
+
+    return preamble_format
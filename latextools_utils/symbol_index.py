@@ -0,0 +1,332 @@
+'''
+An index of the symbols defined in a document, i.e. its labels, glossary
+entries, acronyms, commands, environments and math operators.
+
+The index is built once from the analysis of the document and stored in the
+local cache next to the analysis, so it is reused until the cache is
+invalidated. The completions of each symbol are created
+when the index is built, so the completion helpers only have to select the
+symbols they need. For prefix queries, the keys of each kind of symbols are
+sorted once, so the matching symbols are found using a binary search.
+'''
+from __future__ import print_function
+
+import bisect
+import os
+import random
+import shutil
+import string
+import tempfile
+import time
+import uuid
+from functools import partial
+
+import sublime
+
+if sublime.version() < '3000':
+    from latextools_utils import analysis, cache
+    from latextools_utils.parser_utils import command_to_snippet
+else:
+    from . import analysis, cache
+    from .parser_utils import command_to_snippet
+
+__all__ = ['SymbolIndex', 'get_symbol_index', 'run_benchmark']
+
+# the kinds of symbols in the index
+LABEL = 'label'
+GLOSSARY = 'glossary'
+ACRONYM = 'acronym'
+COMMAND = 'command'
+ENVIRONMENT = 'environment'
+MATH_OPERATOR = 'math_operator'
+
+_GLOSSARY_COMMANDS = ['newglossaryentry', 'longnewglossaryentry', 'newacronym']
+
+
+class Symbol(object):
+    '''
+    a symbol of the document
+
+    :param key:
+        the text matched against the prefix, e.g. the name of the label
+    :param completion:
+        the tuple used as auto completion
+    :param entry:
+        the entry shown in the quick panel
+    :param value:
+        the text inserted if the entry of the quick panel is selected
+    '''
+    __slots__ = ['key', 'completion', 'entry', 'value']
+
+    def __init__(self, key, completion, entry=None, value=None):
+        self.key = key
+        self.completion = completion
+        self.entry = entry if entry is not None else [key]
+        self.value = value if value is not None else key
+
+
+class SymbolIndex(object):
+    '''
+    the symbols defined in the analyzed document
+
+    :param ana:
+        the analysis of the document
+    '''
+
+    def __init__(self, ana):
+        self.tex_root = ana.tex_root()
+        # identifies the index; the local cache returns copies of the index,
+        # which share its data and its version
+        self.version = uuid.uuid4().hex
+        # file name -> labels of the file
+        self.labels_by_file = {}
+        self._symbols = dict((kind, []) for kind in (
+            LABEL, GLOSSARY, ACRONYM, COMMAND, ENVIRONMENT, MATH_OPERATOR
+        ))
+        # (kind, ignore_case) -> (sorted keys, symbols in the same order);
+        # created on the first prefix query
+        self._sorted = {}
+        self._build(ana)
+
+    def _add(self, kind, symbol):
+        self._symbols[kind].append(symbol)
+
+    def _build(self, ana):
+        for c in ana.filter_commands('label'):
+            labels = self.labels_by_file.setdefault(c.file_name, [])
+            labels.append(c.args)
+            self._add(LABEL, Symbol(c.args, c.args))
+
+        for c in ana.filter_commands(_GLOSSARY_COMMANDS):
+            self._add(GLOSSARY, Symbol(
+                c.args, (c.args + '\tGlossary', c.args)))
+
+        for c in ana.filter_commands('newacronym'):
+            self._add(ACRONYM, Symbol(
+                c.args, (c.args + '\tAcronym', c.args),
+                [c.args, u'{0} - {1}'.format(c.args2 or '', c.args3 or '')]
+            ))
+
+        for c in ana.filter_commands(['newcommand', 'renewcommand']):
+            completion = _parse_command(c)
+            self._add(COMMAND, Symbol(c.args, completion))
+
+        for c in ana.filter_commands(['newenvironment', 'renewenvironment']):
+            self._add(ENVIRONMENT, Symbol(
+                c.args, (c.args.ljust(50) + '\tlocal', c.args)))
+
+            begin = u'\\begin{{{0}}}'.format(c.args)
+            end = u'\\end{{{0}}}'.format(c.args)
+            self._add(COMMAND, Symbol(begin, (
+                begin.ljust(50) + '\tlocal',
+                u'\\begin{{{0}}}\n$1\n\\end{{{0}}}$0'.format(c.args)
+            )))
+            self._add(COMMAND, Symbol(end, (end.ljust(50) + '\tlocal', end)))
+
+        for c in ana.filter_commands(['DeclareMathOperator']):
+            self._add(MATH_OPERATOR, Symbol(
+                c.args, (c.args.ljust(50) + '\tlocal', c.args)))
+
+    def _get_sorted(self, kind, ignore_case):
+        try:
+            return self._sorted[(kind, ignore_case)]
+        except KeyError:
+            pass
+
+        if ignore_case:
+            items = [(s.key.lower(), s) for s in self._symbols[kind]]
+        else:
+            items = [(s.key, s) for s in self._symbols[kind]]
+        items.sort(key=lambda item: item[0])
+        result = self._sorted[(kind, ignore_case)] = (
+            [key for key, _ in items], [symbol for _, symbol in items]
+        )
+        return result
+
+    def symbols(self, kind, prefix='', ignore_case=False):
+        '''
+        returns the symbols of the kind, whose key starts with prefix
+
+        without a prefix, the symbols are returned in the order they are
+        defined in the document, otherwise they are sorted by their key
+
+        :param ignore_case:
+            if True, the case of the prefix and the keys is ignored
+        '''
+        if not prefix:
+            return list(self._symbols[kind])
+
+        if ignore_case:
+            prefix = prefix.lower()
+        keys, symbols = self._get_sorted(kind, ignore_case)
+
+        begin = bisect.bisect_left(keys, prefix)
+        # all keys starting with the prefix are less than the prefix with
+        # its last character incremented
+        try:
+            upper = prefix[:-1] + u'%c' % (ord(prefix[-1]) + 1)
+        except (OverflowError, ValueError):
+            # the last character cannot be incremented, so we check the
+            # keys after the prefix
+            return [
+                symbol for key, symbol in zip(keys[begin:], symbols[begin:])
+                if key.startswith(prefix)
+            ]
+        end = bisect.bisect_left(keys, upper, begin)
+        return symbols[begin:end]
+
+    def completions(self, kind, prefix='', ignore_case=False):
+        '''
+        returns the auto completions of the symbols of the kind, whose key
+        starts with prefix
+        '''
+        return [
+            s.completion for s in self.symbols(kind, prefix, ignore_case)
+        ]
+
+    def quick_panel_entries(self, kind, prefix='', ignore_case=False):
+        '''
+        returns the entries of the quick panel and the values inserted for
+        the symbols of the kind, whose key starts with prefix
+        '''
+        symbols = self.symbols(kind, prefix, ignore_case)
+        return [s.entry for s in symbols], [s.value for s in symbols]
+
+
+def _parse_command(c):
+    class NoArgs(Exception):
+        pass
+
+    try:
+        if not c.optargs2:
+            raise NoArgs()
+        arg_count = int(c.optargs2)
+        has_opt = bool(c.optargs2a)
+        s = c.args
+        if has_opt:
+            s += "[{0}]".format(c.optargs2a)
+            arg_count -= 1
+        elif arg_count == 0:
+            raise NoArgs()
+        s += "{arg}" * arg_count
+        comp = command_to_snippet(s)
+        if comp is None:
+            raise NoArgs()
+        comp = comp[1]
+    except:  # no args
+        s = c.args + "{}"
+        comp = s
+
+    s = s.ljust(50)
+    return (s + "\tlocal", comp)
+
+
+def get_symbol_index(tex_root):
+    '''
+    returns the SymbolIndex of the document; it is stored in the local cache,
+    so it is only built again if the cache of the document is invalidated
+
+    :param tex_root:
+        the path to the tex root
+    '''
+    ana = analysis.get_analysis(tex_root)
+    if ana is None:
+        return None
+
+    return cache.LocalCache(tex_root).cache(
+        'symbol_index', partial(SymbolIndex, ana))
+
+
+def _benchmark_document(count):
+    # the keys are random, but the same for each run
+    rand = random.Random(0)
+    keys = [
+        u''.join(rand.choice(string.ascii_letters) for _ in range(8))
+        for _ in range(count)
+    ]
+    lines = [u'\\documentclass{article}', u'\\usepackage{glossaries}']
+    for i, key in enumerate(keys):
+        if i % 5 == 4:
+            lines.append(u'\\newacronym{{{0}}}{{A}}{{Acronym}}'.format(key))
+        else:
+            lines.append(
+                u'\\newglossaryentry{{{0}}}{{name={0},description=x}}'
+                .format(key))
+    lines.extend([u'\\begin{document}', u'\\end{document}', u''])
+    return keys, u'\n'.join(lines)
+
+
+def _time_queries(func, prefixes):
+    start = time.time()
+    for prefix in prefixes:
+        func(prefix)
+    return (time.time() - start) / len(prefixes)
+
+
+def run_benchmark(count=5000, queries=1000):
+    '''
+    measures the prefix queries of the glossary quick panel on a generated
+    document with count glossary entries and acronyms; the keys and the
+    prefixes are the same for each run
+
+    returns the lines of the report
+    '''
+    keys, content = _benchmark_document(count)
+    rand = random.Random(1)
+    prefixes = [
+        rand.choice(keys)[:rand.randint(1, 3)] for _ in range(queries)
+    ]
+
+    temp_path = tempfile.mkdtemp()
+    try:
+        tex_root = os.path.join(temp_path, 'benchmark.tex')
+        with open(tex_root, 'wb') as f:
+            f.write(content.encode('utf-8'))
+
+        start = time.time()
+        ana = analysis.analyze_document(tex_root)
+        analysis_time = time.time() - start
+    finally:
+        shutil.rmtree(temp_path, ignore_errors=True)
+
+    start = time.time()
+    index = SymbolIndex(ana)
+    build_time = time.time() - start
+
+    start = time.time()
+    index.symbols(GLOSSARY, prefixes[0])
+    sort_time = time.time() - start
+
+    # what the completions did before the index: filter the commands of
+    # the analysis on each query
+    def filter_analysis(prefix):
+        return [
+            c.args for c in ana.filter_commands(_GLOSSARY_COMMANDS)
+            if c.args.startswith(prefix)
+        ]
+
+    def query_index(prefix):
+        return index.quick_panel_entries(GLOSSARY, prefix)[1]
+
+    for prefix in prefixes:
+        if sorted(filter_analysis(prefix)) != sorted(query_index(prefix)):
+            raise AssertionError(
+                u'different results for the prefix {0}'.format(prefix))
+
+    filter_time = _time_queries(filter_analysis, prefixes)
+    index_time = _time_queries(query_index, prefixes)
+
+    return [
+        u'Symbol index benchmark: {0} glossary entries and acronyms, '
+        u'{1} prefix queries'.format(count, queries),
+        u'',
+        u'analysis of the document    {0:10.1f}ms'.format(
+            analysis_time * 1000),
+        u'building the index          {0:10.1f}ms'.format(build_time * 1000),
+        u'first query (sorts keys)    {0:10.1f}ms'.format(sort_time * 1000),
+        u'',
+        u'per query',
+        u'  filtering the analysis    {0:10.1f}us'.format(
+            filter_time * 1e6),
+        u'  querying the index        {0:10.1f}us'.format(index_time * 1e6),
+    ]
@@ -0,0 +1,312 @@
+'''
+Finds the files installed in the TEXMF trees, e.g. the packages, classes and
+bibliography styles.
+
+Trees with an ls-R database (as written by mktexlsr/texhash) are not walked;
+the file names are read from the database instead, which is only parsed
+again if it changes. All other trees are walked concurrently. The
+modification time of each walked directory is stored in a file in the
+global cache folder, so on the next scan a directory is only listed again if
+files have been added to or removed from it.
+'''
+from __future__ import print_function
+
+import io
+import os
+import threading
+import traceback
+
+import sublime
+
+if sublime.version() < '3000':
+    from latextools_utils import cache
+    from latextools_utils.six import strbase
+    from latextools_utils.system import make_dirs
+    from latextools_utils.utils import ThreadPool
+else:
+    from . import cache
+    from .six import strbase
+    from .system import make_dirs
+    from .utils import ThreadPool
+
+__all__ = ['find_files', 'find_ls_r', 'parse_ls_r', 'parse_ls_r_names']
+
+# the names of the ls-R databases
+LS_R_NAMES = ['ls-R', 'ls-r']
+
+# the index of the walked directories is stored in its own file, as it is
+# too large for the global cache, which writes all its keys on each change
+_DIRECTORY_INDEX_NAME = 'texmf_directories'
+_DIRECTORY_INDEX_VERSION = 1
+_directory_index_lock = threading.Lock()
+
+# the maximal number of trees walked at the same time
+_MAX_WALK_THREADS = 4
+
+# ls-R path -> (mtime, {directory: [entries]}, {entry: [directories]})
+_ls_r_databases = {}
+_ls_r_lock = threading.Lock()
+
+
+def find_ls_r(path):
+    '''
+    returns the path to the ls-R database of the tree containing path or
+    None if there is none
+    '''
+    path = os.path.normpath(path)
+    while True:
+        for name in LS_R_NAMES:
+            ls_r_path = os.path.join(path, name)
+            if os.path.isfile(ls_r_path):
+                return ls_r_path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _load_ls_r(ls_r_path):
+    try:
+        mtime = os.path.getmtime(ls_r_path)
+    except OSError:
+        return {}, {}
+
+    with _ls_r_lock:
+        try:
+            cached_mtime, directories, names = _ls_r_databases[ls_r_path]
+        except KeyError:
+            pass
+        else:
+            if cached_mtime == mtime:
+                return directories, names
+
+    root = os.path.dirname(ls_r_path)
+    directories = {}
+    names = {}
+    directory = entries = None
+    with io.open(ls_r_path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if not line or line.startswith('%'):
+                continue
+            if line.endswith(':'):
+                directory = os.path.normpath(os.path.join(root, line[:-1]))
+                entries = directories.setdefault(directory, [])
+            elif entries is not None:
+                entries.append(line)
+                names.setdefault(line, []).append(directory)
+
+    with _ls_r_lock:
+        _ls_r_databases[ls_r_path] = (mtime, directories, names)
+    return directories, names
+
+
+def parse_ls_r(ls_r_path):
+    '''
+    returns a dict mapping the absolute path of each directory listed in the
+    ls-R database to the names of its entries
+
+    the result is cached until the database changes
+    '''
+    return _load_ls_r(ls_r_path)[0]
+
+
+def parse_ls_r_names(ls_r_path):
+    '''
+    returns a dict mapping the name of each entry of the ls-R database to
+    the absolute paths of the directories containing it in the order of the
+    database
+
+    the result is cached until the database changes
+    '''
+    return _load_ls_r(ls_r_path)[1]
+
+
+def _files_from_ls_r(ls_r_path, paths):
+    '''
+    returns the files of the ls-R database in the directories below any of
+    the paths; the database is only scanned once for all paths
+    '''
+    directories = parse_ls_r(ls_r_path)
+    paths = set(paths)
+    root = os.path.dirname(ls_r_path)
+    files = []
+    for directory, entries in directories.items():
+        # check the directory and its parents up to the root of the tree
+        path = directory
+        while path not in paths:
+            parent = os.path.dirname(path)
+            if path == root or parent == path:
+                break
+            path = parent
+        else:
+            files.extend(entries)
+    return files
+
+
+if hasattr(os, 'scandir'):
+    def _list_directory(path):
+        files = []
+        sub_directories = []
+        for entry in os.scandir(path):
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            if not is_dir:
+                files.append(entry.name)
+            # like os.walk, we do not follow links to directories
+            elif not entry.is_symlink():
+                sub_directories.append(entry.name)
+        return files, sub_directories
+else:
+    def _list_directory(path):
+        files = []
+        sub_directories = []
+        for name in os.listdir(path):
+            entry_path = os.path.join(path, name)
+            if not os.path.isdir(entry_path):
+                files.append(name)
+            elif not os.path.islink(entry_path):
+                sub_directories.append(name)
+        return files, sub_directories
+
+
+def _walk_tree(path, old_directories):
+    '''
+    returns a dict mapping each directory of the tree to a tuple of its
+    mtime, its files and its sub directories; directories with the same mtime
+    as in old_directories are not listed again
+    '''
+    directories = {}
+    stack = [path]
+    while stack:
+        directory = stack.pop()
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            continue
+
+        entry = old_directories.get(directory)
+        if entry is None or entry[0] != mtime:
+            try:
+                files, sub_directories = _list_directory(directory)
+            except OSError:
+                continue
+            entry = (mtime, tuple(files), tuple(sub_directories))
+
+        directories[directory] = entry
+        stack.extend(os.path.join(directory, d) for d in entry[2])
+    return directories
+
+
+def _get_directory_index_file():
+    return os.path.join(cache._global_cache_path(), _DIRECTORY_INDEX_NAME)
+
+
+def _load_directories():
+    try:
+        with _directory_index_lock:
+            with open(_get_directory_index_file(), 'rb') as f:
+                version, directories = cache.pickle.load(f)
+        if version == _DIRECTORY_INDEX_VERSION:
+            return directories
+    except Exception:
+        # missing or from an incompatible version
+        pass
+    return {}
+
+
+def _save_directories(directories):
+    index_file = _get_directory_index_file()
+    try:
+        make_dirs(os.path.dirname(index_file))
+        with _directory_index_lock:
+            with open(index_file, 'wb') as f:
+                cache.pickle.dump(
+                    (_DIRECTORY_INDEX_VERSION, directories), f, protocol=-1)
+    except Exception:
+        print(u'error while writing the index of the TEXMF directories')
+        traceback.print_exc()
+
+
+def find_files(search_path, extensions=[]):
+    '''
+    returns a dict mapping each extension to the sorted names (without the
+    extension) of the files with that extension in the search path; if no
+    extensions are given, all files are returned under the key '*'
+
+    :param search_path:
+        the search path as returned by kpsewhich --show-path
+    '''
+    if isinstance(extensions, strbase):
+        extensions = [extensions]
+
+    files = []
+    # ls-R path -> the paths of the search path in its tree
+    ls_r_paths = {}
+    walk_paths = []
+    for path in search_path.split(os.pathsep):
+        # our current directory isn't usually meaningful from a WindowCommand
+        if path == '.':
+            continue
+
+        # !! sometimes occurs in the results on POSIX; remove them
+        path = path.replace(u'!!', u'')
+        path = os.path.normpath(path)
+        if not os.path.exists(path):  # ensure path exists
+            continue
+
+        ls_r_path = find_ls_r(path)
+        if ls_r_path is not None:
+            ls_r_paths.setdefault(ls_r_path, []).append(path)
+        elif path not in walk_paths:
+            walk_paths.append(path)
+
+    for ls_r_path, paths in ls_r_paths.items():
+        files.extend(_files_from_ls_r(ls_r_path, paths))
+
+    if walk_paths:
+        old_directories = _load_directories()
+        pool = ThreadPool(max_processes=_MAX_WALK_THREADS)
+        try:
+            results = [
+                pool.apply_async(_walk_tree, (path, old_directories))
+                for path in walk_paths
+            ]
+            directories = {}
+            for result in results:
+                directories.update(result.get())
+        finally:
+            pool.terminate()
+
+        for entry in directories.values():
+            files.extend(entry[1])
+
+        # keep the directories of the trees, which have not been walked
+        prefixes = tuple(path + os.sep for path in walk_paths)
+        for directory in old_directories:
+            if (
+                directory not in directories and
+                directory not in walk_paths and
+                not directory.startswith(prefixes)
+            ):
+                directories[directory] = old_directories[directory]
+
+        _save_directories(directories)
+
+    matched_files = {}
+    if extensions:
+        suffixes = [(ext, u''.join((os.extsep, ext))) for ext in extensions]
+        for f in files:
+            for ext, suffix in suffixes:
+                if f.endswith(suffix):
+                    matched_files.setdefault(ext, set()).add(
+                        f[:-len(suffix)])
+    else:
+        matched_files['*'] = set(os.path.splitext(f)[0] for f in files)
+
+    return dict(
+        (key, sorted(value, key=lambda s: s.lower()))
+        for key, value in matched_files.items()
+    )
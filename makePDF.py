@@ -6,13 +6,15 @@ if sublime.version() < '3000':
 	# we are on ST2 and Python 2.X
 	_ST3 = False
 	import getTeXRoot
-	import parseTeXlog
 	from latextools_plugin import (
 		add_plugin_path, get_plugin, NoSuchPluginException,
 		_classname_to_internal_name
 	)
 	from latextools_utils.is_tex_file import is_tex_file
 	from latextools_utils import get_setting
+	from latextools_utils.build_log import (
+		find_log_file, get_build_log, read_build_log
+	)
 	from latextools_utils.tex_directives import parse_tex_directives
 	from latextools_utils.external_command import (
 		execute_command, external_command, get_texpath, update_env,
@@ -25,19 +27,21 @@ if sublime.version() < '3000':
 	from latextools_utils.sublime_utils import (
 		get_project_file_name, parse_json_with_comments
 	)
-	from latextools_utils.utils import run_on_main_thread
+	from latextools_utils.utils import cpu_count, run_on_main_thread
 
 	strbase = basestring
 else:
 	_ST3 = True
 	from . import getTeXRoot
-	from . import parseTeXlog
 	from .latextools_plugin import (
 		add_plugin_path, get_plugin, NoSuchPluginException,
 		_classname_to_internal_name
 	)
 	from .latextools_utils.is_tex_file import is_tex_file
 	from .latextools_utils import get_setting
+	from .latextools_utils.build_log import (
+		find_log_file, get_build_log, read_build_log
+	)
 	from .latextools_utils.tex_directives import parse_tex_directives
 	from .latextools_utils.external_command import (
 		execute_command, external_command, get_texpath, update_env,
@@ -50,7 +54,7 @@ else:
 	from .latextools_utils.sublime_utils import (
 		get_project_file_name, parse_json_with_comments
 	)
-	from .latextools_utils.utils import run_on_main_thread
+	from .latextools_utils.utils import cpu_count, run_on_main_thread
 
 	strbase = str
 	long = int
@@ -65,7 +69,7 @@ import types
 import traceback
 import shutil
 import glob
-import re
+import time
 
 DEBUG = False
 
@@ -245,6 +249,265 @@ class LatextoolsBuildSelector(sublime_plugin.WindowCommand):
 			self.window.run_command('build')
 
 
+# Kills a running build process and all its children
+def kill_process(proc):
+	try:
+		if sublime.platform() == 'windows':
+			execute_command(
+				'taskkill /t /f /pid {pid}'.format(pid=proc.pid),
+				use_texpath=False
+			)
+		else:
+			os.killpg(proc.pid, signal.SIGTERM)
+	except:
+		print('Exception occurred while killing build')
+		traceback.print_exc()
+
+
+# Appends data (a string or a list of lines) to the output panel; must be
+# called on the main thread
+def append_output(output_view, data):
+	# decoding in thread, so we can pass coded and decoded data
+	# handle both lists and strings
+	# Need different handling for python 2 and 3
+	if not _ST3:
+		strdata = data if isinstance(data, types.StringTypes) else "\n".join(data)
+	else:
+		strdata = data if isinstance(data, str) else "\n".join(data)
+
+	# Normalize newlines, Sublime Text always uses a single \n separator
+	# in memory.
+	strdata = strdata.replace('\r\n', '\n').replace('\r', '\n')
+
+	selection_was_at_end = (len(output_view.sel()) == 1
+	    and output_view.sel()[0]
+	        == sublime.Region(output_view.size()))
+	output_view.set_read_only(False)
+	# Move this to a TextCommand for compatibility with ST3
+	output_view.run_command("do_output_edit", {"data": strdata, "selection_was_at_end": selection_was_at_end})
+	# edit = output_view.begin_edit()
+	# output_view.insert(edit, output_view.size(), strdata)
+	# if selection_was_at_end:
+	#     output_view.show(output_view.size())
+	# output_view.end_edit(edit)
+	output_view.set_read_only(True)
+
+
+# Copies the output of a successful build to the folder of the main tex file
+def copy_output_files(caller):
+	# if using output_directory, follow the copy_output_on_build setting
+	# files are copied to the same directory as the main tex file
+	if caller.output_directory is not None:
+		copy_on_build = get_setting('copy_output_on_build', True)
+		if copy_on_build is None or copy_on_build is True:
+			shutil.copy2(
+				os.path.join(
+					caller.output_directory,
+					caller.tex_base + u'.pdf'
+				),
+				os.path.dirname(caller.file_name)
+			)
+		elif isinstance(copy_on_build, list):
+			for ext in copy_on_build:
+				shutil.copy2(
+					os.path.join(
+						caller.output_directory,
+						caller.tex_base + ext
+					),
+					os.path.dirname(caller.file_name)
+				)
+
+
+# Formats the errors, warnings and bad boxes for the output panel
+def format_build_log(errors, warnings, badboxes, display_bad_boxes):
+	content = [""]
+	if errors:
+		content.append("Errors:")
+		content.append("")
+		content.extend(errors)
+	else:
+		content.append("No errors.")
+
+	if warnings:
+		if errors:
+			content.extend(["", "Warnings:"])
+		else:
+			content[-1] = content[-1] + " Warnings:"
+		content.append("")
+		content.extend(warnings)
+	else:
+		if errors:
+			content.append("")
+			content.append("No warnings.")
+		else:
+			content[-1] = content[-1] + " No warnings."
+
+	if badboxes and display_bad_boxes:
+		if warnings or errors:
+			content.extend(["", "Bad Boxes:"])
+		else:
+			content[-1] = content[-1] + " Bad Boxes:"
+		content.append("")
+		content.extend(badboxes)
+	else:
+		if display_bad_boxes:
+			if errors or warnings:
+				content.append("")
+				content.append("No bad boxes.")
+			else:
+				content[-1] = content[-1] + " No bad boxes."
+
+	return content
+
+
+# Sets up the builder for the tex root caller.file_name. Besides the builder
+# (caller.builder), this sets all other attributes CmdThread expects on its
+# caller. Returns False if the builder could not be created.
+def setup_builder(
+	caller, builder=None, program=None, command=None, env=None, path=None,
+	script_commands=None
+):
+	caller.tex_base = get_jobname(caller.file_name)
+	caller.tex_dir = os.path.dirname(caller.file_name)
+
+	caller.plat = sublime.platform()
+	if caller.plat == "osx":
+		caller.encoding = "UTF-8"
+	elif caller.plat == "windows":
+		caller.encoding = getOEMCP()
+	elif caller.plat == "linux":
+		caller.encoding = "UTF-8"
+	else:
+		sublime.error_message("Platform as yet unsupported. Sorry!")
+		return False
+
+	# Get platform settings, builder, and builder settings
+	platform_settings = get_setting(caller.plat, {})
+	caller.display_bad_boxes = get_setting("display_bad_boxes", False)
+
+	if builder is not None:
+		builder_name = builder
+	else:
+		builder_name = get_setting("builder", "traditional")
+
+	# Default to 'traditional' builder
+	if builder_name in ['', 'default']:
+		builder_name = 'traditional'
+
+	# this is to convert old-style names (e.g. AReallyLongName)
+	# to new style plugin names (a_really_long_name)
+	builder_name = _classname_to_internal_name(builder_name)
+
+	builder_settings = get_setting("builder_settings", {})
+
+	# override the command
+	if command is not None:
+		builder_settings.set("command", command)
+
+	# parse root for any %!TEX directives
+	tex_directives = parse_tex_directives(
+		caller.file_name,
+		multi_values=['options'],
+		key_maps={'ts-program': 'program'}
+	)
+
+	# determine the engine
+	if program is not None:
+		engine = program
+	else:
+		engine = tex_directives.get(
+			'program',
+			builder_settings.get("program", "pdflatex")
+		)
+
+	engine = engine.lower()
+
+	# Sanity check: if "strange" engine, default to pdflatex (silently...)
+	if engine not in [
+		'pdflatex', "pdftex", 'xelatex', 'xetex', 'lualatex', 'luatex'
+	]:
+		engine = 'pdflatex'
+
+	options = builder_settings.get("options", [])
+	if isinstance(options, strbase):
+		options = [options]
+
+	if 'options' in tex_directives:
+		options.extend(tex_directives['options'])
+
+	# filter out --aux-directory and --output-directory options which are
+	# handled separately
+	options = [opt for opt in options if (
+		not opt.startswith('--aux-directory') and
+		not opt.startswith('--output-directory') and
+		not opt.startswith('--jobname')
+	)]
+
+	caller.aux_directory = get_aux_directory(caller.file_name)
+	caller.output_directory = get_output_directory(caller.file_name)
+
+	# Read the env option (platform specific)
+	builder_platform_settings = builder_settings.get(caller.plat, {})
+
+	if env is not None:
+		caller.env = env
+	elif builder_platform_settings:
+		caller.env = builder_platform_settings.get("env", None)
+	else:
+		caller.env = None
+
+	# Safety check: if we are using a built-in builder, disregard
+	# builder_path, even if it was specified in the pref file
+	if builder_name in ['simple', 'traditional', 'script', 'basic']:
+		builder_path = None
+	else:
+		# relative to ST packages dir!
+		builder_path = get_setting("builder_path", "")
+
+	if builder_path:
+		bld_path = os.path.join(sublime.packages_path(), builder_path)
+		add_plugin_path(bld_path)
+
+	try:
+		builder = get_plugin('{0}_builder'.format(builder_name))
+	except NoSuchPluginException:
+		try:
+			builder = get_plugin(builder_name)
+		except NoSuchPluginException:
+			sublime.error_message(
+				"Cannot find builder {0}.\n"
+				"Check your LaTeXTools Preferences".format(builder_name)
+			)
+			return False
+
+	if builder_name == 'script' and script_commands:
+		builder_platform_settings['script_commands'] = script_commands
+		builder_settings[caller.plat] = builder_platform_settings
+
+	print(repr(builder))
+	caller.builder = builder(
+		caller.file_name,
+		caller.output,
+		engine,
+		options,
+		caller.aux_directory,
+		caller.output_directory,
+		caller.tex_base,
+		tex_directives,
+		builder_settings,
+		platform_settings
+	)
+
+	# Now get the tex binary path from prefs, change directory to
+	# that of the tex root file, and run!
+	if path is not None:
+		caller.path = expand_vars(path)
+	else:
+		caller.path = get_texpath() or expand_vars(os.environ['PATH'])
+
+	return True
+
+
 # First, define thread class for async processing
 
 class CmdThread ( threading.Thread ):
@@ -257,6 +520,7 @@ class CmdThread ( threading.Thread ):
 
 	def run ( self ):
 		print ("Welcome to thread " + self.getName())
+		start_time = time.time()
 		self.caller.output("[Compiling " + self.caller.file_name + "]")
 
 		env = dict(os.environ)
@@ -347,67 +611,21 @@ class CmdThread ( threading.Thread ):
 		cmd_iterator.close()
 
 		try:
-			# Here we try to find the log file...
-			# 1. Check the aux_directory if there is one
-			# 2. Check the output_directory if there is one
-			# 3. Assume the log file is in the same folder as the main file
-			log_file_base = self.caller.tex_base + ".log"
-			if self.caller.aux_directory is None:
-				if self.caller.output_directory is None:
-					log_file = os.path.join(
-						self.caller.tex_dir,
-						log_file_base
-					)
-				else:
-					log_file = os.path.join(
-						self.caller.output_directory,
-						log_file_base
-					)
-
-					if not os.path.exists(log_file):
-						log_file = os.path.join(
-							self.caller.tex_dir,
-							log_file_base
-						)
-			else:
-				log_file = os.path.join(
-					self.caller.aux_directory,
-					log_file_base
-				)
-
-				if not os.path.exists(log_file):
-					if (
-						self.caller.output_directory is not None and
-						self.caller.output_directory != self.caller.aux_directory
-					):
-						log_file = os.path.join(
-							self.caller.output_directory,
-							log_file_base
-						)
-
-					if not os.path.exists(log_file):
-						log_file = os.path.join(
-							self.caller.tex_dir,
-							log_file_base
-						)
+			# Here we try to find the log file; this checks the location
+			# found for the last build first, then
+			# 1. the aux_directory if there is one
+			# 2. the output_directory if there is one
+			# 3. the folder of the main file
+			log_file = find_log_file(
+				self.caller.file_name,
+				self.caller.tex_base,
+				self.caller.aux_directory,
+				self.caller.output_directory,
+				newer_than=start_time
+			)
 
-			# CHANGED 12-10-27. OK, here's the deal. We must open in binary mode
-			# on Windows because silly MiKTeX inserts ASCII control characters in
-			# over/underfull warnings. In particular it inserts EOFs, which
-			# stop reading altogether; reading in binary prevents that. However,
-			# that's not the whole story: if a FS character is encountered,
-			# AND if we invoke splitlines on a STRING, it sadly breaks the line
-			# in two. This messes up line numbers in error reports. If, on the
-			# other hand, we invoke splitlines on a byte array (? whatever read()
-			# returns), this does not happen---we only break at \n, etc.
-			# However, we must still decode the resulting lines using the relevant
-			# encoding.
-
-			# Note to self: need to think whether we don't want to codecs.open
-			# this, too... Also, we may want to move part of this logic to the
-			# builder...
-			with open(log_file, 'rb') as f:
-				data = f.read()
+			if not os.path.isfile(log_file):
+				raise IOError('{0} does not exist'.format(log_file))
 		except IOError:
 			traceback.print_exc()
 
@@ -424,50 +642,20 @@ class CmdThread ( threading.Thread ):
 			# if we got here, there shouldn't be a PDF at all
 			self.caller.finish(False)
 		else:
+			build_log = None
 			errors = []
 			warnings = []
 			badboxes = []
 
 			try:
-				(errors, warnings, badboxes) = parseTeXlog.parse_tex_log(
-					data, self.caller.tex_dir
+				# the log is parsed at most once; the result is stored in the
+				# local cache, so that it can be reused without reparsing it
+				# (see latextools_utils/build_log.py)
+				build_log = get_build_log(self.caller.file_name, log_file)
+				(errors, warnings, badboxes) = build_log.format()
+				content = format_build_log(
+					errors, warnings, badboxes, self.caller.display_bad_boxes
 				)
-				content = [""]
-				if errors:
-					content.append("Errors:")
-					content.append("")
-					content.extend(errors)
-				else:
-					content.append("No errors.")
-				
-				if warnings:
-					if errors:
-						content.extend(["", "Warnings:"])
-					else:
-						content[-1] = content[-1] + " Warnings:"
-					content.append("")
-					content.extend(warnings)
-				else:
-					if errors:
-						content.append("")
-						content.append("No warnings.")
-					else:
-						content[-1] = content[-1] + " No warnings."
-
-				if badboxes and self.caller.display_bad_boxes:
-					if warnings or errors:
-						content.extend(["", "Bad Boxes:"])
-					else:
-						content[-1] = content[-1] + " Bad Boxes:"
-					content.append("")
-					content.extend(badboxes)
-				else:
-					if self.caller.display_bad_boxes:
-						if errors or warnings:
-							content.append("")
-							content.append("No bad boxes.")
-						else:
-							content[-1] = content[-1] + " No bad boxes."
 
 				show_panel = {
 					"always": False,
@@ -526,10 +714,9 @@ class CmdThread ( threading.Thread ):
 			self.caller.output(content)
 			self.caller.output("\n\n[Done!]\n")
 
-			if _HAS_PHANTOMS:
-				self.caller.errors = locals().get("errors", [])
-				self.caller.warnings = locals().get("warnings", [])
-				self.caller.badboxes = locals().get("badboxes", [])
+			if _HAS_PHANTOMS and build_log is not None:
+				self.caller.build_log = build_log
+				self.caller.build_log_root = self.caller.file_name
 
 			self.caller.finish(len(errors) == 0)
 
@@ -540,9 +727,8 @@ class make_pdfCommand(sublime_plugin.WindowCommand):
 	errs_by_file = {}
 	phantom_sets_by_buffer = {}
 	show_errors_inline = True
-	errors = []
-	warnings = []
-	badboxes = []
+	build_log = None
+	build_log_root = None
 
 
 	def __init__(self, *args, **kwargs):
@@ -559,6 +745,7 @@ class make_pdfCommand(sublime_plugin.WindowCommand):
 	):
 		if update_phantoms_only:
 			if self.show_errors_inline:
+				self.load_build_log()
 				self.update_phantoms()
 			return
 
@@ -570,18 +757,7 @@ class make_pdfCommand(sublime_plugin.WindowCommand):
 		with self.proc_lock:
 			if self.proc:  # if we are running, try to kill running process
 				self.output("\n\n### Got request to terminate compilation ###")
-				try:
-					if sublime.platform() == 'windows':
-						execute_command(
-							'taskkill /t /f /pid {pid}'.format(pid=self.proc.pid),
-							use_texpath=False
-						)
-					else:
-						os.killpg(self.proc.pid, signal.SIGTERM)
-				except:
-					print('Exception occurred while killing build')
-					traceback.print_exc()
-
+				kill_process(self.proc)
 				self.proc = None
 				return
 			else: # either it's the first time we run, or else we have no running processes
@@ -607,7 +783,6 @@ class make_pdfCommand(sublime_plugin.WindowCommand):
 			sublime.error_message(self.file_name + ": file not found.")
 			return
 
-		self.tex_base = get_jobname(view)
 		self.tex_dir = os.path.dirname(self.file_name)
 
 		if not is_tex_file(self.file_name):
@@ -645,143 +820,14 @@ class make_pdfCommand(sublime_plugin.WindowCommand):
 		if self.hide_panel_level == "never":
 			self.show_output_panel(force=True)
 
-		self.plat = sublime.platform()
-		if self.plat == "osx":
-			self.encoding = "UTF-8"
-		elif self.plat == "windows":
-			self.encoding = getOEMCP()
-		elif self.plat == "linux":
-			self.encoding = "UTF-8"
-		else:
-			sublime.error_message("Platform as yet unsupported. Sorry!")
+		if not setup_builder(
+			self, builder=builder, program=program, command=command, env=env,
+			path=path, script_commands=script_commands
+		):
+			self.window.run_command(
+				'hide_panel', {"panel": "output.latextools"})
 			return
 
-		# Get platform settings, builder, and builder settings
-		platform_settings = get_setting(self.plat, {})
-		self.display_bad_boxes = get_setting("display_bad_boxes", False)
-
-		if builder is not None:
-			builder_name = builder
-		else:
-			builder_name = get_setting("builder", "traditional")
-
-		# Default to 'traditional' builder
-		if builder_name in ['', 'default']:
-			builder_name = 'traditional'
-
-		# this is to convert old-style names (e.g. AReallyLongName)
-		# to new style plugin names (a_really_long_name)
-		builder_name = _classname_to_internal_name(builder_name)
-
-		builder_settings = get_setting("builder_settings", {})
-
-		# override the command
-		if command is not None:
-			builder_settings.set("command", command)
-
-		# parse root for any %!TEX directives
-		tex_directives = parse_tex_directives(
-			self.file_name,
-			multi_values=['options'],
-			key_maps={'ts-program': 'program'}
-		)
-
-		# determine the engine
-		if program is not None:
-			engine = program
-		else:
-			engine = tex_directives.get(
-				'program',
-				builder_settings.get("program", "pdflatex")
-			)
-
-		engine = engine.lower()
-
-		# Sanity check: if "strange" engine, default to pdflatex (silently...)
-		if engine not in [
-			'pdflatex', "pdftex", 'xelatex', 'xetex', 'lualatex', 'luatex'
-		]:
-			engine = 'pdflatex'
-
-		options = builder_settings.get("options", [])
-		if isinstance(options, strbase):
-			options = [options]
-
-		if 'options' in tex_directives:
-			options.extend(tex_directives['options'])
-
-		# filter out --aux-directory and --output-directory options which are
-		# handled separately
-		options = [opt for opt in options if (
-			not opt.startswith('--aux-directory') and
-			not opt.startswith('--output-directory') and
-			not opt.startswith('--jobname')
-		)]
-
-		self.aux_directory = get_aux_directory(self.file_name)
-		self.output_directory = get_output_directory(self.file_name)
-
-		# Read the env option (platform specific)
-		builder_platform_settings = builder_settings.get(self.plat, {})
-
-		if env is not None:
-			self.env = env
-		elif builder_platform_settings:
-			self.env = builder_platform_settings.get("env", None)
-		else:
-			self.env = None
-
-		# Safety check: if we are using a built-in builder, disregard
-		# builder_path, even if it was specified in the pref file
-		if builder_name in ['simple', 'traditional', 'script', 'basic']:
-			builder_path = None
-		else:
-			# relative to ST packages dir!
-			builder_path = get_setting("builder_path", "")
-
-		if builder_path:
-			bld_path = os.path.join(sublime.packages_path(), builder_path)
-			add_plugin_path(bld_path)
-
-		try:
-			builder = get_plugin('{0}_builder'.format(builder_name))
-		except NoSuchPluginException:
-			try:
-				builder = get_plugin(builder_name)
-			except NoSuchPluginException:
-				sublime.error_message(
-					"Cannot find builder {0}.\n"
-					"Check your LaTeXTools Preferences".format(builder_name)
-				)
-				self.window.run_command(
-					'hide_panel', {"panel": "output.latextools"})
-				return
-
-		if builder_name == 'script' and script_commands:
-			builder_platform_settings['script_commands'] = script_commands
-			builder_settings[self.plat] = builder_platform_settings
-
-		print(repr(builder))
-		self.builder = builder(
-			self.file_name,
-			self.output,
-			engine,
-			options,
-			self.aux_directory,
-			self.output_directory,
-			self.tex_base,
-			tex_directives,
-			builder_settings,
-			platform_settings
-		)
-
-		# Now get the tex binary path from prefs, change directory to
-		# that of the tex root file, and run!
-		if path is not None:
-			self.path = expand_vars(path)
-		else:
-			self.path = get_texpath() or expand_vars(os.environ['PATH'])
-
 		thread = CmdThread(self)
 		thread.start()
 		print(threading.active_count())
@@ -818,30 +864,7 @@ class make_pdfCommand(sublime_plugin.WindowCommand):
 		#     str = "[Decode error - output not " + self.encoding + "]"
 		#     proc = None
 
-		# decoding in thread, so we can pass coded and decoded data
-		# handle both lists and strings
-		# Need different handling for python 2 and 3
-		if not _ST3:
-			strdata = data if isinstance(data, types.StringTypes) else "\n".join(data)
-		else:
-			strdata = data if isinstance(data, str) else "\n".join(data)
-
-		# Normalize newlines, Sublime Text always uses a single \n separator
-		# in memory.
-		strdata = strdata.replace('\r\n', '\n').replace('\r', '\n')
-
-		selection_was_at_end = (len(self.output_view.sel()) == 1
-		    and self.output_view.sel()[0]
-		        == sublime.Region(self.output_view.size()))
-		self.output_view.set_read_only(False)
-		# Move this to a TextCommand for compatibility with ST3
-		self.output_view.run_command("do_output_edit", {"data": strdata, "selection_was_at_end": selection_was_at_end})
-		# edit = self.output_view.begin_edit()
-		# self.output_view.insert(edit, self.output_view.size(), strdata)
-		# if selection_was_at_end:
-		#     self.output_view.show(self.output_view.size())
-		# self.output_view.end_edit(edit)
-		self.output_view.set_read_only(True)
+		append_output(self.output_view, data)
 
 	def show_output_panel(self, force=False):
 		if force or self.hide_panel_level != 'always':
@@ -867,27 +890,7 @@ class make_pdfCommand(sublime_plugin.WindowCommand):
 
 		# can_switch_to_pdf indicates a pdf should've been created
 		if can_switch_to_pdf:
-			# if using output_directory, follow the copy_output_on_build setting
-			# files are copied to the same directory as the main tex file
-			if self.output_directory is not None:
-				copy_on_build = get_setting('copy_output_on_build', True)
-				if copy_on_build is None or copy_on_build is True:
-					shutil.copy2(
-						os.path.join(
-							self.output_directory,
-							self.tex_base + u'.pdf'
-						),
-						os.path.dirname(self.file_name)
-					)
-				elif isinstance(copy_on_build, list):
-					for ext in copy_on_build:
-						shutil.copy2(
-							os.path.join(
-								self.output_directory,
-								self.tex_base + ext
-							),
-							os.path.dirname(self.file_name)
-						)
+			copy_output_files(self)
 
 			if get_setting('open_pdf_on_build', True):
 				self.view.run_command("jump_to_pdf", {"from_keybinding": False})
@@ -898,32 +901,24 @@ class make_pdfCommand(sublime_plugin.WindowCommand):
 
 	if _HAS_PHANTOMS:
 		def _find_errors(self, errors, error_class):
-			for line in errors:
-				m = self.file_regex.search(line)
-				if not m:
+			tex_dir = os.path.dirname(self.build_log_root)
+			for file, line, text in errors:
+				if file is None or line is None:
 					continue
-				groups = m.groups()
-				if len(groups) == 4:
-					file, line, column, text = groups
-				else:
-					continue
-				if line is None:
-					continue
-				line = int(line)
-				column = int(column) if column else 0
+				# mimic the file_regex, which only matches the message up to
+				# the first period, except on Windows
+				if sublime.platform() != 'windows':
+					text = text.split('.', 1)[0]
+					if not text:
+						continue
+				file = os.path.join(tex_dir, file)
 				if file not in self.errs_by_file:
 					self.errs_by_file[file] = []
-				self.errs_by_file[file].append((line, column, text, error_class))
+				self.errs_by_file[file].append((line, 0, text, error_class))
 
 		def create_errs_by_file(self):
-			file_regex = self.output_view.settings().get("result_file_regex")
-			if not file_regex:
-				return
 			self.errs_by_file = {}
-			try:
-				self.file_regex = re.compile(file_regex, re.MULTILINE)
-			except:
-				print("Cannot compile file regex.")
+			if self.build_log is None:
 				return
 			level_name = get_setting("show_error_phantoms")
 			level = {
@@ -934,11 +929,33 @@ class make_pdfCommand(sublime_plugin.WindowCommand):
 			}.get(level_name, 2)
 
 			if level >= 1:
-				self._find_errors(self.errors, "error")
+				self._find_errors(self.build_log.errors, "error")
 			if level >= 2:
-				self._find_errors(self.warnings, "warning")
+				self._find_errors(self.build_log.warnings, "warning")
 			if level >= 3:
-				self._find_errors(self.badboxes, "warning badbox")
+				self._find_errors(self.build_log.badboxes, "warning badbox")
+
+		# restores the phantoms of the last build from the local cache if
+		# this window has not run a build yet, e.g. after a restart
+		def load_build_log(self):
+			if self.build_log is not None:
+				return
+
+			view = self.window.active_view()
+			if view is None or view.file_name() is None:
+				return
+
+			tex_root = getTeXRoot.get_tex_root(view)
+			if tex_root is None:
+				return
+
+			build_log = read_build_log(tex_root)
+			if build_log is None:
+				return
+
+			self.build_log = build_log
+			self.build_log_root = tex_root
+			self.create_errs_by_file()
 
 		def update_phantoms(self):
 			stylesheet = """
@@ -1015,6 +1032,432 @@ class make_pdfCommand(sublime_plugin.WindowCommand):
 			self.hide_phantoms()
 
 
+# Shows the results of the last build of the current document in the output
+# panel; the log is only reparsed if it has changed since
+class LatextoolsShowBuildLogCommand(sublime_plugin.WindowCommand):
+
+	def run(self):
+		view = self.window.active_view()
+		if view is None or view.file_name() is None:
+			return
+
+		tex_root = getTeXRoot.get_tex_root(view)
+		build_log = read_build_log(tex_root)
+		if build_log is None:
+			sublime.status_message(
+				"No build results found for {0}".format(
+					os.path.basename(tex_root)
+				)
+			)
+			return
+
+		output_view = self.window.get_output_panel("latextools")
+		output_view_settings = output_view.settings()
+		if not output_view_settings.get("result_file_regex"):
+			build_settings = sublime.load_settings("LaTeX.sublime-build")
+			output_view_settings.set(
+				"result_file_regex",
+				build_settings.get(sublime.platform(), {}).get("file_regex", "")
+			)
+		output_view_settings.set("result_base_dir", os.path.dirname(tex_root))
+		output_view_settings.set("line_numbers", False)
+		output_view_settings.set("gutter", False)
+		output_view_settings.set("scroll_past_end", False)
+
+		errors, warnings, badboxes = build_log.format()
+		content = ["[Results of the last build of " + tex_root + "]"]
+		content.extend(format_build_log(
+			errors, warnings, badboxes,
+			get_setting("display_bad_boxes", False)
+		))
+
+		append_output(output_view, content)
+		output_view.run_command("do_finish_edit")
+
+		self.window.run_command("show_panel", {"panel": "output.latextools"})
+
+
+# Build queue: builds several tex roots, e.g. the standalone figures and the
+# chapters of a project, running up to build_queue_workers builds at the same
+# time. Jobs are started in the order given, but only after all the jobs
+# they depend on have been built successfully; if one of those fails, the
+# job is skipped.
+
+# A single job of the build queue; this is the caller for its CmdThread,
+# which buffers the output so that the output of concurrent builds is not
+# intermingled in the output panel
+class BuildJob(object):
+
+	class _Status(object):
+		success_message = None
+
+	def __init__(self, build_queue, file_name, name, depends, options):
+		self.build_queue = build_queue
+		self.file_name = file_name
+		self.name = name
+		self.depends = depends
+		self.options = options
+
+		self.proc = None
+		self.proc_lock = threading.RLock()
+		# the queue decides whether to show the panel
+		self.hide_panel_level = "always"
+		self.progress_indicator = BuildJob._Status()
+
+		self.thread = None
+		self.state = "pending"
+		self.success = None
+		self.start_time = None
+		self.end_time = None
+
+		self._output = []
+		self._output_lock = threading.Lock()
+
+	def output(self, data):
+		if not isinstance(data, strbase):
+			data = "\n".join(data)
+		with self._output_lock:
+			self._output.append(data)
+
+	def get_output(self):
+		with self._output_lock:
+			return "".join(self._output)
+
+	def show_output_panel(self, force=False):
+		pass
+
+	def finish(self, success):
+		self.build_queue.job_finished(self, success)
+
+	@property
+	def elapsed(self):
+		if self.start_time is None:
+			return 0
+		return (self.end_time or time.time()) - self.start_time
+
+
+class BuildQueue(threading.Thread):
+
+	def __init__(self, window, workers):
+		threading.Thread.__init__(self)
+		self.window = window
+		self.jobs = []
+		self.workers = workers
+		self.cancelled = False
+		self.output_view = None
+		self.progress_indicator = None
+
+		self._condition = threading.Condition()
+
+	def add_job(self, file_name, name, depends, options):
+		self.jobs.append(BuildJob(self, file_name, name, depends, options))
+
+	def output(self, data):
+		sublime.set_timeout(
+			functools.partial(append_output, self.output_view, data), 0)
+
+	# NB this must not acquire self._condition: the queue thread may be
+	# waiting for the main thread while holding it (e.g. in get_setting)
+	def cancel(self):
+		self.cancelled = True
+		for job in self.jobs:
+			with job.proc_lock:
+				if job.proc:
+					kill_process(job.proc)
+					job.proc = None
+
+	def job_finished(self, job, success):
+		with self._condition:
+			job.success = success
+			job.end_time = time.time()
+			self._condition.notify()
+
+	def _count(self, *states):
+		return len([j for j in self.jobs if j.state in states])
+
+	def _progress_message(self):
+		return "Building {0}/{1}".format(
+			self._count("succeeded", "failed", "skipped"), len(self.jobs))
+
+	def _report(self, job, message):
+		self.output("[{0}/{1}] {2}: {3}\n".format(
+			self._count("succeeded", "failed", "skipped"), len(self.jobs),
+			job.name, message
+		))
+
+	def _collect_finished_jobs(self):
+		for job in self.jobs:
+			if job.state != "running":
+				continue
+			if job.success is None:
+				if job.thread.is_alive():
+					continue
+				# CmdThread stopped without a result, e.g. if the command
+				# could not be executed
+				job.end_time = time.time()
+				job.success = False
+
+			if job.success:
+				job.state = "succeeded"
+				try:
+					copy_output_files(job)
+				except (IOError, OSError):
+					traceback.print_exc()
+			else:
+				job.state = "failed"
+
+			self._report(job, "{0} in {1:.2f}s".format(job.state, job.elapsed))
+			self.output(job.get_output() + "\n")
+
+	def _skip_blocked_jobs(self):
+		jobs_by_name = dict((job.name, job) for job in self.jobs)
+		changed = True
+		while changed:
+			changed = False
+			for job in self.jobs:
+				if job.state != "pending":
+					continue
+				if any(
+					jobs_by_name[d].state in ("failed", "skipped")
+					for d in job.depends
+				):
+					job.state = "skipped"
+					self._report(job, "skipped, a dependency failed")
+					changed = True
+
+	def _start_ready_jobs(self):
+		jobs_by_name = dict((job.name, job) for job in self.jobs)
+		running = self._count("running")
+		for job in self.jobs:
+			if running >= self.workers:
+				break
+			if job.state != "pending":
+				continue
+			if not all(
+				jobs_by_name[d].state == "succeeded" for d in job.depends
+			):
+				continue
+
+			job.start_time = time.time()
+			if not setup_builder(job, **job.options):
+				job.end_time = time.time()
+				job.state = "failed"
+				self._report(job, "failed, could not set up the builder")
+				continue
+
+			job.state = "running"
+
+			self._report(job, "started")
+			job.thread = CmdThread(job)
+			job.thread.start()
+			running += 1
+
+	def run(self):
+		start_time = time.time()
+		with self._condition:
+			while True:
+				self._collect_finished_jobs()
+				self._skip_blocked_jobs()
+				if not self.cancelled:
+					self._start_ready_jobs()
+
+				if self.progress_indicator is not None:
+					self.progress_indicator.message = self._progress_message()
+
+				if self._count("running") == 0:
+					break
+				self._condition.wait(0.2)
+
+			# whatever is left can never be built, e.g. due to circular
+			# dependencies, or the queue was cancelled
+			for job in self.jobs:
+				if job.state == "pending":
+					job.state = "skipped"
+					self._report(
+						job,
+						"skipped, the build was cancelled" if self.cancelled
+						else "skipped, unresolvable dependencies"
+					)
+
+		elapsed = time.time() - start_time
+		succeeded = self._count("succeeded")
+		failed = self._count("failed")
+		skipped = self._count("skipped")
+
+		content = ["", "[Built {0} document(s) in {1:.2f}s ({2:.2f}s of build time): {3} succeeded, {4} failed, {5} skipped]".format(
+			len(self.jobs), elapsed, sum(j.elapsed for j in self.jobs),
+			succeeded, failed, skipped
+		), ""]
+		name_length = max(len(job.name) for job in self.jobs)
+		for job in self.jobs:
+			content.append("  {0:<{1}}  {2:<9}  {3:>7.2f}s".format(
+				job.name, name_length, job.state, job.elapsed))
+		content.append("")
+		self.output(content)
+
+		if self.progress_indicator is not None:
+			message = "Build queue finished"
+			if failed or skipped:
+				message += " with {0} failed and {1} skipped".format(
+					failed, skipped)
+			self.progress_indicator.success_message = message
+
+		sublime.set_timeout(functools.partial(self.do_finish, failed or skipped), 0)
+
+	def do_finish(self, show_panel):
+		self.output_view.run_command("do_finish_edit")
+		if show_panel or get_setting("hide_build_panel", "no_warnings") != "always":
+			self.window.run_command(
+				"show_panel", {"panel": "output.latextools"})
+
+
+# Builds all tex roots specified in the "build_queue" setting (or the roots
+# argument), which is a list whose entries are either the path to a tex root
+# or a dictionary with the keys "root", "depends" (a list of paths of other
+# roots in the queue which have to be built first) and optionally "builder"
+# and "program"; relative paths are resolved relative to the project file.
+# Running the command while the queue is running cancels it.
+class LatextoolsBuildQueueCommand(sublime_plugin.WindowCommand):
+
+	queues = {}
+
+	def run(self, roots=None, workers=None):
+		build_queue = self.queues.get(self.window.id())
+		if build_queue is not None and build_queue.is_alive():
+			build_queue.output("\n\n### Got request to terminate compilation ###\n")
+			build_queue.cancel()
+			return
+
+		view = self.window.active_view()
+
+		if roots is None:
+			roots = get_setting("build_queue", [])
+		if not roots:
+			sublime.error_message(
+				"No documents to build. Please set the build_queue setting "
+				"in your project file."
+			)
+			return
+
+		project_file = get_project_file_name(view) if view else None
+		if project_file:
+			base_dir = os.path.dirname(project_file)
+		elif view is not None and view.file_name():
+			base_dir = os.path.dirname(view.file_name())
+		else:
+			base_dir = None
+
+		def resolve(path):
+			path = os.path.expanduser(path)
+			if not os.path.isabs(path) and base_dir is not None:
+				path = os.path.join(base_dir, path)
+			return os.path.normpath(path)
+
+		names_by_path = {}
+		entries = []
+		for entry in roots:
+			if isinstance(entry, strbase):
+				entry = {"root": entry}
+			try:
+				file_name = resolve(entry["root"])
+			except (KeyError, TypeError, AttributeError):
+				print(u"Invalid build_queue entry: {0!r}".format(entry))
+				continue
+
+			if not os.path.isfile(file_name) or not is_tex_file(file_name):
+				sublime.error_message(
+					"{0} is not a TeX source file: cannot compile.".format(
+						file_name))
+				return
+
+			if file_name in names_by_path:
+				continue
+
+			names_by_path[file_name] = entry["root"]
+			entries.append((file_name, entry))
+
+		if not entries:
+			return
+
+		if workers is None:
+			workers = get_setting("build_queue_workers", 0)
+		try:
+			workers = int(workers)
+		except ValueError:
+			workers = 0
+		if workers <= 0:
+			workers = cpu_count() or 1
+
+		build_queue = BuildQueue(self.window, workers)
+		for file_name, entry in entries:
+			depends = entry.get("depends", [])
+			if isinstance(depends, strbase):
+				depends = [depends]
+
+			depends_names = []
+			for d in depends:
+				try:
+					depends_names.append(names_by_path[resolve(d)])
+				except KeyError:
+					print(
+						u"Ignoring dependency {0} of {1}, which is not in "
+						u"the build queue".format(d, entry["root"]))
+
+			options = dict(
+				(key, entry[key]) for key in ("builder", "program")
+				if key in entry
+			)
+
+			build_queue.add_job(
+				file_name, names_by_path[file_name], depends_names, options
+			)
+
+		# save any open documents
+		for v in self.window.views():
+			if v.is_dirty() and v.file_name() and is_tex_file(v.file_name()):
+				v.run_command("save")
+
+		output_view = self.window.get_output_panel("latextools")
+		output_view_settings = output_view.settings()
+		build_settings = sublime.load_settings("LaTeX.sublime-build")
+		output_view_settings.set(
+			"result_file_regex",
+			build_settings.get(sublime.platform(), {}).get("file_regex", "")
+		)
+		if base_dir is not None:
+			output_view_settings.set("result_base_dir", base_dir)
+		output_view_settings.set("line_numbers", False)
+		output_view_settings.set("gutter", False)
+		output_view_settings.set("scroll_past_end", False)
+		if get_setting("highlight_build_panel", True):
+			output_view.set_syntax_file(
+				"Packages/LaTeXTools/LaTeXTools Console.hidden-tmLanguage"
+			)
+		output_view.set_read_only(True)
+		self.window.get_output_panel("latextools")
+
+		build_queue.output_view = output_view
+		build_queue.output(
+			"[Building {0} document(s) using {1} worker(s)]\n\n".format(
+				len(build_queue.jobs), workers))
+
+		if get_setting("hide_build_panel", "no_warnings") == "never":
+			self.window.run_command(
+				"show_panel", {"panel": "output.latextools"})
+
+		self.queues[self.window.id()] = build_queue
+		build_queue.start()
+
+		display_message_length = long(
+			get_setting('build_finished_message_length', 2.0) * 1000
+		)
+		build_queue.progress_indicator = ProgressIndicator(
+			build_queue, build_queue._progress_message(),
+			'Build queue failed',
+			display_message_length=display_message_length
+		)
+
+
 class DoOutputEditCommand(sublime_plugin.TextCommand):
 	def run(self, edit, data, selection_was_at_end):
 		self.view.insert(edit, self.view.size(), data)
@@ -3,8 +3,11 @@ from __future__ import print_function
 
 import re
 import sys
+import time
 import os.path
 
+from collections import namedtuple
+
 
 # To accommodate both Python 2 and 3
 if sys.version_info >= (3,):
@@ -32,11 +35,20 @@ def debug(s):
 # Return value: the question is, "Should I skip this file?" Hence:
 # 	True means YES, DO SKIP IT, IT IS NOT A FILE
 #	False means NO, DO NOT SKIP IT, IT IS A FILE
-def debug_skip_file(f, root_dir):
+#
+# With assume_tex_files, the heuristics are applied without debugging, so the
+# files of the TeX distributions are recognized even if they do not exist
+def debug_skip_file(f, root_dir, assume_tex_files=False):
+	verbose = interactive or print_debug
 	# If we are not debugging, then it's not a file for sure, so skip it
 	# if not (print_debug or interactive):
-	if not (interactive or print_debug):
+	if not (verbose or assume_tex_files):
 		return True
+
+	def report(s):
+		if verbose:
+			print(s)
+
 	debug("debug_skip_file: " + f)
 	f_ext = os.path.splitext(f)[1].lower()[1:]
 	# Heuristic: TeXlive on Mac or Linux (well, Ubuntu at least) or Windows / MiKTeX
@@ -46,52 +58,52 @@ def debug_skip_file(f, root_dir):
 	if (f_ext in known_file_exts) and \
 	   (("/usr/local/texlive/" in f) or ("/usr/share/texlive/" in f) or ("Program Files\\MiKTeX" in f) \
 	   	or re.search(r"\\MiKTeX(?:\\| )\d\.\d+\\tex",f)) or ("\\MiKTeX\\tex\\" in f):
-		print ("TeXlive / MiKTeX FILE! Don't skip it!")
+		report("TeXlive / MiKTeX FILE! Don't skip it!")
 		return False
 	if (f_ext in known_file_exts and re.search(r'(\\|/)texmf\1', f, re.I)):
-		print ("File in TEXMF tree! Don't skip it!")
+		report("File in TEXMF tree! Don't skip it!")
 		return False
 	# Heuristic: "version 2010.12.02"
 	if re.match(r"version \d\d\d\d\.\d\d\.\d\d", f):
-		print ("Skip it!")
+		report("Skip it!")
 		return True
 	# Heuristic: TeX Live line
 	if re.match(r"TeX Live 20\d\d(/Debian)?\) \(format", f):
-		print ("Skip it!")
+		report("Skip it!")
 		return True
 	# Heuristic: MiKTeX line
 	if re.match("MiKTeX \d\.\d\d?",f):
-		print ("Skip it!")
+		report("Skip it!")
 		return True
 	# Heuristic: no two consecutive spaces in file name
 	if "  " in f:
-		print ("Skip it!")
+		report("Skip it!")
 		return True
 	# Heuristic: various diagnostic messages
 	if f=='e.g.,' or "ext4): destination with the same identifier" in f or "Kristoffer H. Rose" in f:
-		print ("Skip it!")
+		report("Skip it!")
 		return True
 	# Heuristic: file in local directory with .tex ending
 	file_exts = extra_file_ext + ['tex', 'aux', 'bbl', 'cls', 'sty', 'out', 'toc', 'dbx']
 	if (f.startswith(root_dir) or f[0:2] in ['./', '.\\', '..']) and f_ext in file_exts:
-		print ("File! Don't skip it")
+		report("File! Don't skip it")
 		return False
 
 	# Heuristic: absolute path that looks like home directory
 	if f[0] == '/':
 		if f.split('/')[1] in ['home', 'Users']:
-			print("Assuming home directory file. Don't skip!")
+			report("Assuming home directory file. Don't skip!")
 			return False
 	# N.B. this is not a good technique for detecting the user folder
 	# on Windows, but is hopefully "good enough" for the common configuration
 	# (given that this will not usually be run on the computer that generated
 	# the log)
 	elif re.match(r'^[A-Z]:\\(?:Documents and Settings|Users)\\', f):
-		print("Assuming home directory file. Don't skip!")
+		report("Assuming home directory file. Don't skip!")
 		return False
 
 	if not interactive:
-		print("Automatically skipping")
+		report("Automatically skipping")
 		return True
 
 	if sys.version_info < (3,):
@@ -107,11 +119,40 @@ def debug_skip_file(f, root_dir):
 		return False
 
 
+# A single error, warning or bad box found in the log
+#	file: the file TeX was processing (or "[no file]"); None if the message is
+#		not associated with any location
+#	line: the line number as an int; None if not known
+#	message: the message itself
+LogEntry = namedtuple('LogEntry', ['file', 'line', 'message'])
+
+
+# Format a LogEntry as displayed in the output panel, i.e. as
+# "file:line: message"
+def format_log_entry(entry):
+	file_name, line, message = entry
+	if file_name is None:
+		return message
+	elif line is None:
+		return file_name + ": " + message
+	else:
+		return file_name + ":" + str(line) + ": " + message
+
+
 # More robust parsing code: October / November 2012
 # Input: tex log file, read in **binary** form, unprocessed
 # Output: content to be displayed in output panel, split into lines
 
-def parse_tex_log(data, root_dir):
+def parse_tex_log(data, root_dir, assume_tex_files=False):
+	return tuple(
+		[format_log_entry(e) for e in entries]
+		for entries in parse_tex_log_entries(data, root_dir, assume_tex_files)
+	)
+
+
+# Same as parse_tex_log, but returns lists of LogEntry tuples, so that the
+# results can be used without splitting the formatted lines again
+def parse_tex_log_entries(data, root_dir, assume_tex_files=False):
 	debug("Parsing log file")
 	errors = []
 	warnings = []
@@ -130,8 +171,8 @@ def parse_tex_log(data, root_dir):
 		log = [(l.decode(guessed_encoding, 'ignore'), len(l))  for l in data.splitlines()]
 	except UnicodeError:
 		debug("log file not in UTF-8 encoding!")
-		errors.append("ERROR: your log file is not in UTF-8 encoding.")
-		errors.append("Sorry, I can't process this file")
+		errors.append(LogEntry(None, None, "ERROR: your log file is not in UTF-8 encoding."))
+		errors.append(LogEntry(None, None, "Sorry, I can't process this file"))
 		return (errors, warnings, badboxes)
 
 	# loop over all log lines; construct error message as needed
@@ -168,6 +209,8 @@ def parse_tex_log(data, root_dir):
 	# from being considered files
 	file_badmatch_rx = re.compile(r"^\s*\([a-zA-Z]+\)\s{4,}.+")
 	pagenum_begin_rx = re.compile(r"\s*\[\d*(.*)")
+	# a run of complete page numbers, e.g. " [1] [2] [3]"
+	pagenum_run_rx = re.compile(r"(?:\s*\[\d+\])+")
 	line_rx = re.compile(r"^l\.(\d+)\s(.*)")  # l.nn <text>
 
 	warning_rx = re.compile(r"^(.*?) Warning: (.+)") # Warnings, first line
@@ -199,9 +242,9 @@ def parse_tex_log(data, root_dir):
 
 		if warn_match_line:
 			warn_line = warn_match_line.group(1)
-			warnings.append(location + ":" + warn_line + ": " + l)
+			warnings.append(LogEntry(location, int(warn_line), l))
 		else:
-			warnings.append(location + ": " + l)
+			warnings.append(LogEntry(location, None, l))
 
 	# Support function to handle bad boxes
 	def handle_badbox(l):
@@ -216,9 +259,9 @@ def parse_tex_log(data, root_dir):
 
 		if badbox_match_line:
 			badbox_line = badbox_match_line.group(1)
-			badboxes.append(location + ":" + badbox_line + ": " + l)
+			badboxes.append(LogEntry(location, int(badbox_line), l))
 		else:
-			badboxes.append(location + ": " + l)
+			badboxes.append(LogEntry(location, None, l))
 	
 	# State definitions
 	STATE_NORMAL = 0
@@ -273,6 +316,7 @@ def parse_tex_log(data, root_dir):
 			recycle_extra = False
 			# HEURISTIC: check first if we just have a long "(.../file.tex" (or similar) line
 			# A bit inefficient as we duplicate some of the code below for filename matching
+			file_name = None
 			file_match = file_rx.match(line)
 			if file_match:
 				if line.startswith('runsystem') or file_badmatch_rx.match(line):
@@ -306,7 +350,7 @@ def parse_tex_log(data, root_dir):
 					debug("only one quote, extending")
 				# Now we have a long line consisting of a potential file name alone
 				# Check if it really is a file name
-				elif (not os.path.isfile(file_name)) and debug_skip_file(file_name, root_dir):
+				elif (not os.path.isfile(file_name)) and debug_skip_file(file_name, root_dir, assume_tex_files):
 					debug("Not a file name")
 				else:
 					debug("IT'S A (LONG) FILE NAME WITH NO EXTRA TEXT")
@@ -345,8 +389,8 @@ def parse_tex_log(data, root_dir):
 					# if the "extra" (next line) starts with a ( and we already have a
 					# valid file, this likely starts something else we need to
 					# process as a file, so add a space...
-					elif extralen > 0 and extra[0] == '(' and (
-						os.path.isfile(file_name) or not debug_skip_file(file_name, root_dir)
+					elif extralen > 0 and extra[0] == '(' and file_name is not None and (
+						os.path.isfile(file_name) or not debug_skip_file(file_name, root_dir, assume_tex_files)
 					):
 						line += " " + extra
 						debug("Extended: " + line)
@@ -390,7 +434,7 @@ def parse_tex_log(data, root_dir):
 			else:
 				location = files[-1]
 			debug("Found error: " + err_msg)		
-			errors.append(location + ":" + err_line + ": " + err_msg + " [" + err_text + "]")
+			errors.append(LogEntry(location, int(err_line), err_msg + " [" + err_text + "]"))
 			continue
 		if state == STATE_REPORT_WARNING:
 			# add current line and check if we are done or not
@@ -442,8 +486,8 @@ def parse_tex_log(data, root_dir):
 			file_name, linelen = advance_iterator(log_iterator) #      \par
 			file_name, linelen = advance_iterator(log_iterator)
 			file_name = file_name[3:] # here is the file name with <*> in front
-			errors.append("TeX STOPPED: " + line[2:-2]+prev_line[:-5])
-			errors.append("TeX reports the error was in file:" + file_name)
+			errors.append(LogEntry(None, None, "TeX STOPPED: " + line[2:-2]+prev_line[:-5]))
+			errors.append(LogEntry(None, None, "TeX reports the error was in file:" + file_name))
 			continue
 
 		# Here, make sure there was no uncaught error, in which case we do more special processing
@@ -451,7 +495,7 @@ def parse_tex_log(data, root_dir):
 		if "==> Fatal error occurred," in line:
 			debug("Fatal error detected")
 			if errors == []:
-				errors.append("TeX STOPPED: fatal errors occurred. Check the TeX log file for details")
+				errors.append(LogEntry(None, None, "TeX STOPPED: fatal errors occurred. Check the TeX log file for details"))
 			continue
 
 		# If tex just stops processing, we will be left with files on stack, so we keep track of it
@@ -465,7 +509,7 @@ def parse_tex_log(data, root_dir):
 		# we have to do differently from above (need to double-check: why not stop processing if
 		# emergency stop, too?)
 		if "(That makes 100 errors; please try again.)" in line:
-			errors.append("Too many errors. TeX stopped.")
+			errors.append(LogEntry(None, None, "Too many errors. TeX stopped."))
 			debug("100 errors, stopping")
 			break
 
@@ -495,8 +539,8 @@ def parse_tex_log(data, root_dir):
 					current_badbox += line
 
 			if ou_processing:
-				warnings.append("Malformed LOG file: over/underfull")
-				warnings.append("Please let me know via GitHub")
+				warnings.append(LogEntry(None, None, "Malformed LOG file: over/underfull"))
+				warnings.append(LogEntry(None, None, "Please let me know via GitHub"))
 				break
 			else:
 				handle_badbox(current_badbox)
@@ -547,7 +591,10 @@ def parse_tex_log(data, root_dir):
 
 		# Special case: xypic's "loaded)" at the BEGINNING of a line. Will check later
 		# for matches AFTER other text.
-		xypic_match = xypic_begin_rx.match(line)
+		# NOTE: the substring test is much cheaper than the regex, which otherwise
+		# rescans the remainder of long lines (e.g. "[1] [2] [3] ...") every time
+		# we reprocess them
+		xypic_match = "loaded)" in line and xypic_begin_rx.match(line)
 		if xypic_match:
 			debug("xypic match before: " + line)
 			# Do an extra check to make sure we are not too eager: is the topmost file
@@ -586,6 +633,15 @@ def parse_tex_log(data, root_dir):
 				debug("PERR [')' no files] (%d)" % (line_num,))
 				break
 
+		# Runs of page numbers: skip them all at once, as reprocessing the rest of
+		# the line after each of them is quadratic in the length of the run
+		pagenum_run_match = pagenum_run_rx.match(line)
+		if pagenum_run_match:
+			extra = line[pagenum_run_match.end():]
+			debug("Reprocessing " + extra)
+			reprocess_extra = True
+			continue
+
 		# Opening page indicators: skip and reprocess
 		# Note: here we look for matches at the BEGINNING of a line. We check again below
 		# for matches elsewhere, but AFTER matching for file names.
@@ -648,7 +704,7 @@ def parse_tex_log(data, root_dir):
 				file_name = file_name[:-6]
 				extra = "pdfTeX" + extra
 			# This kills off stupid matches
-			if (not os.path.isfile(file_name)) and debug_skip_file(file_name, root_dir):
+			if (not os.path.isfile(file_name)) and debug_skip_file(file_name, root_dir, assume_tex_files):
 				#continue
 				# NOTE BIG CHANGE HERE: CONTINUE PROCESSING IF NO MATCH
 				pass
@@ -670,7 +726,7 @@ def parse_tex_log(data, root_dir):
 		# AFTER looking for file matches. The problem is that we
 		# may have the " loaded)" marker either after non-file text, or after a loaded
 		# file name. Aaaarghh!!!
-		xypic_match = xypic_rx.match(line)
+		xypic_match = "loaded)" in line and xypic_rx.match(line)
 		if xypic_match:
 			debug("xypic match after: " + line)
 			# Do an extra check to make sure we are not too eager: is the topmost file
@@ -693,8 +749,8 @@ def parse_tex_log(data, root_dir):
 				err_msg = line[1:].strip() # remove '!' and possibly spaces
 				# This may or may not have a file location associated with it. 
 				# Be conservative and do not try to report one.
-				errors.append(err_msg)
-				errors.append("Check the TeX log file for more information")
+				errors.append(LogEntry(None, None, err_msg))
+				errors.append(LogEntry(None, None, "Check the TeX log file for more information"))
 				continue
 			# Now it's a regular TeX error 
 			err_msg = line[2:] # skip "! "
@@ -726,16 +782,230 @@ def parse_tex_log(data, root_dir):
 
 	# If there were parsing issues, output them to debug
 	if parsing:
-		warnings.append("(Log parsing issues. Disregard unless something else is wrong.)")
+		warnings.append(LogEntry(None, None, "(Log parsing issues. Disregard unless something else is wrong.)"))
 		print_debug = True
 		for l in parsing:
 			debug(l)
 	return (errors, warnings, badboxes)
 
 
+# Regression and throughput harness
+#
+# Usage:
+#	python parseTeXlog.py --benchmark [--update] [--repeat N] [--max-seconds S]
+#		[--min-lines-per-second N] [--synthetic] [--assume-tex-files]
+#		[<log file or directory> ...]
+#
+# Every .log file (directories are searched recursively) is parsed using the
+# non-interactive heuristics, i.e. exactly as during a build, with the folder
+# of the log as root directory. If a golden file "<name>.log.json" exists next
+# to the log, the result is compared against it; --update (re)writes the golden
+# files instead. Paths below the root directory are stored as "$ROOT", so
+# golden files can be shared between machines.
+#
+# Each log is parsed --repeat times and the best time is used to report the
+# throughput in lines per second. A log is reported as SLOW if it takes longer
+# than --max-seconds or is parsed at less than --min-lines-per-second; this is
+# how we catch regexes which backtrack badly on unusual input.
+#
+# --synthetic additionally runs a set of generated stress logs (deeply nested
+# file stacks, long runs of page numbers, MiKTeX control characters, ...), for
+# which only the throughput is checked.
+#
+# Without any log files, the corpus in tests/parseTeXlog is checked. It
+# contains logs of pdfTeX (TeX Live and MiKTeX), XeTeX and LuaTeX with their
+# golden files. As the files of the TeX distribution named in these logs do
+# not exist on most machines, they are parsed with --assume-tex-files, which
+# uses the heuristics of the interactive mode to recognize the files of the
+# TeX distributions instead of checking whether they exist.
+#
+# The exit status is 1 if any log failed to parse, did not match its golden
+# file or was too slow.
+
+GOLDEN_EXT = ".json"
+ROOT_PLACEHOLDER = "$ROOT"
+CORPUS_DIR = os.path.join(
+	os.path.dirname(os.path.abspath(__file__)), "tests", "parseTeXlog")
+
+
+def _wrap_log_lines(text):
+	# TeX breaks all log lines at 79 characters
+	return "\n".join(text[i:i + 79] for i in range(0, len(text), 79))
+
+
+def _synthetic_logs():
+	header = "This is pdfTeX, Version 3.14159265-2.6-1.40.17 (TeX Live 2016) (preloaded format=pdflatex)\n"
+	footer = "\nHere is how much of TeX's memory you used:\n"
+	logs = []
+
+	depth = 500
+	nested = "".join("(./nested{0}.tex\n".format(i) for i in range(depth))
+	nested += "".join(")" for _ in range(depth))
+	logs.append(("nested file stack", header + nested + footer))
+
+	pages = _wrap_log_lines(" ".join("[{0}]".format(i) for i in range(1, 5000)))
+	logs.append(("long page number run", header + "(./main.tex " + pages + ")" + footer))
+
+	badboxes = "".join(
+		"Overfull \\hbox (1.{0}pt too wide) in paragraph at lines {0}--{1}\n"
+		"[]\\T1/cmr/m/n/10 text\x1c with\x1a control\x1e chars\n"
+		" []\n\n".format(i, i + 1)
+		for i in range(2000)
+	)
+	logs.append(("MiKTeX control characters", header + "(./main.tex\n" + badboxes + ")" + footer))
+
+	warnings = "".join(
+		_wrap_log_lines(
+			"LaTeX Warning: Reference `{0}' on page 1 undefined on input line {1}. ".format(
+				"a" * 200, i)
+		) + "\n"
+		for i in range(2000)
+	)
+	logs.append(("long wrapped warnings", header + "(./main.tex\n" + warnings + ")" + footer))
+
+	parens = _wrap_log_lines("(" + "a." * 20000)
+	logs.append(("unterminated file name", header + parens + footer))
+
+	return [(name, data.encode("utf-8")) for name, data in logs]
+
+
+def _find_logs(paths):
+	logs = []
+	for path in paths:
+		if os.path.isdir(path):
+			for dir_name, _, files in os.walk(path):
+				logs.extend(
+					os.path.join(dir_name, f) for f in sorted(files)
+					if f.endswith(".log")
+				)
+		else:
+			logs.append(path)
+	return logs
+
+
+def _replace_root(entries, root_dir):
+	root = os.path.normpath(root_dir) + os.sep
+	return [e.replace(root, ROOT_PLACEHOLDER + os.sep) for e in entries]
+
+
+def _time_parse(data, root_dir, repeat, assume_tex_files=False):
+	best = None
+	for _ in range(max(repeat, 1)):
+		start = time.time()
+		result = parse_tex_log(data, root_dir, assume_tex_files)
+		elapsed = time.time() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return result, best
+
+
+def _benchmark(args):
+	import argparse
+	import json
+
+	parser = argparse.ArgumentParser(
+		prog="parseTeXlog.py --benchmark",
+		description="Regression and throughput harness for parse_tex_log")
+	parser.add_argument("paths", nargs="*")
+	parser.add_argument("--update", action="store_true",
+		help="write the golden files instead of comparing against them")
+	parser.add_argument("--repeat", type=int, default=3)
+	parser.add_argument("--max-seconds", type=float, default=5.0)
+	parser.add_argument("--min-lines-per-second", type=float, default=0)
+	parser.add_argument("--synthetic", action="store_true",
+		help="also run the built-in stress logs")
+	parser.add_argument("--assume-tex-files", action="store_true",
+		help="recognize the files of the TeX distributions by their path "
+			"instead of checking whether they exist")
+	options = parser.parse_args(args)
+
+	if not options.paths:
+		options.paths = [CORPUS_DIR]
+		options.assume_tex_files = True
+
+	jobs = [(f, None) for f in _find_logs(options.paths)]
+	if options.synthetic:
+		jobs.extend(_synthetic_logs())
+	if not jobs:
+		parser.error("no log files given")
+
+	failed = False
+	total_lines = 0
+	total_time = 0
+	print("{0:>10} {1:>9} {2:>12}  {3}".format("lines", "seconds", "lines/sec", "log"))
+	for name, data in jobs:
+		if data is None:
+			with open(name, "rb") as f:
+				data = f.read()
+			root_dir = os.path.dirname(os.path.abspath(name))
+		else:
+			root_dir = os.getcwd()
+
+		num_lines = len(data.splitlines())
+		status = []
+		try:
+			result, elapsed = _time_parse(
+				data, root_dir, options.repeat, options.assume_tex_files)
+		except Exception:
+			import traceback
+			traceback.print_exc()
+			print("{0:>10} {1:>9} {2:>12}  {3} [EXCEPTION]".format(num_lines, "-", "-", name))
+			failed = True
+			continue
+
+		lines_per_second = num_lines / elapsed if elapsed > 0 else float("inf")
+		total_lines += num_lines
+		total_time += elapsed
+
+		if (elapsed > options.max_seconds or
+				lines_per_second < options.min_lines_per_second):
+			status.append("SLOW")
+
+		if os.path.isfile(name):
+			result = dict(zip(
+				("errors", "warnings", "badboxes"),
+				(_replace_root(r, root_dir) for r in result)
+			))
+			golden_file = name + GOLDEN_EXT
+			if options.update:
+				with open(golden_file, "w") as f:
+					json.dump(result, f, indent=1, sort_keys=True)
+				status.append("UPDATED")
+			elif os.path.isfile(golden_file):
+				with open(golden_file, "r") as f:
+					expected = json.load(f)
+				mismatched = [
+					key for key in sorted(expected)
+					if expected[key] != result.get(key)
+				]
+				if mismatched:
+					status.append("MISMATCH: " + ", ".join(mismatched))
+				else:
+					status.append("OK")
+			else:
+				status.append("NO GOLDEN FILE")
+
+		if any(s == "SLOW" or s.startswith("MISMATCH") for s in status):
+			failed = True
+
+		print("{0:>10} {1:>9.4f} {2:>12.0f}  {3}{4}".format(
+			num_lines, elapsed, lines_per_second, name,
+			" [{0}]".format("; ".join(status)) if status else ""))
+
+	if total_time > 0:
+		print("")
+		print("Total: {0} lines in {1:.4f} seconds ({2:.0f} lines/sec)".format(
+			total_lines, total_time, total_lines / total_time))
+
+	return 1 if failed else 0
+
+
 # If invoked from the command line, parse provided log file
 
 if __name__ == '__main__':
+	if len(sys.argv) > 1 and sys.argv[1] == "--benchmark":
+		sys.exit(_benchmark(sys.argv[2:]))
+
 	print_debug = True
 	interactive = True
 	try:
@@ -1,7 +1,5 @@
-import imghdr
 import inspect
 import os
-import struct
 import threading
 import types
 
@@ -14,21 +12,31 @@ from ..jumpto_tex_file import open_image, find_image
 from ..latextools_utils import cache, get_setting
 from . import preview_utils
 from .preview_utils import (
-    convert_installed, run_convert_command, ghostscript_installed,
-    run_ghostscript_command
+    TempFileIndex, convert_installed, run_convert_command, get_image_size,
+    get_temp_size_limit, ghostscript_installed, run_ghostscript_command,
+    save_image_sizes
 )
 from . import preview_threading as pv_threading
 
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 # export the listeners
 exports = ["PreviewImageHoverListener", "PreviewImagePhantomListener"]
 
 # the path to the temp files (set on loading)
 temp_path = None
+# the index of the temp files (set on loading)
+_temp_file_index = None
 
 # we use png files for the html popup
 _IMAGE_EXTENSION = ".png"
 # we add this extension to log error information
 _ERROR_EXTENSION = ".err"
+# the maximal number of thumbnails created by one process
+_BATCH_SIZE = 10
 
 _lt_settings = {}
 
@@ -41,28 +49,31 @@ def _on_setting_change():
         "preview_max_convert_threads", default=None, view={})
     if max_threads is not None:
         pv_threading.set_max_threads(max_threads)
+    if _temp_file_index is not None:
+        _temp_file_index.set_max_size(get_temp_size_limit(_name))
 
 
 def plugin_loaded():
-    global _lt_settings, temp_path
+    global _lt_settings, temp_path, _temp_file_index
     _lt_settings = sublime.load_settings("LaTeXTools.sublime-settings")
 
     temp_path = os.path.join(cache._global_cache_path(), _name)
     # validate the temporary file directory is available
     if not os.path.exists(temp_path):
         os.makedirs(temp_path)
+    _temp_file_index = TempFileIndex(temp_path)
 
     # init all variables
     _on_setting_change()
     # add a callback to setting changes
     _lt_settings.add_on_change("lt_preview_image_main", _on_setting_change)
 
-    # register the temp folder for auto deletion
-    pv_threading.register_temp_folder(_name, temp_path)
-
 
 def plugin_unloaded():
     _lt_settings.clear_on_change("lt_preview_image_main")
+    if _temp_file_index is not None:
+        _temp_file_index.save()
+    save_image_sizes()
 
 
 _GS_EXTS = set(['ps', 'eps', 'pdf'])
@@ -70,50 +81,154 @@ _GS_EXTS = set(['ps', 'eps', 'pdf'])
 
 def _uses_gs(file):
     file, ext = os.path.splitext(file)
-    return ext.lower() in _GS_EXTS
+    return ext[1:].lower() in _GS_EXTS
 
 
 def _can_create_preview(file=None):
     if file is None:
-        return ghostscript_installed() or convert_installed()
+        return (
+            ghostscript_installed() or convert_installed() or
+            Image is not None
+        )
     else:
         if _uses_gs(file):
             return ghostscript_installed()
         else:
-            return convert_installed()
+            return convert_installed() or Image is not None
+
+
+def _create_thumbnails_gs(jobs, width, height):
+    """
+    Render the first page of each image; Ghostscript counts the pages for
+    -dLastPage across all input files of a run, so each image is rendered
+    by its own run
+    """
+    for job in jobs:
+        # Ghostscript renders the page into the given size, hence we keep
+        # the width/height ratio of the page
+        page_width, page_height = _adapt_image_size(
+            job["image_path"], width, height)
+        run_ghostscript_command([
+            '-sDEVICE=pngalpha', '-dLastPage=1',
+            '-dPDFFitPage', '-dEPSFitPage',
+            '-g{0}x{1}'.format(page_width, page_height),
+            '-sOutputFile=' + job["thumbnail_path"],
+            job["image_path"]
+        ])
 
 
-def create_thumbnail(image_path, thumbnail_path, width, height):
-    # convert the image
-    if os.path.exists(thumbnail_path):
+def _create_thumbnails_convert(jobs, width, height):
+    """
+    Convert all images in one ImageMagick run by writing each image and
+    removing it from the image sequence before reading the next one
+    """
+    command = []
+    for i, job in enumerate(jobs):
+        # only use the first frame of e.g. multipage tiff files
+        command.extend([
+            job["image_path"] + '[0]',
+            '-thumbnail', '{width}x{height}'.format(**locals())
+        ])
+        if i < len(jobs) - 1:
+            command.extend(['-write', job["thumbnail_path"], '+delete'])
+        else:
+            command.append(job["thumbnail_path"])
+    run_convert_command(command)
+
+
+def _create_thumbnail_pil(image_path, thumbnail_path, width, height):
+    try:
+        image = Image.open(image_path)
+        image.thumbnail((width, height))
+        image.save(thumbnail_path, "PNG")
+    except Exception:
+        return False
+    return True
+
+
+def create_thumbnails(jobs):
+    """
+    Create the thumbnails of the jobs, which must all have the same width
+    and height and either all use Ghostscript or not.
+
+    If a thumbnail is missing after converting the images together, e.g.
+    because an image could not be read, it is converted on its own.
+    """
+    jobs = [job for job in jobs if not os.path.exists(job["thumbnail_path"])]
+    if not jobs:
         return
+    width, height = jobs[0]["width"], jobs[0]["height"]
 
-    if _uses_gs(image_path):
-        run_ghostscript_command([
-            '-sDEVICE=pngalpha', '-dLastPage=1',
-            '-sOutputFile={thumbnail_path}'.format(**locals()),
-            '-g{width}x{height}'.format(**locals())
-        ])
+    if _uses_gs(jobs[0]["image_path"]):
+        create = _create_thumbnails_gs
     else:
-        run_convert_command([
-            '-thumbnail', '{width}x{height}'.format(**locals()),
-            image_path, thumbnail_path
-        ])
+        if Image is not None:
+            jobs = [
+                job for job in jobs
+                if not _create_thumbnail_pil(
+                    job["image_path"], job["thumbnail_path"], width, height)
+            ]
+        create = _create_thumbnails_convert if convert_installed() else None
 
-    if not os.path.exists(thumbnail_path):
-        with open(thumbnail_path + _ERROR_EXTENSION, "w") as f:
-            f.write("Failed to create preview thumbnail.")
+    if create is not None and jobs:
+        create(jobs, width, height)
+        # Ghostscript already renders each image on its own
+        if len(jobs) > 1 and create is not _create_thumbnails_gs:
+            for job in jobs:
+                if not os.path.exists(job["thumbnail_path"]):
+                    create([job], width, height)
+
+    for job in jobs:
+        thumbnail_path = job["thumbnail_path"]
+        if not os.path.exists(thumbnail_path):
+            with open(thumbnail_path + _ERROR_EXTENSION, "w") as f:
+                f.write("Failed to create preview thumbnail.")
+
+        # record the thumbnail or the error in the index of the temp files
+        if os.path.dirname(thumbnail_path) == temp_path:
+            thumbnail_name = os.path.basename(thumbnail_path)
+            _temp_file_index.add(thumbnail_name)
+            _temp_file_index.add(thumbnail_name + _ERROR_EXTENSION)
+
+
+def create_thumbnail(image_path, thumbnail_path, width, height):
+    create_thumbnails([{
+        "image_path": image_path,
+        "thumbnail_path": thumbnail_path,
+        "width": width,
+        "height": height
+    }])
 
 
 # CONVERT THREADING
+def _execute_job(job):
+    # convert the pending images, which use the same tool and size, in
+    # the same process
+    jobs = [job] + pv_threading.take_jobs(
+        _name, lambda j: j["batch_key"] == job["batch_key"],
+        _BATCH_SIZE - 1
+    )
+    try:
+        create_thumbnails(jobs)
+    finally:
+        for j in jobs:
+            j["cont"]()
+
+
 def _append_image_job(image_path, thumbnail_path, width, height, cont):
-    global _job_list
     if not _can_create_preview(image_path):
         return
 
-    def job():
-        create_thumbnail(image_path, thumbnail_path, width, height)
-        cont()
+    # the images are batched by the requested size, the size of the pages
+    # rendered by Ghostscript is adapted to each image
+    job = {
+        "image_path": image_path,
+        "thumbnail_path": thumbnail_path,
+        "width": width,
+        "height": height,
+        "cont": cont,
+        "batch_key": (_uses_gs(image_path), width, height)
+    }
 
     _, job_id = os.path.split(thumbnail_path)
     pv_threading.append_job(_name, jid=job_id, job=job)
@@ -121,56 +236,11 @@ def _append_image_job(image_path, thumbnail_path, width, height, cont):
 
 def _run_image_jobs():
     if not pv_threading.has_function(_name):
-        pv_threading.register_function(_name, lambda job: job())
+        pv_threading.register_function(
+            _name, _execute_job, pv_threading.merge_continuations)
     pv_threading.run_jobs(_name)
 
 
-# see https://bugs.python.org/issue16512#msg198034
-# not added to imghdr.tests because of potential issues with reloads
-def _is_jpg(h):
-    return h.startswith(b'\xff\xd8')
-
-
-# from http://stackoverflow.com/a/20380514/5963435
-# somewhat enhanced from http://stackoverflow.com/a/39778771
-def get_image_size(image_path):
-    '''Determine the image type of image_path and return its size.
-    from draco'''
-    with open(image_path, 'rb') as fhandle:
-        # read 32 as we pass this to imghdr
-        head = fhandle.read(32)
-        if len(head) != 32:
-            return
-        what = imghdr.what(image_path, head)
-        if what == 'png':
-            check = struct.unpack('>i', head[4:8])[0]
-            if check != 0x0d0a1a0a:
-                return
-            width, height = struct.unpack('>ii', head[16:24])
-        elif what == 'gif':
-            width, height = struct.unpack('<HH', head[6:10])
-        elif what == 'jpeg' or _is_jpg(head):
-            try:
-                fhandle.seek(0)  # Read 0xff next
-                size = 2
-                ftype = 0
-                while not 0xc0 <= ftype <= 0xcf or ftype in (0xc4, 0xc8, 0xcc):
-                    fhandle.seek(size, 1)
-                    byte = fhandle.read(1)
-                    while ord(byte) == 0xff:
-                        byte = fhandle.read(1)
-                    ftype = ord(byte)
-                    size = struct.unpack('>H', fhandle.read(2))[0] - 2
-                # We are at a SOFn block
-                fhandle.seek(1, 1)  # Skip `precision' byte.
-                height, width = struct.unpack('>HH', fhandle.read(4))
-            except Exception:  # IGNORE:W0703
-                return
-        else:
-            return
-        return width, height
-
-
 def _adapt_image_size(thumbnail_path, width, height):
     try:
         w, h = get_image_size(thumbnail_path)
@@ -180,7 +250,7 @@ def _adapt_image_size(thumbnail_path, width, height):
             height = int(height * width_ration / height_ratio)
         elif width_ration > height_ratio:
             width = int(width * height_ratio / width_ration)
-    except TypeError:
+    except (TypeError, ZeroDivisionError):
         pass
     return width, height
 
@@ -219,6 +289,8 @@ def _get_thumbnail_path(image_path, width, height):
 
         # remove the thumbnail if it is outdated
         _validate_thumbnail_currentness(image_path, thumbnail_path)
+        if os.path.exists(thumbnail_path):
+            _temp_file_index.touch(fingerprint + _IMAGE_EXTENSION)
     return thumbnail_path
 
 
@@ -235,7 +307,7 @@ def _get_popup_html(image_path, thumbnail_path, width, height):
         )
     elif _uses_gs(image_path) and not ghostscript_installed():
         img_tag = "Install Ghostscript to enable preview."
-    elif not _uses_gs(image_path) and not convert_installed():
+    elif not _uses_gs(image_path) and not _can_create_preview(image_path):
         img_tag = "Install ImageMagick to enable preview."
     elif os.path.exists(thumbnail_path + _ERROR_EXTENSION):
         img_tag = "ERROR: Failed to create preview thumbnail."
@@ -465,7 +537,7 @@ class PreviewImagePhantomListener(sublime_plugin.ViewEventListener,
                  height="{height}">
                 </div>
                 """.format(**locals())
-            elif convert_installed():
+            elif _can_create_preview(p.image_path):
                 html_content += """Preparing image for preview..."""
             elif os.path.exists(p.thumbnail_path + _ERROR_EXTENSION):
                 img_tag = "ERROR: Failed to create preview thumbnail."
@@ -617,6 +689,6 @@ class PreviewImagePhantomListener(sublime_plugin.ViewEventListener,
                 _append_image_job(
                     p.image_path, p.thumbnail_path,
                     width=tn_width, height=tn_height,
-                    cont=lambda: self.update_phantom(p))
+                    cont=lambda p=p: self.update_phantom(p))
             if need_thumbnails:
                 _run_image_jobs()
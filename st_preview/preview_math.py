@@ -16,17 +16,27 @@ from ..parseTeXlog import parse_tex_log
 
 from ..latextools_utils import cache, get_setting
 from ..latextools_utils.external_command import execute_command
+from ..latextools_utils.preamble_format import (
+    FORMAT_ERROR_MESSAGES, SUPPORTED_ENGINES, mylatexformat_installed
+)
+from ..latextools_utils.progress_indicator import ProgressIndicator
 from . import preview_utils
 from .preview_utils import (
-    ghostscript_installed, get_ghostscript_version, run_ghostscript_command)
+    TempFileIndex, ghostscript_installed, get_ghostscript_version,
+    get_pdf_media_box, get_shared_cache, get_temp_size_limit,
+    run_ghostscript_command
+)
 from . import preview_threading as pv_threading
 
 # export the listener
-exports = ["MathPreviewPhantomListener"]
+exports = [
+    "MathPreviewPhantomListener", "LatextoolsPreviewMathBenchmarkCommand",
+    "LatextoolsPreviewStatisticsCommand"
+]
 
 # increase this number if you change the convert command to mark the
 # generated images as expired
-_version = 2
+_version = 3
 
 # use this variable to disable the plugin for a session
 # (until ST is restarted)
@@ -60,9 +70,45 @@ default_latex_template = """
 \\end{document}
 """
 
+# the template to compile several formulas at once if the default template
+# is used; each formula is placed in a preview environment, which results
+# in one page per formula with the size of the formula
+# the pages are not cropped, so the border must give the same geometry as
+# the default template, i.e. its border of 0.3pt and the padding of 2bp on
+# each side added when cropping its page in _create_image, because both
+# images are stored under the same name
+batch_latex_template = """
+\\documentclass{article}
+\\usepackage[active,tightpage]{preview}
+\\setlength\\PreviewBorder{\\dimexpr 0.3pt + 2bp\\relax}
+% import xcolor if available and not already present
+\\IfFileExists{xcolor.sty}{\\usepackage{xcolor}}{}%
+<<packages>>
+<<preamble>>
+\\begin{document}
+<<content>>
+\\end{document}
+"""
+
+batch_content_template = """
+\\typeout{{ltxpreview:{index}}}%
+\\begin{{preview}}%
+\\IfFileExists{{xcolor.sty}}{{{set_color}}}{{}}%
+{content}
+\\end{{preview}}
+"""
+
 
 # the path to the temp files (set on loading)
 temp_path = None
+# the index of the temp files (set on loading)
+_temp_file_index = None
+# the folder shared with other machines (None if not set)
+_shared_cache = None
+# the path to the formats containing the preamble (set on loading)
+format_path = None
+# the number of formats to keep
+_MAX_FORMATS = 4
 
 # we use png files for the html popup
 _IMAGE_EXTENSION = ".png"
@@ -72,45 +118,99 @@ _ERROR_EXTENSION = ".err"
 _scale_quotient = 1
 _density = 150
 _hires = True
+_batch_size = 20
+_use_format = True
 _lt_settings = {}
 
 _name = "preview_math"
 
 
 def _on_setting_change():
-    global _density, _scale_quotient, _hires
+    global _density, _scale_quotient, _hires, _batch_size, _use_format
+    global _shared_cache
     _scale_quotient = _lt_settings.get(
         "preview_math_scale_quotient", _scale_quotient)
     _density = _lt_settings.get("preview_math_density", _density)
     _hires = _lt_settings.get("preview_math_hires", _hires)
+    _batch_size = get_setting(
+        "preview_math_batch_size", default=_batch_size, view={})
+    _use_format = get_setting(
+        "preview_math_use_format", default=_use_format, view={})
     max_threads = get_setting(
         "preview_max_convert_threads", default=None, view={})
     if max_threads is not None:
         pv_threading.set_max_threads(max_threads)
+    if _temp_file_index is not None:
+        _temp_file_index.set_max_size(get_temp_size_limit(_name))
+
+    shared_cache = get_shared_cache(_name)
+    if (
+        (shared_cache and (shared_cache.path, shared_cache.writable)) !=
+        (_shared_cache and (_shared_cache.path, _shared_cache.writable))
+    ):
+        if _shared_cache is not None:
+            _shared_cache.save()
+        _shared_cache = shared_cache
 
 
 def plugin_loaded():
-    global _lt_settings, temp_path
+    global _lt_settings, temp_path, _temp_file_index, format_path
     _lt_settings = sublime.load_settings("LaTeXTools.sublime-settings")
 
     temp_path = os.path.join(cache._global_cache_path(), _name)
     # validate the temporary file directory is available
     if not os.path.exists(temp_path):
         os.makedirs(temp_path)
+    _temp_file_index = TempFileIndex(temp_path)
+
+    # the formats are stored in a subfolder, so they are not affected by
+    # the deletion of the temporary files
+    format_path = os.path.join(temp_path, "formats")
+    if not os.path.exists(format_path):
+        os.makedirs(format_path)
 
     # init all variables
     _on_setting_change()
     # add a callback to setting changes
     _lt_settings.add_on_change("lt_preview_math_main", _on_setting_change)
 
-    # register the temp folder for auto deletion
-    pv_threading.register_temp_folder(_name, temp_path)
-
 
 def plugin_unloaded():
     global _IS_ENABLED
     _IS_ENABLED = False
     _lt_settings.clear_on_change("lt_preview_math_main")
+    if _temp_file_index is not None:
+        _temp_file_index.save()
+    if _shared_cache is not None:
+        _shared_cache.save()
+
+
+# the sizes of the common paper formats in pt; if a template produces a
+# page of such a size, the page is not cropped to the formula
+_PAPER_SIZES = [
+    (595, 842),  # A4
+    (420, 595),  # A5
+    (612, 792),  # letter
+    (612, 1008),  # legal
+]
+
+
+def _is_paper_size(bbox):
+    width = bbox[2] - bbox[0]
+    height = bbox[3] - bbox[1]
+    return any(
+        abs(width - w) < 1 and abs(height - h) < 1 or
+        abs(width - h) < 1 and abs(height - w) < 1
+        for w, h in _PAPER_SIZES
+    )
+
+
+def _create_set_color(color):
+    if color.startswith("#"):
+        color = color[1:].upper()
+        return "\\color[HTML]{{{color}}}".format(color=color)
+    else:
+        return "\\color{{{color}}}".format(color=color)
 
 
 def _create_image(latex_program, latex_document, base_name, color,
@@ -142,27 +242,35 @@ def _create_image(latex_program, latex_document, base_name, color,
             pdf_exists = True
 
     if pdf_exists:
-        # get the cropping boundaries; note that the relevant output is
-        # written to STDERR rather than STDOUT; we specify 72 dpi in order to
-        # speed up processing; the user-supplied density will be used in
-        # making the actual conversion
-        rc, _, output = run_ghostscript_command([
-            '-sDEVICE=bbox', '-r72', '-dLastPage=1', pdf_path
-        ], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-
-        if rc == 0:
-            # we only check the first line of output which should be in the
-            # format:
-            # %%BoundingBox: int int int int
-            try:
-                bbox = [
-                    int(x) for x in
-                    output.splitlines()[0].lstrip('%%BoundingBox: ').split()
-                ]
-            except ValueError:
+        # the default template crops the page to the formula, so we can
+        # use the page as cropping boundaries
+        bbox = None
+        if pdf_path.endswith(".pdf"):
+            bbox = get_pdf_media_box(pdf_path)
+            if bbox is not None and _is_paper_size(bbox):
                 bbox = None
-        else:
-            bbox = None
+
+        # otherwise get the cropping boundaries; note that the relevant
+        # output is written to STDERR rather than STDOUT; we specify 72 dpi
+        # in order to speed up processing; the user-supplied density will be
+        # used in making the actual conversion
+        if bbox is None:
+            rc, _, output = run_ghostscript_command([
+                '-sDEVICE=bbox', '-r72', '-dLastPage=1', pdf_path
+            ], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+            if rc == 0:
+                # we only check the first line of output which should be in
+                # the format:
+                # %%BoundingBox: int int int int
+                try:
+                    bbox = [
+                        int(x) for x in
+                        output.splitlines()[0].lstrip(
+                            '%%BoundingBox: ').split()
+                    ]
+                except ValueError:
+                    bbox = None
 
         # hires renders the image at 8 times the dpi, then scales it down
         scale_factor = \
@@ -259,10 +367,313 @@ def _create_image(latex_program, latex_document, base_name, color,
             os.remove(delete_path)
 
 
+def _delete_old_formats():
+    try:
+        format_files = [
+            os.path.join(format_path, file_name)
+            for file_name in os.listdir(format_path)
+            if file_name.endswith(".fmt")
+        ]
+    except OSError:
+        return
+    # keep the most recently used formats
+    format_files.sort(key=preview_utils._modified_time, reverse=True)
+    for file_path in format_files[_MAX_FORMATS:]:
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+
+class _PreviewFormat(object):
+    """
+    A format file containing the preamble of the batch documents, which is
+    loaded instead of processing the packages on every compilation.
+
+    There is one format per compile program and preamble. A new format is
+    dumped if the preamble changes and the format is dumped again once if it
+    cannot be loaded anymore.
+    """
+    _formats = {}
+    _formats_lock = threading.Lock()
+
+    def __init__(self, latex_program, batch_key, batch_preamble):
+        self.latex_program = latex_program
+        self.batch_preamble = batch_preamble
+        self.name = "preview_" + batch_key
+        self.path = os.path.join(format_path, self.name + ".fmt")
+        self.failed = False
+        self.invalidated = False
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get(cls, latex_program, batch_key, batch_preamble):
+        """
+        Return the format for the preamble, dumping it if necessary, or
+        None if no format can be used.
+        """
+        if (
+            latex_program not in SUPPORTED_ENGINES or
+            not mylatexformat_installed()
+        ):
+            return None
+
+        with cls._formats_lock:
+            try:
+                fmt = cls._formats[batch_key]
+            except KeyError:
+                fmt = cls._formats[batch_key] = cls(
+                    latex_program, batch_key, batch_preamble)
+
+        return fmt if fmt.ensure_dumped() else None
+
+    @property
+    def fmt_option(self):
+        return "-fmt=" + os.path.splitext(self.path)[0]
+
+    def ensure_dumped(self):
+        with self.lock:
+            if self.failed:
+                return False
+            if os.path.exists(self.path):
+                # mark the format as recently used
+                try:
+                    os.utime(self.path, None)
+                except OSError:
+                    pass
+                return True
+
+            self.failed = not self._dump()
+            return not self.failed
+
+    def _dump(self):
+        rel_source_path = self.name + ".tex"
+        source_path = os.path.join(format_path, rel_source_path)
+        with open(source_path, "w", encoding="utf-8") as f:
+            f.write(self.batch_preamble.replace("<<content>>", "", 1))
+
+        execute_command([
+            self.latex_program, "-ini", "-interaction=nonstopmode",
+            "-jobname=" + self.name, "&" + self.latex_program,
+            "mylatexformat.ltx", rel_source_path
+        ], cwd=format_path)
+
+        for ext in ["tex", "log"]:
+            delete_path = os.path.join(format_path, self.name + "." + ext)
+            if os.path.exists(delete_path):
+                os.remove(delete_path)
+
+        _delete_old_formats()
+        return os.path.exists(self.path)
+
+    def invalidate(self):
+        with self.lock:
+            # if a freshly dumped format cannot be loaded either, we stop
+            # using a format for this preamble
+            self.failed = self.invalidated
+            self.invalidated = True
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+_BATCH_MARKER_REGEX = re.compile(r"^ltxpreview:(\d+)$")
+
+
+def _create_images_batch(latex_program, batch_preamble, jobs,
+                         use_format=True):
+    """
+    Create the images for several jobs by compiling all formulas in one
+    document and converting all pages in one Ghostscript call. If
+    use_format is True, the preamble is loaded from a format.
+
+    Returns the jobs, which could not be created in the batch, e.g. because
+    the formula contains an error. These should be created using
+    _create_image to get the error report.
+    """
+    base_name = "batch_" + cache.hash_digest(
+        "\n".join(job["base_name"] for job in jobs))
+    rel_source_path = base_name + ".tex"
+    pdf_path = os.path.join(temp_path, base_name + ".pdf")
+    log_path = os.path.join(temp_path, base_name + ".log")
+    page_path = os.path.join(temp_path, base_name + "-{0}" + _IMAGE_EXTENSION)
+
+    latex_document = batch_preamble.replace(
+        "<<content>>",
+        "".join(
+            batch_content_template.format(
+                index=i, set_color=job["batch_set_color"],
+                content=job["batch_content"])
+            for i, job in enumerate(jobs)
+        ),
+        1
+    )
+
+    source_path = os.path.join(temp_path, rel_source_path)
+    with open(source_path, "w", encoding="utf-8") as f:
+        f.write(latex_document)
+
+    fmt = None
+    if use_format:
+        fmt = _PreviewFormat.get(
+            latex_program, jobs[0]["batch_key"], batch_preamble)
+
+    if fmt is not None:
+        execute_command([
+            latex_program, fmt.fmt_option, '-interaction=nonstopmode',
+            rel_source_path
+        ], cwd=temp_path)
+
+        # the format may have been dumped by another version of the engine
+        try:
+            with open(log_path, "rb") as f:
+                log_data = f.read().decode("utf8", "ignore")
+        except OSError:
+            log_data = ""
+        if any(message in log_data for message in FORMAT_ERROR_MESSAGES):
+            fmt.invalidate()
+            fmt = None
+
+    if fmt is None:
+        execute_command([
+            latex_program, '-interaction=nonstopmode', rel_source_path
+        ], cwd=temp_path)
+
+    # find the formulas with errors; the errors are reported after the
+    # marker of the formula
+    failed = set()
+    try:
+        with open(log_path, "rb") as f:
+            log_lines = f.read().decode("utf8", "ignore").splitlines()
+    except OSError:
+        failed.update(range(len(jobs)))
+    else:
+        index = None
+        for line in log_lines:
+            m = _BATCH_MARKER_REGEX.match(line)
+            if m:
+                index = int(m.group(1))
+            elif line.startswith("! "):
+                if index is None:
+                    # an error in the preamble
+                    failed.update(range(len(jobs)))
+                    break
+                failed.add(index)
+
+    if len(failed) < len(jobs) and os.path.exists(pdf_path):
+        # hires renders the image at 8 times the dpi, then scales it down
+        scale_factor = \
+            8 if _hires and get_ghostscript_version() >= (9, 14) else 1
+
+        # the pages already have the size of the formulas, so we can
+        # convert them without cropping
+        run_ghostscript_command([
+            '-sDEVICE=pngalpha',
+            '-sOutputFile={0}'.format(page_path.format("%d")),
+            '-r{density}'.format(density=_density * scale_factor),
+            '-dDownScaleFactor={0}'.format(scale_factor),
+            '-dTextAlphaBits=4', '-dGraphicsAlphaBits=4',
+            pdf_path
+        ])
+
+    pages = []
+    page_number = 1
+    while os.path.exists(page_path.format(page_number)):
+        pages.append(page_path.format(page_number))
+        page_number += 1
+
+    if len(pages) != len(jobs):
+        # we cannot assign the pages to the formulas
+        failed.update(range(len(jobs)))
+
+    for i, job in enumerate(jobs):
+        if i not in failed:
+            image_path = os.path.join(
+                temp_path, job["base_name"] + _IMAGE_EXTENSION)
+            os.replace(pages[i], image_path)
+
+    # cleanup created files
+    for ext in ["tex", "aux", "log", "pdf", "dvi"]:
+        delete_path = os.path.join(temp_path, base_name + "." + ext)
+        if os.path.exists(delete_path):
+            os.remove(delete_path)
+    for path in pages:
+        if os.path.exists(path):
+            os.remove(path)
+
+    return [job for i, job in enumerate(jobs) if i in failed]
+
+
 # CONVERT THREADING
+def _add_to_index(job):
+    image_name = job["base_name"] + _IMAGE_EXTENSION
+    # the index ignores files which have not been created
+    _temp_file_index.add(image_name)
+    _temp_file_index.add(image_name + _ERROR_EXTENSION)
+
+
+def _fetch_shared_image(job):
+    if _shared_cache is None:
+        return False
+    image_name = job["base_name"] + _IMAGE_EXTENSION
+    return _shared_cache.fetch(image_name, os.path.join(temp_path, image_name))
+
+
+def _publish_image(job):
+    if _shared_cache is None or not _shared_cache.writable:
+        return
+    image_name = job["base_name"] + _IMAGE_EXTENSION
+    image_path = os.path.join(temp_path, image_name)
+    # only publish the images, which have been compiled without errors
+    if (
+        os.path.exists(image_path) and
+        not os.path.exists(image_path + _ERROR_EXTENSION)
+    ):
+        _shared_cache.publish(image_path, image_name)
+
+
 def _execute_job(job):
-    _create_image(**job)
-    job["cont"]()
+    jobs = [job]
+    batch_key = job.get("batch_key")
+    if batch_key is not None and _batch_size > 1:
+        jobs.extend(pv_threading.take_jobs(
+            _name, lambda j: j.get("batch_key") == batch_key,
+            _batch_size - 1
+        ))
+
+    # reuse the images of the shared cache instead of compiling them
+    if _shared_cache is not None:
+        compile_jobs = []
+        for j in jobs:
+            if _fetch_shared_image(j):
+                _add_to_index(j)
+                j["cont"]()
+            else:
+                compile_jobs.append(j)
+        jobs = compile_jobs
+        if not jobs:
+            return
+
+    # if a format is used, even a single formula is compiled faster in
+    # a batch document
+    if len(jobs) > 1 or (batch_key is not None and _use_format):
+        failed_jobs = _create_images_batch(
+            job["latex_program"], job["batch_preamble"], jobs)
+        failed_ids = set(id(j) for j in failed_jobs)
+        for j in jobs:
+            if id(j) not in failed_ids:
+                _add_to_index(j)
+                _publish_image(j)
+                j["cont"]()
+    else:
+        failed_jobs = jobs
+
+    for j in failed_jobs:
+        _create_image(**j)
+        _add_to_index(j)
+        _publish_image(j)
+        j["cont"]()
 
 
 def _cancel_image_jobs(vid, p=None):
@@ -272,13 +683,14 @@ def _cancel_image_jobs(vid, p=None):
         def is_target_job(job):
             return job["vid"] == vid
     elif isinstance(p, list):
-        pset = set(p)
+        # the phantoms are not hashable, hence we compare their ids
+        pids = set(id(x) for x in p)
 
         def is_target_job(job):
-            return job["vid"] == vid and job["p"] in pset
+            return job["vid"] == vid and id(job["p"]) in pids
     else:
         def is_target_job(job):
-            return job["vid"] == vid and job["p"] == p
+            return job["vid"] == vid and job["p"] is p
 
     pv_threading.cancel_jobs(_name, is_target_job)
 
@@ -291,12 +703,32 @@ def _extend_image_jobs(vid, latex_program, jobs):
 
         prepared_jobs.append((job["base_name"], job))
 
-    pv_threading.extend_jobs(_name, prepared_jobs[::-1])
+    pv_threading.extend_jobs(_name, prepared_jobs)
+
+
+def _distance(region, visible_region):
+    if region.end() < visible_region.begin():
+        return visible_region.begin() - region.end()
+    if region.begin() > visible_region.end():
+        return region.begin() - visible_region.end()
+    return 0
+
+
+def _prioritize_image_jobs(vid, visible_region):
+    # the jobs of the view are prioritized by their distance to the visible
+    # region, i.e. the visible formulas first, then the ones nearby
+    def priority(job):
+        if job["vid"] == vid:
+            job["priority"] = _distance(job["p"].region, visible_region)
+        return job.get("priority", 0)
+
+    pv_threading.prioritize_jobs(_name, priority)
 
 
 def _run_image_jobs():
     if not pv_threading.has_function(_name):
-        pv_threading.register_function(_name, _execute_job)
+        pv_threading.register_function(
+            _name, _execute_job, pv_threading.merge_continuations)
     pv_threading.run_jobs(_name)
 
 
@@ -372,6 +804,16 @@ def _generate_html(view, image_path, style_kwargs):
     return html_content
 
 
+# the commands, which only modify the lines of the selections; after other
+# modifications all math scopes of the view are checked
+_LOCAL_EDIT_COMMANDS = set([
+    "insert", "left_delete", "right_delete", "delete_word"
+])
+
+# the key of the regions modified since the last update
+_DIRTY_REGIONS_KEY = "latextools_preview_math_dirty"
+
+
 class MathPreviewPhantomListener(sublime_plugin.ViewEventListener,
                                  preview_utils.SettingsListener):
     key = "preview_math"
@@ -391,6 +833,16 @@ class MathPreviewPhantomListener(sublime_plugin.ViewEventListener,
         self._modifications = 0
         self._selection_modifications = 0
 
+        self._visible_region = None
+        self._watching_viewport = False
+
+        # the lines modified since the last update are stored as regions of
+        # the view, so they are moved by later modifications
+        self._dirty_lock = threading.Lock()
+        self._needs_full_update = True
+        # (document content, color, hires) -> (latex document, base name)
+        self._base_names = {}
+
         self._init_watch_settings()
 
         if self.latex_template_file:
@@ -537,6 +989,9 @@ class MathPreviewPhantomListener(sublime_plugin.ViewEventListener,
     # MODIFICATION LISTENER
     #######################
 
+    def on_close(self):
+        _cancel_image_jobs(self.view.id())
+
     def on_after_modified_async(self):
         self.update_phantoms()
 
@@ -547,8 +1002,88 @@ class MathPreviewPhantomListener(sublime_plugin.ViewEventListener,
 
     def on_modified(self):
         self._modifications += 1
+        self._track_modification()
         sublime.set_timeout(self._validate_after_modified, 600)
 
+    def _track_modification(self):
+        view = self.view
+        command, _, _ = view.command_history(0, True)
+        with self._dirty_lock:
+            if self._needs_full_update:
+                return
+            if command not in _LOCAL_EDIT_COMMANDS:
+                self._needs_full_update = True
+                view.erase_regions(_DIRTY_REGIONS_KEY)
+                return
+            # include the previous line in case a newline was inserted
+            dirty_regions = view.get_regions(_DIRTY_REGIONS_KEY)
+            dirty_regions.extend(
+                sublime.Region(
+                    view.line(max(sel.begin() - 1, 0)).begin(),
+                    view.line(sel.end()).end()
+                )
+                for sel in view.sel()
+            )
+            view.add_regions(
+                _DIRTY_REGIONS_KEY, dirty_regions, "", "", sublime.HIDDEN)
+
+    def _take_dirty_regions(self):
+        """
+        Return the regions modified since the last update or None if all
+        math scopes have to be checked.
+        """
+        with self._dirty_lock:
+            if self._needs_full_update:
+                dirty_regions = None
+            else:
+                dirty_regions = self.view.get_regions(_DIRTY_REGIONS_KEY)
+            self._needs_full_update = False
+            self.view.erase_regions(_DIRTY_REGIONS_KEY)
+        return dirty_regions
+
+    def _split_dirty_scopes(self, scopes, dirty_regions, phantom_index):
+        """
+        Return the scopes intersecting the dirty regions and the phantoms
+        of the other scopes or None if the other scopes do not match the
+        phantoms, e.g. because a math delimiter has been inserted. The
+        scopes of placeholder phantoms are dirty, so they are queued again.
+        """
+        dirty_scopes = []
+        clean_phantoms = []
+        placeholder_ids = set()
+        for scope in scopes:
+            if any(
+                scope.begin() <= r.end() and r.begin() <= scope.end()
+                for r in dirty_regions
+            ):
+                dirty_scopes.append(scope)
+                continue
+            # the phantom of a begin end block may be after the \end{...}
+            p = (
+                phantom_index.get((scope.end(), scope.end())) or
+                phantom_index.get((scope.end() + 4, scope.end() + 4))
+            )
+            if p is None:
+                return None
+            if p.placeholder:
+                dirty_scopes.append(scope)
+                placeholder_ids.add(id(p))
+                continue
+            clean_phantoms.append(p)
+
+        # all other phantoms must be inside the dirty regions
+        clean_ids = set(id(p) for p in clean_phantoms)
+        for p in self.phantoms:
+            if id(p) in clean_ids or id(p) in placeholder_ids:
+                continue
+            if not any(
+                r.begin() <= p.region.begin() and p.region.end() <= r.end()
+                for r in dirty_regions
+            ):
+                return None
+
+        return dirty_scopes, clean_phantoms
+
     def on_after_selection_modified_async(self):
         if self.visible_mode == "selected" or not self.phantoms:
             self.update_phantoms()
@@ -598,6 +1133,7 @@ class MathPreviewPhantomListener(sublime_plugin.ViewEventListener,
             self.view.window().open_file(file_path)
 
     def reset_phantoms(self):
+        self._base_names = {}
         self.delete_phantoms()
         self.update_phantoms()
 
@@ -638,6 +1174,10 @@ class MathPreviewPhantomListener(sublime_plugin.ViewEventListener,
 
         # update the regions of the phantoms
         self._update_phantom_regions()
+        phantom_index = dict(
+            ((p.region.begin(), p.region.end()), p) for p in self.phantoms
+        )
+        dirty_regions = self._take_dirty_regions()
 
         new_phantoms = []
         job_args = []
@@ -648,6 +1188,13 @@ class MathPreviewPhantomListener(sublime_plugin.ViewEventListener,
         elif self.visible_mode == "all":
             scopes = view.find_by_selector(
                 "text.tex.latex meta.environment.math")
+            # only check the scopes, which have been modified, if the
+            # remaining scopes still have their phantoms
+            if dirty_regions is not None:
+                split = self._split_dirty_scopes(
+                    scopes, dirty_regions, phantom_index)
+                if split is not None:
+                    scopes, new_phantoms = split
         elif self.visible_mode == "selected":
             math_scopes = view.find_by_selector(
                 "text.tex.latex meta.environment.math")
@@ -679,6 +1226,17 @@ class MathPreviewPhantomListener(sublime_plugin.ViewEventListener,
             "background_color": self.background_color
         }
 
+        if self._uses_default_template() and self.latex_program != "latex":
+            batch_preamble = (
+                batch_latex_template
+                .replace("<<packages>>", self.packages_str, 1)
+                .replace("<<preamble>>", self.preamble_str, 1)
+            )
+            batch_key = cache.hash_digest(
+                "\n".join([self.latex_program, batch_preamble]))
+        else:
+            batch_preamble = batch_key = None
+
         for scope in scopes:
             content = view.substr(scope)
             multline = "\n" in content
@@ -695,41 +1253,58 @@ class MathPreviewPhantomListener(sublime_plugin.ViewEventListener,
             else:
                 region = sublime.Region(scope.end())
 
-            try:
-                p = next(e for e in self.phantoms if e.region == region)
-                if p.content == content:
+            p = phantom_index.get((region.begin(), region.end()))
+            if p is not None:
+                if p.content == content and not p.placeholder:
                     new_phantoms.append(p)
                     continue
+                if p.placeholder:
+                    # the job is queued again below
+                    _cancel_image_jobs(view.id(), p)
 
                 # update the content and the layout
                 p.content = content
                 p.layout = layout
-            except:
+            else:
                 p = types.SimpleNamespace(
                     id=None,
                     region=region,
                     content=content,
                     layout=layout,
-                    update_time=0
+                    update_time=0,
+                    placeholder=False
                 )
 
             # generate the latex template
-            latex_document = self._create_document(scope, color)
-
-            # create a string, which uniquely identifies the compiled document
-            id_str = "\n".join([
-                str(_version),
-                self.latex_program,
-                str(_density),
-                str(_hires and get_ghostscript_version() >= (9, 14)),
-                color,
-                latex_document
-            ])
-            base_name = cache.hash_digest(id_str)
+            document_content = self._create_document_content(scope)
+            hires = _hires and get_ghostscript_version() >= (9, 14)
+            key = (document_content, color, hires)
+            try:
+                latex_document, base_name = self._base_names[key]
+            except KeyError:
+                latex_document = self._create_document(
+                    document_content, color)
+
+                # create a string, which uniquely identifies the compiled
+                # document
+                id_str = "\n".join([
+                    str(_version),
+                    self.latex_program,
+                    str(_density),
+                    str(hires),
+                    color,
+                    latex_document
+                ])
+                base_name = cache.hash_digest(id_str)
+
+                if len(self._base_names) > 5000:
+                    self._base_names = {}
+                self._base_names[key] = (latex_document, base_name)
             image_path = os.path.join(temp_path, base_name + _IMAGE_EXTENSION)
 
             # if the file exists as an image update the phantom
             if os.path.exists(image_path):
+                _temp_file_index.touch(base_name + _IMAGE_EXTENSION)
                 if p.id is not None:
                     view.erase_phantom_by_id(p.id)
                     _cancel_image_jobs(view.id(), p)
@@ -737,6 +1312,7 @@ class MathPreviewPhantomListener(sublime_plugin.ViewEventListener,
                 p.id = view.add_phantom(
                     self.key, region, html_content, layout,
                     on_navigate=self.on_navigate)
+                p.placeholder = False
                 new_phantoms.append(p)
                 continue
             # if neither the file nor the phantom exists, create a
@@ -745,20 +1321,32 @@ class MathPreviewPhantomListener(sublime_plugin.ViewEventListener,
                 p.id = view.add_phantom(
                     self.key, region, _wrap_html("\u231B", **style_kwargs),
                     layout, on_navigate=self.on_navigate)
+                p.placeholder = True
 
-            job_args.append({
+            job = {
                 "latex_document": latex_document,
                 "base_name": base_name,
                 "color": color,
                 "p": p,
                 "cont": self._make_cont(
                     p, image_path, time.time(), style_kwargs)
-            })
+            }
+            # formulas using the default template can be compiled together
+            # with other formulas with the same preamble
+            if batch_preamble is not None:
+                job.update({
+                    "batch_key": batch_key,
+                    "batch_preamble": batch_preamble,
+                    "batch_content": document_content,
+                    "batch_set_color": _create_set_color(color)
+                })
+            job_args.append(job)
 
             new_phantoms.append(p)
 
         # delete deprecated phantoms
-        delete_phantoms = [x for x in self.phantoms if x not in new_phantoms]
+        new_ids = set(id(p) for p in new_phantoms)
+        delete_phantoms = [x for x in self.phantoms if id(x) not in new_ids]
         for p in delete_phantoms:
             if p.region != sublime.Region(-1):
                 view.erase_phantom_by_id(p.id)
@@ -770,9 +1358,39 @@ class MathPreviewPhantomListener(sublime_plugin.ViewEventListener,
         # run the jobs to create the remaining images
         if job_args:
             _extend_image_jobs(view.id(), self.latex_program, job_args)
+            self._prioritize_jobs()
             _run_image_jobs()
+            sublime.set_timeout(self._watch_viewport)
+
+    def _prioritize_jobs(self):
+        self._visible_region = self.view.visible_region()
+        _prioritize_image_jobs(self.view.id(), self._visible_region)
+
+    def _watch_viewport(self):
+        if self._watching_viewport:
+            return
+        self._watching_viewport = True
+        sublime.set_timeout(self._check_viewport, 300)
+
+    def _check_viewport(self):
+        # re-prioritize the jobs of this view after scrolling as long as
+        # there are jobs left
+        vid = self.view.id()
+        if not pv_threading.has_jobs(_name, lambda job: job["vid"] == vid):
+            self._watching_viewport = False
+            return
+
+        if self.view.visible_region() != self._visible_region:
+            self._prioritize_jobs()
+        sublime.set_timeout(self._check_viewport, 300)
 
-    def _create_document(self, scope, color):
+    def _uses_default_template(self):
+        try:
+            return not self.template_contents[self.latex_template_file]
+        except KeyError:
+            return True
+
+    def _create_document_content(self, scope):
         view = self.view
         content = view.substr(scope)
         env = None
@@ -818,7 +1436,9 @@ class MathPreviewPhantomListener(sublime_plugin.ViewEventListener,
             "{open_str}\n\\mathstrut {content}\n{close_str}"
             .format(**locals())
         )
+        return document_content
 
+    def _create_document(self, document_content, color):
         try:
             latex_template = self.template_contents[self.latex_template_file]
             if not latex_template:
@@ -826,11 +1446,7 @@ class MathPreviewPhantomListener(sublime_plugin.ViewEventListener,
         except:
             latex_template = default_latex_template
 
-        if color.startswith("#"):
-            color = color[1:].upper()
-            set_color = "\\color[HTML]{{{color}}}".format(color=color)
-        else:
-            set_color = "\\color{{{color}}}".format(color=color)
+        set_color = _create_set_color(color)
 
         latex_document = (
             latex_template
@@ -886,3 +1502,240 @@ class MathPreviewPhantomListener(sublime_plugin.ViewEventListener,
 
         # update the phantoms update time
         p.update_time = update_time
+        p.placeholder = False
+
+
+_BENCHMARK_FORMULA = (
+    "\\[\n\\mathstrut \\sum_{{k=1}}^{{{index}}} k^2 = "
+    "\\frac{{{index}({index}+1)(2 \\cdot {index}+1)}}{{6}} "
+    "+ \\alpha_{{{nonce}}}\n\\]"
+)
+
+
+def _benchmark_jobs(latex_program, packages_str, preamble_str, count):
+    # the nonce ensures that the images are not cached
+    nonce = int(time.time() * 1000)
+    color = "#CCCCCC"
+    set_color = _create_set_color(color)
+    batch_preamble = (
+        batch_latex_template
+        .replace("<<packages>>", packages_str, 1)
+        .replace("<<preamble>>", preamble_str, 1)
+    )
+    batch_key = cache.hash_digest(
+        "\n".join([latex_program, batch_preamble]))
+
+    jobs = []
+    for index in range(count):
+        document_content = _BENCHMARK_FORMULA.format(
+            index=index, nonce=nonce)
+        latex_document = (
+            default_latex_template
+            .replace("<<content>>", document_content, 1)
+            .replace("<<set_color>>", set_color, 1)
+            .replace("<<packages>>", packages_str, 1)
+            .replace("<<preamble>>", preamble_str, 1)
+        )
+        jobs.append({
+            "latex_program": latex_program,
+            "latex_document": latex_document,
+            "base_name": cache.hash_digest(latex_document),
+            "color": color,
+            "batch_key": batch_key,
+            "batch_preamble": batch_preamble,
+            "batch_content": document_content,
+            "batch_set_color": set_color
+        })
+    return jobs
+
+
+def _delete_benchmark_images(jobs):
+    for job in jobs:
+        image_path = os.path.join(
+            temp_path, job["base_name"] + _IMAGE_EXTENSION)
+        for path in [image_path, image_path + _ERROR_EXTENSION]:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _run_benchmark(latex_program, packages_str, preamble_str, count):
+    """
+    Create count previews in each of the available ways and return a list
+    of (description, formulas per second) tuples.
+    """
+    batch_size = max(_batch_size, 1)
+
+    def separately(jobs):
+        for job in jobs:
+            _create_image(**job)
+
+    def batched(jobs, use_format):
+        for i in range(0, len(jobs), batch_size):
+            batch = jobs[i:i + batch_size]
+            _create_images_batch(
+                latex_program, batch[0]["batch_preamble"], batch,
+                use_format=use_format
+            )
+
+    def separately_with_format(jobs):
+        for job in jobs:
+            _create_images_batch(
+                latex_program, job["batch_preamble"], [job])
+
+    modes = [
+        ("one process per formula", separately),
+        ("batches of {0} formulas".format(batch_size),
+            lambda jobs: batched(jobs, False))
+    ]
+
+    results = []
+    jobs = _benchmark_jobs(latex_program, packages_str, preamble_str, 1)
+    start_time = time.time()
+    fmt = _PreviewFormat.get(
+        latex_program, jobs[0]["batch_key"], jobs[0]["batch_preamble"])
+    if fmt is None:
+        results.append(("preamble format", "not available"))
+    else:
+        results.append((
+            "preamble format",
+            "ready after {0:.2f}s".format(time.time() - start_time)
+        ))
+        modes.extend([
+            ("one formula per run with format", separately_with_format),
+            ("batches of {0} formulas with format".format(batch_size),
+                lambda jobs: batched(jobs, True))
+        ])
+
+    for description, create_images in modes:
+        jobs = _benchmark_jobs(
+            latex_program, packages_str, preamble_str, count)
+        start_time = time.time()
+        try:
+            create_images(jobs)
+        finally:
+            elapsed = time.time() - start_time
+            created = sum(
+                os.path.exists(os.path.join(
+                    temp_path, job["base_name"] + _IMAGE_EXTENSION))
+                for job in jobs
+            )
+            _delete_benchmark_images(jobs)
+        results.append((
+            description,
+            "{0:.2f} formulas/s ({1} of {2} created in {3:.2f}s)".format(
+                created / elapsed if elapsed > 0 else 0,
+                created, count, elapsed
+            )
+        ))
+    return results
+
+
+class LatextoolsPreviewMathBenchmarkCommand(sublime_plugin.WindowCommand):
+    """
+    Measure how many math previews per second can be created with the
+    current settings, compiling each formula in its own document, in
+    batches and using a preamble format.
+    """
+
+    def run(self, count=20):
+        if not ghostscript_installed():
+            sublime.error_message(
+                "Ghostscript is required to create the math previews.")
+            return
+
+        view = self.window.active_view()
+        latex_program = get_setting(
+            "preview_math_latex_compile_program", "pdflatex", view=view)
+        packages = get_setting(
+            "preview_math_template_packages", [], view=view)
+        preamble = get_setting(
+            "preview_math_template_preamble", "", view=view)
+        if not isinstance(preamble, str):
+            preamble = "\n".join(preamble)
+
+        results = []
+
+        def run_benchmark():
+            results.extend(_run_benchmark(
+                latex_program, "\n".join(packages), preamble, count))
+            sublime.set_timeout(lambda: self._show_results(
+                latex_program, count, results))
+
+        t = threading.Thread(target=run_benchmark)
+        t.start()
+
+        ProgressIndicator(
+            t, "Running math preview benchmark...",
+            "Math preview benchmark complete"
+        )
+
+    def _show_results(self, latex_program, count, results):
+        width = max(len(description) for description, _ in results)
+        lines = [
+            "Math preview benchmark: {0} formulas using {1}".format(
+                count, latex_program),
+            ""
+        ]
+        lines.extend(
+            "{0}  {1}".format(description.ljust(width), result)
+            for description, result in results
+        )
+        _show_report(
+            self.window, "LaTeXTools Math Preview Benchmark", lines)
+
+
+def _show_report(window, title, lines):
+    new_view = window.new_file()
+    new_view.set_scratch(True)
+    new_view.settings().set("word_wrap", False)
+    new_view.settings().set("line_numbers", False)
+    new_view.settings().set("gutter", False)
+    new_view.set_name(title)
+    new_view.run_command(
+        "latextools_insert_text", {"text": "\n".join(lines)})
+    new_view.set_read_only(True)
+
+
+def _format_histogram(histogram):
+    total = sum(count for _, count in histogram)
+    lines = []
+    for bound, count in histogram:
+        if not count:
+            continue
+        label = (
+            "<= {0:g}s".format(bound) if bound != float("inf")
+            else "> {0:g}s".format(histogram[-2][0])
+        )
+        lines.append("    {0:>9}  {1:>6}  {2}".format(
+            label, count, "#" * max(1, round(40 * count / total))))
+    return lines or ["    (no jobs)"]
+
+
+class LatextoolsPreviewStatisticsCommand(sublime_plugin.WindowCommand):
+    """
+    Show the statistics of the worker threads, which create the previews.
+    """
+
+    def run(self):
+        metrics = pv_threading.get_metrics()
+        lines = [
+            "Preview worker threads: {0} running".format(
+                metrics.pop("threads"))
+        ]
+        for name in sorted(metrics):
+            m = metrics[name]
+            lines.extend([
+                "",
+                "{0}:".format(name),
+                "  queue depth: {queue_depth}, running: {running}".format(
+                    **m),
+                "  queued: {queued}, completed: {completed}, "
+                "failed: {failed}, cancelled: {cancelled}, "
+                "merged: {merged}".format(**m),
+                "  time in queue:"
+            ])
+            lines.extend(_format_histogram(m["wait_histogram"]))
+            lines.append("  run time:")
+            lines.extend(_format_histogram(m["run_histogram"]))
+
+        _show_report(self.window, "LaTeXTools Preview Statistics", lines)
@@ -1,188 +1,433 @@
+"""
+A pool of worker threads shared by the previews to convert images.
+
+Each preview registers a function under its name and queues jobs under this
+name. The jobs are processed by at most preview_max_convert_threads worker
+threads in the order of their priority (lowest first) and, for the same
+priority, in the order they have been queued. At most one job with the same
+job id runs at a time; if a job is queued with the id of a queued job, both
+jobs are kept in the same entry and processed once. The jobs of an entry are
+merged using the function registered with the name, e.g.
+merge_continuations(), otherwise only the newest job is processed.
+
+The functions at the end of this module are the interface used by the
+previews.
+"""
+import bisect
+import heapq
+import itertools
 import threading
+import time
 import traceback
 
 
-from .preview_utils import try_delete_temp_files
-
-_max_threads = 2
-_thread_num_lock = threading.Lock()
-_thread_num = 0
-_jobs_lock = threading.Lock()
-_jobs = {}
-_working_sets = {}
-_working_sets_lock = threading.Lock()
-
-# folder path to delete for each job
-_temp_folder_paths = {}
-# execute job functions for each job
-_thread_functions = {}
+# the upper bounds of the buckets of the latency histograms in seconds
+LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf")]
+
+
+class _Entry(object):
+    __slots__ = ["priority", "seq", "name", "jid", "jobs", "queued_time",
+                 "valid"]
+
+    def __init__(self, priority, seq, name, jid, job):
+        self.priority = priority
+        self.seq = seq
+        self.name = name
+        self.jid = jid
+        # the jobs queued with the same id in the order they were queued
+        self.jobs = [job]
+        self.queued_time = time.time()
+        self.valid = True
+
+    @property
+    def job(self):
+        return self.jobs[-1]
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _Metrics(object):
+    def __init__(self):
+        self.queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.merged = 0
+        self.wait_histogram = [0] * len(LATENCY_BUCKETS)
+        self.run_histogram = [0] * len(LATENCY_BUCKETS)
+
+    @staticmethod
+    def _record(histogram, duration):
+        histogram[bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+
+    def record_wait(self, duration):
+        self._record(self.wait_histogram, duration)
+
+    def record_run(self, duration):
+        self._record(self.run_histogram, duration)
+
+
+class WorkerPool(object):
+    """
+    A prioritized job queue with a bounded number of worker threads
+
+    :param max_threads:
+        the maximal number of jobs running at the same time
+
+    :param idle_timeout:
+        the time in seconds after which an idle worker thread terminates
+    """
+
+    def __init__(self, max_threads=2, idle_timeout=30):
+        self.max_threads = max_threads
+        self.idle_timeout = idle_timeout
+
+        self._condition = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        # (name, jid) -> queued entry
+        self._queued_ids = {}
+        # (name, jid) of the running jobs
+        self._running_ids = set()
+        # (name, jid) -> entry, which has to wait until the running job with
+        # the same id has finished
+        self._deferred = {}
+        self._functions = {}
+        self._merge_functions = {}
+        self._metrics = {}
+        self._threads = 0
+        self._idle_threads = 0
+        self._local = threading.local()
+
+    def _get_metrics(self, name):
+        try:
+            return self._metrics[name]
+        except KeyError:
+            metrics = self._metrics[name] = _Metrics()
+            return metrics
+
+    def set_max_threads(self, max_threads):
+        with self._condition:
+            self.max_threads = max_threads
+            self._condition.notify_all()
+
+    def register_function(self, name, func, merge_jobs=None):
+        """
+        registers the function processing the jobs of the name; if given,
+        merge_jobs(jobs) merges the jobs queued with the same id into the
+        job passed to func
+        """
+        self._functions[name] = func
+        self._merge_functions[name] = merge_jobs
+
+    def has_function(self, name):
+        return name in self._functions
+
+    def _remove(self, entry):
+        entry.valid = False
+        key = (entry.name, entry.jid)
+        if entry.jid is not None and self._queued_ids.get(key) is entry:
+            del self._queued_ids[key]
+        if entry.jid is not None and self._deferred.get(key) is entry:
+            del self._deferred[key]
+
+    def _merged_job(self, entry):
+        if len(entry.jobs) == 1:
+            return entry.job
+        merge_jobs = self._merge_functions.get(entry.name)
+        if merge_jobs is None:
+            return entry.job
+        return merge_jobs(entry.jobs)
+
+    def add(self, name, jid, job, priority=0):
+        """
+        queues a job; call start() to ensure it is processed
+        """
+        with self._condition:
+            metrics = self._get_metrics(name)
+            metrics.queued += 1
+            if jid is not None:
+                old_entry = (
+                    self._queued_ids.get((name, jid)) or
+                    self._deferred.get((name, jid))
+                )
+                if old_entry is not None:
+                    old_entry.jobs.append(job)
+                    metrics.merged += 1
+                    if priority < old_entry.priority:
+                        old_entry.priority = priority
+                        heapq.heapify(self._heap)
+                    return
+
+            entry = _Entry(priority, next(self._seq), name, jid, job)
+            if jid is not None:
+                self._queued_ids[(name, jid)] = entry
+            heapq.heappush(self._heap, entry)
+
+    def _entries(self, name, is_target_job=None):
+        def is_target_entry(entry):
+            return (
+                entry.name == name and
+                (is_target_job is None or
+                 any(is_target_job(job) for job in entry.jobs))
+            )
+        return [
+            entry for entry in self._heap
+            if entry.valid and is_target_entry(entry)
+        ] + [
+            entry for entry in self._deferred.values()
+            if is_target_entry(entry)
+        ]
+
+    def cancel(self, name, is_target_job):
+        """
+        removes all queued jobs for which is_target_job returns True; an
+        entry is kept as long as one of its jobs is not cancelled
+        """
+        with self._condition:
+            cancelled = 0
+            for entry in self._entries(name, is_target_job):
+                jobs = [job for job in entry.jobs if not is_target_job(job)]
+                cancelled += len(entry.jobs) - len(jobs)
+                if jobs:
+                    entry.jobs = jobs
+                else:
+                    self._remove(entry)
+            self._get_metrics(name).cancelled += cancelled
+
+    def has_jobs(self, name, is_target_job=None):
+        with self._condition:
+            return bool(self._entries(name, is_target_job))
+
+    def prioritize(self, name, priority):
+        """
+        sets the priority of the queued jobs to priority(job)
+        """
+        with self._condition:
+            for entry in self._entries(name):
+                entry.priority = min(priority(job) for job in entry.jobs)
+            self._heap = [entry for entry in self._heap if entry.valid]
+            heapq.heapify(self._heap)
+
+    def take(self, name, is_target_job, max_jobs):
+        """
+        removes up to max_jobs of the queued jobs for which is_target_job
+        returns True in the order they would be processed and returns them;
+        if called from a job, they count as running until the job finishes
+        """
+        with self._condition:
+            entries = sorted(
+                entry for entry in self._heap
+                if entry.valid and entry.name == name and
+                (entry.jid is None or
+                 (name, entry.jid) not in self._running_ids) and
+                is_target_job(entry.job)
+            )[:max_jobs]
+
+            taken_ids = getattr(self._local, "taken_ids", None)
+            now = time.time()
+            metrics = self._get_metrics(name)
+            for entry in entries:
+                self._remove(entry)
+                metrics.record_wait(now - entry.queued_time)
+                if entry.jid is not None and taken_ids is not None:
+                    self._running_ids.add((name, entry.jid))
+                    taken_ids.append((name, entry.jid))
+            return [self._merged_job(entry) for entry in entries]
+
+    def start(self):
+        """
+        starts worker threads as needed to process the queued jobs
+        """
+        with self._condition:
+            queued = sum(1 for entry in self._heap if entry.valid)
+            # the idle threads are woken up first
+            self._condition.notify(queued)
+            new_threads = min(
+                self.max_threads - self._threads,
+                queued - self._idle_threads
+            )
+            for _ in range(new_threads):
+                self._threads += 1
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+
+    def _pop(self):
+        # must be called with the condition
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if not entry.valid:
+                continue
+            key = (entry.name, entry.jid)
+            if entry.jid is not None:
+                if key in self._running_ids:
+                    # wait until the running job with the same id finished
+                    self._queued_ids.pop(key, None)
+                    self._deferred[key] = entry
+                    continue
+                self._queued_ids.pop(key, None)
+                self._running_ids.add(key)
+            entry.valid = False
+            return entry
+        return None
+
+    def _finish(self, entry, taken_ids):
+        # must be called with the condition
+        for key in taken_ids + [(entry.name, entry.jid)]:
+            if key[1] is None:
+                continue
+            self._running_ids.discard(key)
+            deferred = self._deferred.pop(key, None)
+            if deferred is not None:
+                self._queued_ids[key] = deferred
+                heapq.heappush(self._heap, deferred)
+
+    def _work(self):
+        self._local.taken_ids = []
+        while True:
+            with self._condition:
+                entry = None
+                while True:
+                    if self._threads > self.max_threads:
+                        break
+                    entry = self._pop()
+                    if entry is not None:
+                        break
+                    self._idle_threads += 1
+                    start_wait = time.time()
+                    self._condition.wait(self.idle_timeout)
+                    self._idle_threads -= 1
+                    if time.time() - start_wait >= self.idle_timeout:
+                        entry = self._pop()
+                        break
+
+                if entry is None:
+                    self._threads -= 1
+                    return
+
+                func = self._functions.get(entry.name)
+                job = self._merged_job(entry)
+                metrics = self._get_metrics(entry.name)
+                start_time = time.time()
+                metrics.record_wait(start_time - entry.queued_time)
+
+            failed = False
+            try:
+                if func is None:
+                    print("Thread function missing for '{0}'".format(
+                        entry.name))
+                    failed = True
+                else:
+                    func(job)
+            except Exception:
+                traceback.print_exc()
+                failed = True
+
+            with self._condition:
+                metrics.record_run(time.time() - start_time)
+                if failed:
+                    metrics.failed += 1
+                else:
+                    metrics.completed += 1
+                self._finish(entry, self._local.taken_ids)
+                self._local.taken_ids = []
+
+    def get_metrics(self):
+        """
+        returns a dict from the name to the metrics of the jobs of that name
+        """
+        with self._condition:
+            result = {}
+            for name, metrics in self._metrics.items():
+                result[name] = {
+                    "queue_depth": len(self._entries(name)),
+                    "running": sum(
+                        1 for n, _ in self._running_ids if n == name),
+                    "queued": metrics.queued,
+                    "completed": metrics.completed,
+                    "failed": metrics.failed,
+                    "cancelled": metrics.cancelled,
+                    "merged": metrics.merged,
+                    "wait_histogram": list(
+                        zip(LATENCY_BUCKETS, metrics.wait_histogram)),
+                    "run_histogram": list(
+                        zip(LATENCY_BUCKETS, metrics.run_histogram))
+                }
+            result["threads"] = self._threads
+            return result
+
+
+_pool = WorkerPool()
 
 
 def set_max_threads(max_threads):
-    global _max_threads
-    if max_threads > 0 and max_threads != _max_threads:
-        _max_threads = max_threads
+    if max_threads > 0:
+        _pool.set_max_threads(max_threads)
 
 
-def has_function(_name):
-    return _name in _thread_functions
+def has_function(name):
+    return _pool.has_function(name)
 
 
-def register_function(name, func):
-    _thread_functions[name] = func
+def register_function(name, func, merge_jobs=None):
+    _pool.register_function(name, func, merge_jobs)
 
 
-def register_temp_folder(name, temp_path):
-    _temp_folder_paths[name] = temp_path
+def merge_continuations(jobs):
+    """
+    merges jobs, which create the same file, into a copy of the newest job,
+    whose continuation "cont" calls the continuations of all jobs
+    """
+    conts = [job["cont"] for job in jobs]
 
+    def cont():
+        for c in conts:
+            c()
 
-def _cancel_jobs(name, is_target_job):
-    try:
-        lock, job_list = _jobs[name]
-    except KeyError:
-        return
-    with lock:
-        delete_jobs = [job for jid, job in job_list if is_target_job(job)]
-        for job in delete_jobs:
-            try:
-                job_list.remove(job)
-            except ValueError:
-                pass
+    job = dict(jobs[-1])
+    job["cont"] = cont
+    return job
 
 
 def cancel_jobs(name, is_target_job):
-    with _jobs_lock:
-        _cancel_jobs(name, is_target_job)
+    _pool.cancel(name, is_target_job)
 
 
-def _extend_jobs(name, extend_job_list):
-    if name not in _jobs:
-        _jobs[name] = (threading.Lock(), [])
-    lock, job_list = _jobs[name]
-    with lock:
-        job_list.extend(extend_job_list)
+def has_jobs(name, is_target_job):
+    return _pool.has_jobs(name, is_target_job)
 
 
-def extend_jobs(name, extend_job_list):
-    with _jobs_lock:
-        _extend_jobs(name, extend_job_list)
+def prioritize_jobs(name, priority):
+    """
+    sets the priority of the queued jobs to priority(job); the jobs with the
+    lowest priority value are processed first
+    """
+    _pool.prioritize(name, priority)
 
 
-def _append_job(name, jid, job):
-    if name not in _jobs:
-        _jobs[name] = (threading.Lock(), [])
-    lock, job_list = _jobs[name]
-    with lock:
-        job_list.append((jid, job))
+def take_jobs(name, is_target_job, max_jobs):
+    """
+    removes up to max_jobs of the queued jobs for which is_target_job
+    returns True and returns them, e.g. to process them together with the
+    current job
+    """
+    return _pool.take(name, is_target_job, max_jobs)
 
 
-def append_job(name, jid, job):
-    with _jobs_lock:
-        _append_job(name, jid, job)
+def extend_jobs(name, extend_job_list, priority=0):
+    for jid, job in extend_job_list:
+        _pool.add(name, jid, job, priority)
 
 
-def _start_threads(name, thread_id):
-    try:
-        func = _thread_functions[name]
-    except KeyError:
-        print("Thread function missing for '{0}'".format(name))
-        return
-    try:
-        lock, job_list = _jobs[name]
-    except KeyError:
-        return
-
-    with _working_sets_lock:
-        if name not in _working_sets:
-            _working_sets[name] = set()
-        working_set = _working_sets[name]
-
-    while True:
-        try:
-            with lock:
-                head = job_list.pop()
-                jid, job = head
-                if jid is not None and jid in working_set:
-                    job_list.append(head)
-                    for i in range(len(job_list)):
-                        jid, job = job_list[i]
-                        if jid not in working_set:
-                            del job_list[i]
-                            break
-                    else:
-                        raise StopIteration()
-
-            with lock:
-                working_set.add(jid)
-            func(job)
-            with lock:
-                working_set.remove(jid)
-        except IndexError:
-            break
-        except StopIteration:
-            break
-        except Exception:
-            traceback.print_exc()
-            break
-        if thread_id >= _max_threads:
-            break
-
-
-def start_threads(name, thread_id):
-    _start_threads(name, thread_id)
-
-    visited = set([name])
-
-    while True:
-        new_name = None
-        for key, (lock, joblist) in _jobs.items():
-            with lock:
-                if joblist:
-                    new_name = key
-                    break
-
-        if not new_name or new_name in visited:
-            break
-
-        if new_name and new_name != name:
-            _start_threads(new_name, thread_id)
-
-    global _thread_num
-    with _thread_num_lock:
-        _thread_num -= 1
-        remaining_threads = _thread_num
-
-    # if all threads have been terminated we can check to delete
-    # the temporary files beyond the size limit
-    if remaining_threads == 0:
-        for v in visited:
-            try:
-                temp_path = _temp_folder_paths[v]
-            except KeyError:
-                continue
-
-            threading.Thread(
-                target=lambda: try_delete_temp_files(name, temp_path))
+def append_job(name, jid, job, priority=0):
+    _pool.add(name, jid, job, priority)
 
 
 def run_jobs(name):
-    global _thread_num, _max_threads
-    thread_id = -1
+    _pool.start()
 
-    with _jobs_lock:
-        try:
-            lock, job_list = _jobs[name]
-        except KeyError:
-            return
-    # we may not need locks for this
-        with lock:
-            rem_len = len(job_list)
-        with _thread_num_lock:
-            before_num = _thread_num
-            after_num = min(_max_threads, rem_len)
-            start_threads_count = after_num - before_num
-            if start_threads_count > 0:
-                _thread_num += start_threads_count
-        for thread_id in range(before_num, after_num):
-            threading.Thread(target=start_threads,
-                             args=(name, thread_id,)).start()
+
+def get_metrics():
+    return _pool.get_metrics()
@@ -1,8 +1,13 @@
+import collections
+import json
 import os
 import re
+import shutil
+import struct
 import threading
 import time
 import traceback
+import zlib
 
 import sublime
 
@@ -249,6 +254,258 @@ def run_ghostscript_command(args, stdout=__sentinel__, stderr=__sentinel__):
     )
 
 
+_MEDIA_BOX_REGEX = re.compile(
+    br"/MediaBox\s*\[\s*([-+\d.]+)\s+([-+\d.]+)\s+([-+\d.]+)\s+([-+\d.]+)"
+)
+_STREAM_REGEX = re.compile(br"stream\r?\n")
+
+
+def get_pdf_media_box(pdf_path):
+    """
+    Return the media box of the first page of a pdf file as a tuple
+    (ll_x, ll_y, ur_x, ur_y) in pt or None if it cannot be determined.
+
+    This reads the pdf without running any external program. If the page
+    is stored in a compressed object stream, the streams are decompressed
+    until a media box is found.
+    """
+    try:
+        with open(pdf_path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    m = _MEDIA_BOX_REGEX.search(data)
+    if m is None:
+        for stream_match in _STREAM_REGEX.finditer(data):
+            start = stream_match.end()
+            end = data.find(b"endstream", start)
+            if end == -1:
+                break
+            try:
+                stream = zlib.decompressobj().decompress(data[start:end])
+            except zlib.error:
+                continue
+            m = _MEDIA_BOX_REGEX.search(stream)
+            if m is not None:
+                break
+
+    if m is None:
+        return None
+
+    try:
+        return tuple(float(x) for x in m.groups())
+    except ValueError:
+        return None
+
+
+# the number of bytes read from the start and the end of a pdf or eps file
+# to find its size before the whole file is read
+_HEAD_TAIL_SIZE = 1024
+_BOUNDING_BOX_REGEX = re.compile(
+    br"%%(?:HiRes)?BoundingBox:\s*([-+\d.]+)\s+([-+\d.]+)\s+([-+\d.]+)"
+    br"\s+([-+\d.]+)"
+)
+_DOS_EPS_MAGIC = b"\xc5\xd0\xd3\xc6"
+
+
+def _read_head_tail(f, offset=0, length=None):
+    f.seek(0, os.SEEK_END)
+    end = f.tell() if length is None else min(offset + length, f.tell())
+    f.seek(offset)
+    head = f.read(min(_HEAD_TAIL_SIZE, end - offset))
+    tail_start = max(end - _HEAD_TAIL_SIZE, offset + len(head))
+    f.seek(tail_start)
+    tail = f.read(end - tail_start)
+    return head, tail
+
+
+def _box_size(m):
+    try:
+        ll_x, ll_y, ur_x, ur_y = (float(x) for x in m.groups())
+    except ValueError:
+        return None
+    return ur_x - ll_x, ur_y - ll_y
+
+
+def _read_png_size(f, head):
+    if head[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", head[16:24])
+
+
+def _read_gif_size(f, head):
+    return struct.unpack("<HH", head[6:10])
+
+
+def _read_jpeg_size(f, head):
+    # skip the segments until we are at a SOFn segment
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) != 2 or marker[0] != 0xff:
+            return None
+        ftype = marker[1]
+        if ftype == 0xff:
+            # padding
+            f.seek(-1, os.SEEK_CUR)
+            continue
+        if 0xc0 <= ftype <= 0xcf and ftype not in (0xc4, 0xc8, 0xcc):
+            break
+        size = struct.unpack(">H", f.read(2))[0]
+        f.seek(size - 2, os.SEEK_CUR)
+    # skip the size and the precision
+    f.seek(3, os.SEEK_CUR)
+    height, width = struct.unpack(">HH", f.read(4))
+    return width, height
+
+
+def _read_pdf_size(f, head):
+    for data in _read_head_tail(f):
+        m = _MEDIA_BOX_REGEX.search(data)
+        if m is not None:
+            return _box_size(m)
+    # the page may be in a compressed object stream
+    media_box = get_pdf_media_box(f.name)
+    if media_box is None:
+        return None
+    ll_x, ll_y, ur_x, ur_y = media_box
+    return ur_x - ll_x, ur_y - ll_y
+
+
+def _read_eps_size(f, head):
+    offset = length = None
+    if head.startswith(_DOS_EPS_MAGIC):
+        # a binary header points to the postscript section
+        offset, length = struct.unpack("<II", head[4:12])
+    for data in _read_head_tail(f, offset or 0, length):
+        # the first bounding box may be "(atend)"
+        m = _BOUNDING_BOX_REGEX.search(data)
+        if m is not None:
+            return _box_size(m)
+    return None
+
+
+def _read_image_size(image_path):
+    with open(image_path, "rb") as f:
+        head = f.read(32)
+        if head.startswith(b"\x89PNG\r\n\x1a\n"):
+            read_size = _read_png_size
+        elif head[:6] in (b"GIF87a", b"GIF89a"):
+            read_size = _read_gif_size
+        elif head.startswith(b"\xff\xd8"):
+            read_size = _read_jpeg_size
+        elif head.startswith(b"%PDF"):
+            read_size = _read_pdf_size
+        elif head.startswith(b"%!PS") or head.startswith(_DOS_EPS_MAGIC):
+            read_size = _read_eps_size
+        else:
+            return None
+        try:
+            return read_size(f, head)
+        except (struct.error, OSError):
+            return None
+
+
+class _ImageSizeCache(object):
+    """
+    The sizes of the images keyed by their path, modification time and
+    size, so a changed image is read again.
+
+    The sizes are stored in the global cache, so they survive restarts.
+    New sizes are saved after a delay, so reading several images only
+    writes the cache once.
+    """
+
+    _CACHE_KEY = "preview_image_sizes"
+    _MAX_ENTRIES = 2000
+    # the delay in seconds before new sizes are saved
+    _SAVE_DELAY = 5
+
+    def __init__(self):
+        self._entries = None
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._save_timer = None
+
+    def _load(self):
+        # must be called with the lock
+        self._entries = collections.OrderedDict()
+        try:
+            entries = cache.read_global(self._CACHE_KEY)
+        except cache.CacheMiss:
+            return
+        except Exception:
+            traceback.print_exc()
+            return
+        for key, value in entries:
+            self._entries[tuple(key)] = value
+
+    def get(self, image_path):
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        key = (image_path, stat.st_mtime, stat.st_size)
+
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            try:
+                return self._entries[key]
+            except KeyError:
+                pass
+
+        try:
+            size = _read_image_size(image_path)
+        except OSError:
+            return None
+
+        with self._lock:
+            self._entries[key] = size
+            while len(self._entries) > self._MAX_ENTRIES:
+                self._entries.popitem(last=False)
+            self._dirty = True
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(
+                    self._SAVE_DELAY, self.save)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+        return size
+
+    def save(self):
+        """Write the new sizes to the global cache"""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if not self._dirty:
+                return
+            self._dirty = False
+            entries = list(self._entries.items())
+        cache.write_global(self._CACHE_KEY, entries)
+
+
+_image_size_cache = _ImageSizeCache()
+
+
+def get_image_size(image_path):
+    """
+    Return the size of a png, jpeg, gif, pdf or eps file as a tuple
+    (width, height) or None if it cannot be determined. The size of pdf
+    and eps files is in pt, the size of the other images in px.
+
+    Only the header of the image is read and the size is cached until the
+    image changes.
+    """
+    return _image_size_cache.get(image_path)
+
+
+def save_image_sizes():
+    """Write the pending sizes of get_image_size() to the global cache"""
+    _image_size_cache.save()
+
+
 class SettingsListener(object):
     """
     Required class attributes:
@@ -310,77 +567,367 @@ class SettingsListener(object):
             break
 
 
-_last_delete_try = {}
+def _modified_time(file_path):
+    try:
+        mtime = os.path.getmtime(file_path)
+    except:
+        mtime = 0
+    return mtime
+
+
+_INDEX_FILE_NAME = "index.json"
+_INDEX_VERSION = 1
 
 
-def try_delete_temp_files(key, temp_path):
-    try:
-        last_try = _last_delete_try[key]
-    except KeyError:
+class TempFileIndex(object):
+    """
+    An index of the files in the temporary folder of a preview with their
+    size and the time they were last used.
+
+    The files are recorded when they are created and used, so the least
+    recently used files can be deleted as soon as the folder exceeds its
+    maximal size without listing the folder. The folder is only listed
+    once to build the index if there is none yet.
+    """
+
+    # the delay in seconds before the changes of the index are saved
+    _SAVE_DELAY = 5
+
+    def __init__(self, temp_path):
+        self.temp_path = temp_path
+        self.index_path = os.path.join(temp_path, _INDEX_FILE_NAME)
+        # the maximal size of the folder in bytes; None for no limit
+        self.max_size = None
+
+        # file name -> [size, last access time], least recently used first
+        self._entries = collections.OrderedDict()
+        self._total_size = 0
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._save_timer = None
+
+        self._load()
+
+    def _load(self):
         try:
-            last_try = cache.read_global("preview_image_temp_delete")
-        except:
-            last_try = 0
-        _last_delete_try[key] = last_try
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data["version"] != _INDEX_VERSION:
+                raise ValueError("outdated index")
+            entries = data["entries"]
+        except (OSError, ValueError, KeyError, TypeError):
+            entries = None
+
+        if entries is None:
+            entries = self._scan()
+            self._schedule_save()
+
+        for file_name, size, last_access in sorted(
+                entries, key=lambda entry: entry[2]):
+            self._entries[file_name] = [size, last_access]
+            self._total_size += size
+
+    def _scan(self):
+        entries = []
+        try:
+            file_names = os.listdir(self.temp_path)
+        except OSError:
+            return entries
 
-    max_remaining_size = get_setting(key + "_temp_size", 50, view={})
-    period = get_setting("preview_temp_delete_period", 24, view={})
+        for file_name in file_names:
+            if file_name.startswith(_INDEX_FILE_NAME):
+                continue
+            file_path = os.path.join(self.temp_path, file_name)
+            if not os.path.isfile(file_path):
+                continue
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            entries.append([file_name, stat.st_size, stat.st_mtime])
+        return entries
+
+    @property
+    def total_size(self):
+        return self._total_size
+
+    def set_max_size(self, max_size):
+        """Set the maximal size of the folder in bytes or None for no limit"""
+        with self._lock:
+            self.max_size = max_size
+            self._evict()
+
+    def add(self, file_name):
+        """
+        Record a file created in the temporary folder and delete the least
+        recently used files if the folder exceeds the maximal size.
+        """
+        try:
+            size = os.path.getsize(os.path.join(self.temp_path, file_name))
+        except OSError:
+            return
 
-    # if the period is negative don't clear automatically
-    if period < 0:
-        return
+        with self._lock:
+            entry = self._entries.pop(file_name, None)
+            if entry is not None:
+                self._total_size -= entry[0]
+            self._entries[file_name] = [size, time.time()]
+            self._total_size += size
+            self._evict(keep=file_name)
+        self._schedule_save()
+
+    def touch(self, file_name):
+        """Record the usage of a file in the temporary folder"""
+        with self._lock:
+            entry = self._entries.get(file_name)
+            if entry is not None:
+                entry[1] = time.time()
+                self._entries.move_to_end(file_name)
+        if entry is None:
+            self.add(file_name)
+        else:
+            self._schedule_save()
+
+    def _evict(self, keep=None):
+        if self.max_size is None:
+            return
 
-    # convert the units
-    max_remaining_size *= 10**6  # MB -> B
-    period *= 60 * 60  # h -> s
+        deleted = False
+        for file_name in list(self._entries.keys()):
+            if self._total_size <= self.max_size:
+                break
+            if file_name == keep:
+                continue
+            size, _ = self._entries.pop(file_name)
+            self._total_size -= size
+            deleted = True
+            try:
+                os.remove(os.path.join(self.temp_path, file_name))
+            except OSError:
+                pass
+
+        if deleted:
+            self._schedule_save()
+
+    def _schedule_save(self):
+        with self._lock:
+            if self._save_timer is not None:
+                return
+            self._save_timer = threading.Timer(self._SAVE_DELAY, self.save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def save(self):
+        """Write the index to the temporary folder"""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            data = {
+                "version": _INDEX_VERSION,
+                "entries": [
+                    [file_name, size, last_access]
+                    for file_name, (size, last_access)
+                    in self._entries.items()
+                ]
+            }
+
+        # write to a temporary file first, so the index is never left
+        # half written
+        temp_index_path = self.index_path + ".tmp"
+        with self._save_lock:
+            try:
+                with open(temp_index_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+                os.replace(temp_index_path, self.index_path)
+            except OSError:
+                traceback.print_exc()
 
-    # the remaining size as tenth of the cache size
-    max_remaining_size /= 10.
 
-    if time.time() <= last_try + period:
-        return
-    cache.write_global(key + "_temp_delete", last_try)
+_MANIFEST_FILE_NAME = "manifest.json"
+_MANIFEST_VERSION = 1
 
-    tr = threading.Thread(
-        target=lambda: delete_temp_files(temp_path, max_remaining_size))
-    tr.start()
 
+class SharedCache(object):
+    """
+    A folder, e.g. on a network share, in which the previews of several
+    machines are stored to be reused by each other.
 
-def _temp_folder_size(temp_path):
-    size = 0
-    for file_name in os.listdir(temp_path):
-        file_path = os.path.join(temp_path, file_name)
-        if os.path.isfile(file_path):
-            size += os.path.getsize(file_path)
-    return size
+    The folder contains a manifest, which lists the files with their size.
+    Only the files listed in the manifest are used, so files, which are
+    still copied or have been copied by something else, are ignored. Each
+    file is written to a temporary name first and then renamed, hence a
+    file is never read half written.
 
+    If writable is False, the folder is only read.
+    """
 
-def _modified_time(file_path):
-    try:
-        mtime = os.path.getmtime(file_path)
-    except:
-        mtime = 0
-    return mtime
+    # the minimal delay in seconds between checking the manifest for
+    # changes and between writing it
+    _RELOAD_DELAY = 10
+    _SAVE_DELAY = 5
+
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.writable = writable
+        self.manifest_path = os.path.join(path, _MANIFEST_FILE_NAME)
+
+        # file name -> size
+        self._entries = {}
+        self._manifest_mtime = None
+        self._last_reload = 0
+        # the files published since the manifest has been written
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._save_timer = None
+
+    def _reload(self):
+        # must be called with the lock
+        now = time.time()
+        if now - self._last_reload < self._RELOAD_DELAY:
+            return
+        self._last_reload = now
+
+        mtime = _modified_time(self.manifest_path)
+        if mtime == self._manifest_mtime:
+            return
+        self._manifest_mtime = mtime
+        self._entries = self._read_manifest()
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data["version"] != _MANIFEST_VERSION:
+                return {}
+            return dict(data["entries"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return {}
+
+    def lookup(self, file_name):
+        """
+        Return the path of the file in the shared folder or None if it is
+        not listed in the manifest or has a different size.
+        """
+        with self._lock:
+            self._reload()
+            size = self._entries.get(file_name)
+        if size is None:
+            return None
+
+        file_path = os.path.join(self.path, file_name)
+        try:
+            if os.path.getsize(file_path) != size:
+                return None
+        except OSError:
+            return None
+        return file_path
+
+    def fetch(self, file_name, target_path):
+        """
+        Copy the file from the shared folder to target_path and return True
+        if it is listed in the manifest.
+        """
+        source_path = self.lookup(file_name)
+        if source_path is None:
+            return False
+
+        temp_target_path = "{0}.{1}.tmp".format(target_path, os.getpid())
+        try:
+            shutil.copyfile(source_path, temp_target_path)
+            os.replace(temp_target_path, target_path)
+        except OSError:
+            try:
+                os.remove(temp_target_path)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def publish(self, source_path, file_name):
+        """
+        Copy the file at source_path into the shared folder (if it is
+        writable) and add it to the manifest.
+        """
+        if not self.writable:
+            return
+
+        target_path = os.path.join(self.path, file_name)
+        temp_target_path = "{0}.{1}.tmp".format(target_path, os.getpid())
+        try:
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+            shutil.copyfile(source_path, temp_target_path)
+            os.replace(temp_target_path, target_path)
+            size = os.path.getsize(target_path)
+        except OSError:
+            traceback.print_exc()
+            return
+
+        with self._lock:
+            self._entries[file_name] = size
+            self._pending[file_name] = size
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(
+                    self._SAVE_DELAY, self.save)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def save(self):
+        """Add the published files to the manifest"""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if not self._pending:
+                return
+
+            # merge with the manifest, as other machines may have written
+            # it in the meantime
+            entries = self._read_manifest()
+            entries.update(self._pending)
+            data = {
+                "version": _MANIFEST_VERSION,
+                "entries": entries
+            }
+
+            temp_manifest_path = "{0}.{1}.tmp".format(
+                self.manifest_path, os.getpid())
+            try:
+                with open(temp_manifest_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+                os.replace(temp_manifest_path, self.manifest_path)
+            except OSError:
+                traceback.print_exc()
+                return
 
+            self._pending = {}
+            self._entries = entries
+            self._manifest_mtime = _modified_time(self.manifest_path)
+
+
+def get_shared_cache(key):
+    """
+    Return the SharedCache of the preview key or None if no shared cache
+    folder is set.
+    """
+    path = get_setting(key + "_shared_cache_path", "", view={})
+    if not path:
+        return None
+    path = os.path.normpath(os.path.expanduser(path))
+    writable = get_setting(key + "_shared_cache_write", False, view={})
+    return SharedCache(path, writable)
+
+
+def get_temp_size_limit(key):
+    """
+    Return the maximal size of the temporary folder of the preview key in
+    bytes or None if the files should not be deleted automatically.
+    """
+    period = get_setting("preview_temp_delete_period", 24, view={})
+    # if the period is negative don't delete automatically
+    if period < 0:
+        return None
 
-def delete_temp_files(temp_path, max_remaining_size, total_size=None,
-                      delete_all=False):
-    if total_size is None and not delete_all:
-        total_size = _temp_folder_size(temp_path)
-    if total_size <= max_remaining_size:
-        return
-
-    del_files = [
-        os.path.join(temp_path, file_name)
-        for file_name in os.listdir(temp_path)
-    ]
-    # sort the delete files by their modification time
-    del_files.sort(key=_modified_time, reverse=True)
-
-    # delete the files until the max boundary is reached
-    # oldest files first
-    while del_files and (delete_all or total_size > max_remaining_size):
-        file_path = del_files.pop()
-        if os.path.isfile(file_path):
-            total_size -= os.path.getsize(file_path)
-            os.remove(file_path)
+    max_size = get_setting(key + "_temp_size", 50, view={})
+    return max_size * 10**6  # MB -> B